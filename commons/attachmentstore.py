@@ -0,0 +1,98 @@
+from __future__ import annotations
+from typing import Dict, Optional
+
+from pathlib import Path
+import os
+import json
+import threading
+from hashlib import sha1
+
+
+class AttachmentStore:
+    """
+    转存文件夹中按内容寻址的附件存储。
+
+    附件以 A 岛的 `img` 与 `ext` 拼成的路径（如 `2020-08-15/5f37b8c1a2b3c.jpg`）为键，
+    内容存为 `attachments/objects/<sha256 前两位>/<sha256><ext>`，
+    相同内容的附件只会存储一份。
+    `attachments/index.json` 记录了各键对应的内容文件。
+    """
+
+    FOLDER_NAME = "attachments"
+    INDEX_FILE_NAME = "index.json"
+
+    def __init__(self, dump_folder_path: Path, index: Dict[str, str]):
+        self.dump_folder_path = dump_folder_path
+        self.__index = index
+        # 改动内容文件与索引需要在持有此锁时进行
+        self.lock = threading.RLock()
+
+    @property
+    def folder_path(self) -> Path:
+        return self.dump_folder_path / AttachmentStore.FOLDER_NAME
+
+    @property
+    def partial_folder_path(self) -> Path:
+        """尚未下载完成的附件所在的文件夹。"""
+        return self.folder_path / "partial"
+
+    @staticmethod
+    def load(dump_folder_path: Path) -> AttachmentStore:
+        index_file_path = dump_folder_path / \
+            AttachmentStore.FOLDER_NAME / AttachmentStore.INDEX_FILE_NAME
+        try:
+            with open(index_file_path) as index_file:
+                index = json.load(index_file)
+        except FileNotFoundError:
+            index = {}
+        return AttachmentStore(dump_folder_path, index)
+
+    @staticmethod
+    def key(adnmb_img: str, adnmb_ext: str) -> str:
+        return f"{adnmb_img}{adnmb_ext}"
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__index
+
+    def __len__(self) -> int:
+        return len(self.__index)
+
+    def object_path(self, object_name: str) -> Path:
+        return self.folder_path / "objects" / object_name[:2] / object_name
+
+    def get_object_path(self, key: str) -> Optional[Path]:
+        """
+        获取某个附件的内容文件的路径。如果尚未存储，返回空。
+        """
+        object_name = self.__index.get(key, None)
+        if object_name == None:
+            return None
+        return self.object_path(object_name)
+
+    def partial_path(self, key: str) -> Path:
+        return self.partial_folder_path / f"{sha1(key.encode('utf-8')).hexdigest()}.part"
+
+    def add(self, key: str, file_path: Path, sha256: str):
+        """
+        将下载完成的文件移入存储。
+        如果已有相同内容的文件，则直接删除该文件。
+        """
+        object_name = sha256 + os.path.splitext(key)[1]
+        object_path = self.object_path(object_name)
+        with self.lock:
+            if object_path.exists():
+                os.remove(file_path)
+            else:
+                object_path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(file_path, object_path)
+            self.__index[key] = object_name
+
+    def save(self):
+        with self.lock:
+            self.folder_path.mkdir(parents=True, exist_ok=True)
+            tmp_file_path = self.folder_path / \
+                f"_{AttachmentStore.INDEX_FILE_NAME}"
+            with open(tmp_file_path, "w+") as index_file:
+                json.dump(self.__index, index_file, indent=2, sort_keys=True)
+            os.replace(tmp_file_path,
+                       self.folder_path / AttachmentStore.INDEX_FILE_NAME)
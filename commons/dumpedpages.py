@@ -1,11 +1,15 @@
 from __future__ import annotations
-from typing import Tuple, List, Optional
+from typing import Tuple, List, Optional, Dict, Any
 from dataclasses import dataclass
 from enum import Enum, auto
 
 import logging
 from pathlib import Path
 from os.path import splitext
+import os
+import json
+import shutil
+import threading
 
 
 @dataclass
@@ -38,30 +42,268 @@ class PageInfo:
     number: int
     status: "PageInfo.Status"
 
+    # 以下信息来自页面清单，从文件夹中直接列出页面时可能为空
+    first_post_id: Optional[int] = None
+    last_post_id: Optional[int] = None
+    reply_count: Optional[int] = None
+
     def filename(self):
         return f'{self.number}{self.status.as_sub_ext()}.json'
 
+    def as_obj(self) -> Dict[str, Any]:
+        return {
+            "number": self.number,
+            "status": self.status.name,
+            "first_post_id": self.first_post_id,
+            "last_post_id": self.last_post_id,
+            "reply_count": self.reply_count,
+        }
+
+    @staticmethod
+    def load_from_obj(obj: Dict[str, Any]) -> PageInfo:
+        return PageInfo(
+            number=obj["number"],
+            status=PageInfo.Status[obj["status"]],
+            first_post_id=obj.get("first_post_id", None),
+            last_post_id=obj.get("last_post_id", None),
+            reply_count=obj.get("reply_count", None),
+        )
+
+    @staticmethod
+    def from_replies(number: int, status: PageInfo.Status, replies: List[Dict[str, Any]]) -> PageInfo:
+        return PageInfo(
+            number=number,
+            status=status,
+            first_post_id=int(replies[0]["id"]) if len(replies) > 0 else None,
+            last_post_id=int(replies[-1]["id"]) if len(replies) > 0 else None,
+            reply_count=len(replies),
+        )
+
+
+class PageManifest:
+    """
+    转存文件夹的页面清单。
+
+    记录各页的页数、状态、首末串号与回应数，
+    以免每次都要逐页读取页面文件。
+
+    清单由转存程序在每轮提交页面时一并更新。
+    清单中还记录了各页文件当时的大小与修改时间，
+    读取清单时会列出 `pages` 文件夹逐页核对，
+    只有被其他程序改动过或清单中没有的页面才需要重新检查。
+    """
+
+    FILE_NAME = "manifest.json"
+    VERSION = 2
+
+    def __init__(
+        self, dump_folder_path: Path, page_infos: Dict[int, PageInfo],
+        page_file_stats: Optional[Dict[int, Tuple[int, int]]] = None,
+    ):
+        self.dump_folder_path = dump_folder_path
+        self.__page_infos = page_infos
+        # 页数 -> 记录时页面文件的 (大小, 修改时间)
+        self.__page_file_stats = page_file_stats or {}
+        # 改动页面文件与更新清单需要在持有此锁时一同进行
+        self.lock = threading.RLock()
+
+    @property
+    def file_path(self) -> Path:
+        return self.dump_folder_path / PageManifest.FILE_NAME
 
-def get_page_info_list(dump_folder_path: Path) -> Tuple[List[PageInfo], str]:
-    # 123.previous-page-unchecked.json
-    # 456.incomplete.json
-    page_infos = {}
-    for page_path in (dump_folder_path / "pages").iterdir():
-        page_name = splitext(page_path.name)[0]
-        page_status = None
+    @property
+    def pages_folder_path(self) -> Path:
+        return self.dump_folder_path / "pages"
+
+    @staticmethod
+    def load(dump_folder_path: Path, examines_pages: bool = False) -> Optional[PageManifest]:
+        """
+        读取页面清单，并逐页核对 `pages` 文件夹中的页面文件。
+
+        大小或修改时间与清单记录不符的页面，以及清单中没有的页面，
+        会像 `rebuild` 那样重新检查；清单中有但文件已不存在的页面会被去掉。
+        如果清单不存在或版本不符，返回空。
+        """
+        manifest_file_path = dump_folder_path / PageManifest.FILE_NAME
         try:
-            page_number = int(page_name)
-        except ValueError:
-            (page_number, page_status) = splitext(page_name)
-            page_number = int(page_number)
-        if page_number in page_infos:
-            logging.critical(f"页面 {page_name} 存在多种状态版本，无法判断，将中断")
-            raise KeyError(page_name)
-        page_infos[page_number] = page_status
-    page_infos = map(lambda kv: PageInfo(
-        kv[0], PageInfo.Status.from_sub_ext(kv[1])), page_infos.items())
-    page_infos = sorted(page_infos, key=lambda x: x.number)
-    return page_infos
+            with open(manifest_file_path) as manifest_file:
+                obj = json.load(manifest_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if obj.get("version", None) != PageManifest.VERSION:
+            return None
+
+        recorded_pages = {}
+        for page_obj in obj["pages"]:
+            page_info = PageInfo.load_from_obj(page_obj)
+            recorded_pages[page_info.filename()] = (
+                page_info, (page_obj["size"], page_obj["mtime_ns"]))
+        return PageManifest.__scan(dump_folder_path, recorded_pages, examines_pages)
+
+    @staticmethod
+    def rebuild(dump_folder_path: Path, examines_pages: bool = False) -> PageManifest:
+        """
+        列出 `pages` 文件夹来重建页面清单。
+
+        Parameters
+        ----------
+        examines_pages : bool
+            是否读取各页来获取首末串号与回应数。
+            如果为假，清单中只有页数与状态。
+        """
+        return PageManifest.__scan(dump_folder_path, {}, examines_pages)
+
+    @staticmethod
+    def __scan(
+        dump_folder_path: Path, recorded_pages: Dict[str, Tuple[PageInfo, Tuple[int, int]]],
+        examines_pages: bool,
+    ) -> PageManifest:
+        """
+        列出 `pages` 文件夹，文件名、大小与修改时间都与 `recorded_pages` 中记录的一致时沿用记录。
+        """
+
+        # 123.previous-page-unchecked.json
+        # 456.incomplete.json
+        page_infos = {}
+        page_file_stats = {}
+        changed_page_count = 0
+        for entry in os.scandir(dump_folder_path / "pages"):
+            page_name = splitext(entry.name)[0]
+            page_status = None
+            try:
+                page_number = int(page_name)
+            except ValueError:
+                (page_number, page_status) = splitext(page_name)
+                page_number = int(page_number)
+            if page_number in page_infos:
+                logging.critical(f"页面 {page_name} 存在多种状态版本，无法判断，将中断")
+                raise KeyError(page_name)
+
+            stat = entry.stat()
+            page_file_stat = (stat.st_size, stat.st_mtime_ns)
+            (page_info, recorded_stat) = recorded_pages.get(
+                entry.name, (None, None))
+            if page_info == None or recorded_stat != page_file_stat:
+                changed_page_count += 1
+                page_info = PageInfo(
+                    page_number, PageInfo.Status.from_sub_ext(page_status))
+            if examines_pages and page_info.reply_count == None:
+                with open(entry.path) as page_file:
+                    replies = json.load(page_file)
+                page_info = PageInfo.from_replies(
+                    page_number, page_info.status, replies)
+
+            page_infos[page_number] = page_info
+            page_file_stats[page_number] = page_file_stat
+
+        if len(recorded_pages) > 0 and (changed_page_count > 0 or len(recorded_pages) != len(page_infos)):
+            logging.info(f"页面清单与页面文件夹不一致，已重新检查{changed_page_count}页")
+
+        return PageManifest(
+            dump_folder_path=dump_folder_path,
+            page_infos=page_infos,
+            page_file_stats=page_file_stats,
+        )
+
+    @staticmethod
+    def load_or_rebuild(dump_folder_path: Path, examines_pages: bool = False) -> PageManifest:
+        manifest = PageManifest.load(
+            dump_folder_path, examines_pages=examines_pages)
+        if manifest == None:
+            manifest = PageManifest.rebuild(
+                dump_folder_path, examines_pages=examines_pages)
+        return manifest
+
+    def page_info_list(self) -> List[PageInfo]:
+        return sorted(self.__page_infos.values(), key=lambda x: x.number)
+
+    def get(self, page_number: int) -> Optional[PageInfo]:
+        return self.__page_infos.get(page_number, None)
+
+    def update(self, page_info: PageInfo):
+        self.__page_infos[page_info.number] = page_info
+
+    def __page_obj_of(self, page_info: PageInfo) -> Dict[str, Any]:
+        (size, mtime_ns) = self.__page_file_stat_of(page_info)
+        return dict(page_info.as_obj(), size=size, mtime_ns=mtime_ns)
+
+    def __page_file_stat_of(self, page_info: PageInfo) -> Tuple[int, int]:
+        page_file_stat = self.__page_file_stats.get(page_info.number, None)
+        if page_file_stat == None:
+            stat = os.stat(self.pages_folder_path / page_info.filename())
+            page_file_stat = (stat.st_size, stat.st_mtime_ns)
+            self.__page_file_stats[page_info.number] = page_file_stat
+        return page_file_stat
+
+    def close(self):
+        """
+        与打包格式的页面存储接口一致。原格式没有需要释放的资源。
+        """
+        pass
+
+    def read_page_replies(self, page_info: PageInfo) -> List[Dict[str, Any]]:
+        with open(self.pages_folder_path / page_info.filename()) as page_file:
+            return json.load(page_file)
+
+    @staticmethod
+    def encode_page(replies: List[Dict[str, Any]]) -> bytes:
+        return json.dumps(replies, indent=2, ensure_ascii=False).encode("utf-8")
+
+    def commit_staged_pages(self, staging_folder_path: Path, page_infos: List[PageInfo]):
+        """
+        用暂存文件夹中的页面替换 `pages` 文件夹中对应的页面，并更新页面清单。
+        """
+        with self.lock:
+            for page_info in page_infos:
+                previous_page_info = self.get(page_info.number)
+                current_name = page_info.filename()
+                if previous_page_info != None:
+                    previous_name = previous_page_info.filename()
+                    previous_page_path = self.pages_folder_path / previous_name
+                    tmp_path = self.pages_folder_path / f"_{previous_name}"
+                    shutil.move(previous_page_path, tmp_path)
+
+                os.replace(staging_folder_path / current_name,
+                           self.pages_folder_path / current_name)
+                self.__page_file_stats.pop(page_info.number, None)
+
+                if previous_page_info != None:
+                    os.remove(tmp_path)
+
+                self.update(page_info)
+            self.save()
+
+    def save(self):
+        """
+        保存页面清单。
+        应在改动完页面文件后、释放 `lock` 前调用，以记录正确的大小与修改时间。
+        """
+        with self.lock:
+            obj = {
+                "version": PageManifest.VERSION,
+                "pages": list(map(self.__page_obj_of, self.page_info_list())),
+            }
+            tmp_file_path = self.dump_folder_path / \
+                f"_{PageManifest.FILE_NAME}"
+            with open(tmp_file_path, "w+") as manifest_file:
+                json.dump(obj, manifest_file)
+            os.replace(tmp_file_path, self.file_path)
+
+
+def get_page_info_list(dump_folder_path: Path) -> List[PageInfo]:
+    """
+    获取转存文件夹中各页的信息。
+
+    优先读取页面清单，清单不存在或已过期时才列出 `pages` 文件夹。
+    打包格式的转存文件夹则读取其索引。
+    """
+    # `packeddump` 依赖本模块，因此在此处引入
+    from packeddump import PackedPageStore
+    if PackedPageStore.exists(dump_folder_path):
+        with PackedPageStore.open(dump_folder_path, read_only=True) as store:
+            return store.page_info_list()
+    return PageManifest.load_or_rebuild(dump_folder_path).page_info_list()
 
 
 def get_processable_page_info_list(dump_folder_path: Path) -> Tuple[List[PageInfo], str]:
@@ -133,7 +375,16 @@ def get_page_ranges_for_dumping(
     return merged_ranges
 
 
-def get_page_name_and_status(pages_folder_path: Path, page_number: int) -> Optional[str, PageInfo.Status]:
+def get_page_name_and_status(
+    pages_folder_path: Path, page_number: int,
+    manifest: Optional[PageManifest] = None,
+) -> Optional[str, PageInfo.Status]:
+    if manifest != None:
+        page_info = manifest.get(page_number)
+        if page_info == None:
+            return (None, None)
+        return (page_info.filename(), page_info.status)
+
     for (name, status) in [
         (f"{page_number}.json", PageInfo.Status.COMPLETE),
         (f"{page_number}.incomplete.json", PageInfo.Status.INCOMPLETE),
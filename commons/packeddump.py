@@ -0,0 +1,481 @@
+from __future__ import annotations
+from typing import List, Dict, Any, Optional, Tuple, Union, IO, Iterable
+from dataclasses import dataclass
+
+import logging
+from pathlib import Path
+from bisect import bisect_right
+import io
+import os
+import json
+import mmap
+import struct
+import shutil
+import threading
+import zlib
+
+from dumpedpages import PageInfo, PageManifest
+
+
+@dataclass(frozen=True)
+class PackedRecordLocation:
+    segment_number: int
+    offset: int
+    length: int
+
+
+class PackedPageStore:
+    """
+    打包格式的页面存储。
+
+    各页以紧凑的 JSON 记录依次追加到 `packed` 文件夹下的分段文件中，
+    同一页的新记录会取代旧记录。
+    `index.json` 记录了各页最新记录的位置，以及首末串号与回应数，
+    因此可以按页数或串号直接定位到记录，读取时通过 mmap 完成。
+
+    每条记录的格式为：
+    `b"PG"`、状态（u8）、页数（u32）、内容长度（u32）、内容的 CRC32（u32），之后为内容。
+
+    追加记录后才会更新索引，因此如果程序中途退出，
+    之后打开时会从索引记录的分段大小开始扫描并补全索引，
+    末尾不完整的记录会被截去。
+
+    转存进行中也可能有其他程序读取，末尾不完整的记录可能正在写入，
+    因此读取方应以只读方式打开：只在内存中补全索引，不截去分段文件，也不保存索引。
+    """
+
+    FOLDER_NAME = "packed"
+    INDEX_FILE_NAME = "index.json"
+    VERSION = 1
+
+    RECORD_MAGIC = b"PG"
+    RECORD_HEADER = struct.Struct("<2sBIII")
+    SEGMENT_MAX_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, dump_folder_path: Path, read_only: bool = False):
+        self.dump_folder_path = dump_folder_path
+        self.read_only = read_only
+        self.__segment_sizes: List[int] = []
+        self.__page_infos: Dict[int, PageInfo] = {}
+        self.__locations: Dict[int, PackedRecordLocation] = {}
+        self.__mmaps: Dict[int, mmap.mmap] = {}
+        # 按首串号排序的 (首串号, 页数)，用于按串号定位页面
+        self.__post_id_index: Optional[List[Tuple[int, int]]] = None
+        # 追加记录与更新索引需要在持有此锁时一同进行
+        self.lock = threading.RLock()
+
+    @property
+    def folder_path(self) -> Path:
+        return self.dump_folder_path / PackedPageStore.FOLDER_NAME
+
+    @property
+    def index_file_path(self) -> Path:
+        return self.folder_path / PackedPageStore.INDEX_FILE_NAME
+
+    def segment_path(self, segment_number: int) -> Path:
+        return self.folder_path / f"segment-{segment_number:06d}.dat"
+
+    @staticmethod
+    def exists(dump_folder_path: Path) -> bool:
+        return (dump_folder_path / PackedPageStore.FOLDER_NAME).is_dir()
+
+    @staticmethod
+    def create(dump_folder_path: Path) -> PackedPageStore:
+        store = PackedPageStore(dump_folder_path)
+        store.folder_path.mkdir(parents=True)
+        store.save()
+        return store
+
+    @staticmethod
+    def open(dump_folder_path: Path, read_only: bool = False) -> PackedPageStore:
+        """
+        打开打包格式的页面存储。
+
+        如果索引不存在、版本不符或落后于分段文件，则扫描分段文件来补全索引；
+        如果索引记录的分段比实际的更长或更多，说明索引已过时，将扫描分段文件重建。
+        以只读方式打开时，只在内存中补全索引。
+        """
+        store = PackedPageStore(dump_folder_path, read_only=read_only)
+
+        obj = None
+        try:
+            with open(store.index_file_path) as index_file:
+                obj = json.load(index_file)
+        except (FileNotFoundError, ValueError):
+            pass
+        if obj != None and obj.get("version", None) != PackedPageStore.VERSION:
+            obj = None
+
+        if obj != None:
+            store.__segment_sizes = list(obj["segment_sizes"])
+            for [number, status, segment_number, offset, length,
+                 first_post_id, last_post_id, reply_count] in obj["pages"]:
+                store.__page_infos[number] = PageInfo(
+                    number=number,
+                    status=PageInfo.Status[status],
+                    first_post_id=first_post_id,
+                    last_post_id=last_post_id,
+                    reply_count=reply_count,
+                )
+                store.__locations[number] = PackedRecordLocation(
+                    segment_number, offset, length)
+        else:
+            logging.info("打包转存的索引不存在或已不可用，将扫描分段文件重建")
+
+        with store.lock:
+            if store.__scan_unindexed_records() and not read_only:
+                store.save()
+        return store
+
+    def close(self):
+        with self.lock:
+            for segment_number in list(self.__mmaps.keys()):
+                self.__drop_mmap(segment_number)
+
+    def __enter__(self) -> PackedPageStore:
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def page_info_list(self) -> List[PageInfo]:
+        return sorted(self.__page_infos.values(), key=lambda x: x.number)
+
+    def get(self, page_number: int) -> Optional[PageInfo]:
+        return self.__page_infos.get(page_number, None)
+
+    def get_location(self, page_number: int) -> Optional[PackedRecordLocation]:
+        return self.__locations.get(page_number, None)
+
+    def find_page_number(self, post_id: int) -> Optional[int]:
+        """
+        找出可能包含指定串号的页面的页数。
+        """
+        with self.lock:
+            if self.__post_id_index == None:
+                self.__post_id_index = sorted(
+                    (page_info.first_post_id, page_info.number)
+                    for page_info in self.__page_infos.values()
+                    if page_info.first_post_id != None
+                )
+            post_id_index = self.__post_id_index
+        i = bisect_right(post_id_index, (post_id, float("inf"))) - 1
+        if i < 0:
+            return None
+        page_number = post_id_index[i][1]
+        if post_id > self.__page_infos[page_number].last_post_id:
+            return None
+        return page_number
+
+    def read_page_bytes(self, page_number: int) -> Optional[memoryview]:
+        """
+        读取某页记录的内容，即该页各回应的紧凑 JSON。
+        返回的内容直接引用 mmap，在存储关闭后便不可再用。
+        """
+        with self.lock:
+            location = self.__locations.get(page_number, None)
+            if location == None:
+                return None
+            m = self.__get_mmap(location.segment_number)
+        start = location.offset + PackedPageStore.RECORD_HEADER.size
+        return memoryview(m)[start: start + location.length]
+
+    def read_page_crc32(self, page_number: int) -> Optional[int]:
+        """
+        读取某页记录头中内容的 CRC32。
+        """
+        with self.lock:
+            location = self.__locations.get(page_number, None)
+            if location == None:
+                return None
+            m = self.__get_mmap(location.segment_number)
+        (_, _, _, _, crc) = PackedPageStore.RECORD_HEADER.unpack_from(
+            m, location.offset)
+        return crc
+
+    def read_page_replies(self, page_info: PageInfo) -> List[Dict[str, Any]]:
+        page_bytes = self.read_page_bytes(page_info.number)
+        try:
+            return json.loads(bytes(page_bytes))
+        finally:
+            page_bytes.release()
+
+    @staticmethod
+    def encode_page(replies: List[Dict[str, Any]]) -> bytes:
+        return json.dumps(replies, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def commit_staged_pages(self, staging_folder_path: Path, page_infos: List[PageInfo]):
+        """
+        将暂存文件夹中的页面追加为记录，并更新索引。
+        """
+        pages = []
+        for page_info in page_infos:
+            with open(staging_folder_path / page_info.filename(), "rb") as staged_file:
+                pages.append((page_info, staged_file.read()))
+        self.append_pages(pages)
+
+    def append_pages(self, pages: Iterable[Tuple[PageInfo, bytes]]):
+        """
+        依次追加各页的记录，并更新索引。
+        """
+        self.__check_writable()
+        with self.lock:
+            segment_file: Optional[IO] = None
+            try:
+                for (page_info, page_bytes) in pages:
+                    record_size = PackedPageStore.RECORD_HEADER.size + \
+                        len(page_bytes)
+                    if len(self.__segment_sizes) == 0 or \
+                            (self.__segment_sizes[-1] > 0 and
+                             self.__segment_sizes[-1] + record_size > PackedPageStore.SEGMENT_MAX_SIZE):
+                        if segment_file != None:
+                            segment_file.close()
+                            segment_file = None
+                        self.__segment_sizes.append(0)
+                    segment_number = len(self.__segment_sizes) - 1
+                    if segment_file == None:
+                        segment_file = open(
+                            self.segment_path(segment_number), "ab")
+                        # 分段文件变长后，原有的 mmap 便不足以读到新记录
+                        self.__drop_mmap(segment_number)
+
+                    offset = self.__segment_sizes[segment_number]
+                    segment_file.write(PackedPageStore.RECORD_HEADER.pack(
+                        PackedPageStore.RECORD_MAGIC, page_info.status.value,
+                        page_info.number, len(page_bytes), zlib.crc32(page_bytes)))
+                    segment_file.write(page_bytes)
+                    self.__segment_sizes[segment_number] += record_size
+
+                    self.update(page_info, PackedRecordLocation(
+                        segment_number, offset, len(page_bytes)))
+                if segment_file != None:
+                    segment_file.flush()
+                    os.fsync(segment_file.fileno())
+            finally:
+                if segment_file != None:
+                    segment_file.close()
+            self.save()
+
+    def update(self, page_info: PageInfo, location: PackedRecordLocation):
+        with self.lock:
+            self.__page_infos[page_info.number] = page_info
+            self.__locations[page_info.number] = location
+            self.__post_id_index = None
+
+    def save(self):
+        self.__check_writable()
+        with self.lock:
+            obj = {
+                "version": PackedPageStore.VERSION,
+                "segment_sizes": self.__segment_sizes,
+                "pages": [
+                    [
+                        page_info.number, page_info.status.name,
+                        self.__locations[page_info.number].segment_number,
+                        self.__locations[page_info.number].offset,
+                        self.__locations[page_info.number].length,
+                        page_info.first_post_id, page_info.last_post_id, page_info.reply_count,
+                    ]
+                    for page_info in self.page_info_list()
+                ],
+            }
+            tmp_file_path = self.folder_path / \
+                f"_{PackedPageStore.INDEX_FILE_NAME}"
+            with open(tmp_file_path, "w+") as index_file:
+                json.dump(obj, index_file)
+            os.replace(tmp_file_path, self.index_file_path)
+
+    def garbage_ratio(self) -> float:
+        """
+        已被新记录取代的旧记录所占的比例。
+        """
+        total_size = sum(self.__segment_sizes)
+        if total_size == 0:
+            return 0
+        live_size = sum(map(
+            lambda location: PackedPageStore.RECORD_HEADER.size + location.length,
+            self.__locations.values()))
+        return 1 - live_size / total_size
+
+    def compact(self):
+        """
+        按页数顺序重写所有页面的最新记录，抛弃被取代的旧记录。
+        """
+        self.__check_writable()
+        with self.lock:
+            tmp_dump_folder_path = self.dump_folder_path / \
+                f"_{PackedPageStore.FOLDER_NAME}"
+            shutil.rmtree(tmp_dump_folder_path, ignore_errors=True)
+            tmp_dump_folder_path.mkdir()
+            compacted = PackedPageStore.create(tmp_dump_folder_path)
+            compacted.append_pages(map(
+                lambda page_info: (page_info, bytes(
+                    self.read_page_bytes(page_info.number))),
+                self.page_info_list(),
+            ))
+            compacted.close()
+            self.close()
+
+            old_folder_path = self.dump_folder_path / \
+                f"_old_{PackedPageStore.FOLDER_NAME}"
+            os.replace(self.folder_path, old_folder_path)
+            os.replace(compacted.folder_path, self.folder_path)
+            shutil.rmtree(old_folder_path, ignore_errors=True)
+            shutil.rmtree(tmp_dump_folder_path, ignore_errors=True)
+
+            self.__segment_sizes = compacted.__segment_sizes
+            self.__locations = compacted.__locations
+
+    def __check_writable(self):
+        if self.read_only:
+            raise io.UnsupportedOperation("打包转存以只读方式打开，不可写入")
+
+    def __get_mmap(self, segment_number: int) -> mmap.mmap:
+        m = self.__mmaps.get(segment_number, None)
+        if m == None:
+            with open(self.segment_path(segment_number), "rb") as segment_file:
+                m = mmap.mmap(segment_file.fileno(), 0,
+                              access=mmap.ACCESS_READ)
+            self.__mmaps[segment_number] = m
+        return m
+
+    def __drop_mmap(self, segment_number: int):
+        m = self.__mmaps.pop(segment_number, None)
+        if m != None:
+            try:
+                m.close()
+            except BufferError:
+                # 仍有读取结果引用着旧的 mmap，交给垃圾回收
+                pass
+
+    def __scan_unindexed_records(self) -> bool:
+        """
+        扫描索引尚未记录的分段文件内容，补全索引。
+
+        Returns
+        -------
+        bool
+            是否有改动。
+        """
+        segment_file_sizes = []
+        while True:
+            segment_path = self.segment_path(len(segment_file_sizes))
+            if not segment_path.exists():
+                break
+            segment_file_sizes.append(segment_path.stat().st_size)
+
+        changed = False
+        if len(self.__segment_sizes) > len(segment_file_sizes) or any(map(
+                lambda sizes: sizes[0] > sizes[1], zip(self.__segment_sizes, segment_file_sizes))):
+            # 分段文件比索引记录的更短或更少，例如整理后被替换，此时索引中的位置都不再可信
+            logging.info("打包转存的索引与分段文件不符，将扫描分段文件重建")
+            self.__segment_sizes = []
+            self.__page_infos = {}
+            self.__locations = {}
+            self.__post_id_index = None
+            changed = True
+
+        for (segment_number, size) in enumerate(segment_file_sizes):
+            if segment_number >= len(self.__segment_sizes):
+                self.__segment_sizes.append(0)
+            offset = self.__segment_sizes[segment_number]
+            if offset != size:
+                changed = True
+                offset = self.__scan_segment(segment_number, offset)
+                if offset != size and not self.read_only:
+                    # 只读时末尾的记录可能正在写入，只是不读取，交由写入方处理
+                    logging.warning(
+                        f"打包转存的分段 {self.segment_path(segment_number).name} 末尾有不完整的记录，将截去")
+                    os.truncate(self.segment_path(segment_number), offset)
+                self.__segment_sizes[segment_number] = offset
+        return changed
+
+    def __scan_segment(self, segment_number: int, offset: int) -> int:
+        header_size = PackedPageStore.RECORD_HEADER.size
+        with open(self.segment_path(segment_number), "rb") as segment_file:
+            segment_file.seek(offset)
+            while True:
+                header = segment_file.read(header_size)
+                if len(header) < header_size:
+                    return offset
+                (magic, status, number, length, crc) = \
+                    PackedPageStore.RECORD_HEADER.unpack(header)
+                if magic != PackedPageStore.RECORD_MAGIC:
+                    return offset
+                page_bytes = segment_file.read(length)
+                if len(page_bytes) < length or zlib.crc32(page_bytes) != crc:
+                    return offset
+                page_info = PageInfo.from_replies(
+                    number, PageInfo.Status(status), json.loads(page_bytes))
+                self.update(page_info, PackedRecordLocation(
+                    segment_number, offset, length))
+                offset += header_size + length
+
+
+PageStore = Union[PageManifest, PackedPageStore]
+
+
+def open_page_store(dump_folder_path: Path, examines_pages: bool = False, read_only: bool = False) -> PageStore:
+    """
+    打开转存文件夹中的页面存储。
+    如果存在 `packed` 文件夹，则为打包格式，否则为 `pages` 文件夹下逐页存放的原格式。
+    `read_only` 只对打包格式有效。
+    """
+    if PackedPageStore.exists(dump_folder_path):
+        return PackedPageStore.open(dump_folder_path, read_only=read_only)
+    return PageManifest.load_or_rebuild(dump_folder_path, examines_pages=examines_pages)
+
+
+def convert_to_packed(dump_folder_path: Path):
+    """
+    将 `pages` 文件夹下逐页存放的转存文件夹转换为打包格式。
+
+    先在临时文件夹中生成打包文件，完成后再替换，
+    因此中途退出时原有的页面不受影响。
+    """
+    manifest = PageManifest.load_or_rebuild(
+        dump_folder_path, examines_pages=True)
+
+    tmp_dump_folder_path = dump_folder_path / f"_{PackedPageStore.FOLDER_NAME}"
+    shutil.rmtree(tmp_dump_folder_path, ignore_errors=True)
+    tmp_dump_folder_path.mkdir()
+    with PackedPageStore.create(tmp_dump_folder_path) as store:
+        store.append_pages(map(
+            lambda page_info: (page_info, PackedPageStore.encode_page(
+                manifest.read_page_replies(page_info))),
+            manifest.page_info_list(),
+        ))
+    os.replace(tmp_dump_folder_path / PackedPageStore.FOLDER_NAME,
+               dump_folder_path / PackedPageStore.FOLDER_NAME)
+    shutil.rmtree(tmp_dump_folder_path)
+
+    # 打包文件夹存在时优先使用，因此此后移除原有的页面不会造成不一致
+    shutil.rmtree(manifest.pages_folder_path)
+    if manifest.file_path.exists():
+        os.remove(manifest.file_path)
+
+
+def convert_to_legacy(dump_folder_path: Path):
+    """
+    将打包格式的转存文件夹转换回 `pages` 文件夹下逐页存放的格式。
+    """
+    pages_folder_path = dump_folder_path / "pages"
+    tmp_pages_folder_path = dump_folder_path / "_pages"
+    shutil.rmtree(tmp_pages_folder_path, ignore_errors=True)
+    tmp_pages_folder_path.mkdir()
+
+    with PackedPageStore.open(dump_folder_path) as store:
+        page_infos = store.page_info_list()
+        for page_info in page_infos:
+            with open(tmp_pages_folder_path / page_info.filename(), "wb+") as page_file:
+                page_file.write(PageManifest.encode_page(
+                    store.read_page_replies(page_info)))
+    os.replace(tmp_pages_folder_path, pages_folder_path)
+
+    manifest = PageManifest(
+        dump_folder_path=dump_folder_path,
+        page_infos={page_info.number: page_info for page_info in page_infos},
+    )
+    manifest.save()
+
+    shutil.rmtree(dump_folder_path / PackedPageStore.FOLDER_NAME)
@@ -1,80 +1,257 @@
 #!/usr/bin/env python3
 
-from typing import List, OrderedDict
+from typing import List, Dict, Any, Callable, Iterator
+from dataclasses import dataclass
 
 import os
 import sys
+import io
+import re
 import logging
 import argparse
 from pathlib import Path
-import shutil
 import json
+import time
+from hashlib import sha256
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import zipfile
+import tarfile
 
 # TODO: --move-assets
 # TODO: add .gitattributes if moved assets
 # TODO: add .gitignore if specified --git-ignore-assets
 
 
+STATE_FILE_NAME = ".luwei-conversion.json"
+
+DATA_FILE_NAME_PATTERN = re.compile(r"(?:^|/)data/(\d+)\.data$")
+
+
+@dataclass(frozen=True)
+class SourcePage:
+    """
+    芦苇下载的一页的来源。
+    """
+    number: int
+    size: int
+    mtime_ns: int
+    read: Callable[[], bytes]
+    """读取该页的内容。来源为 tar 文档时，只能在迭代到下一页之前调用。"""
+
+
 def main(args: List[str]):
     logging.debug(f"args: {args}")
     args = parse_args(prog=args[0], args=args[1:])
 
-    if args.dump_folder_path.exists():
-        shutil.rmtree(args.dump_folder_path)
-    args.dump_folder_path.mkdir(parents=True)
-    (args.dump_folder_path / "pages").mkdir(parents=True)
-
-    data_folder_path = args.luwei_downloaded_thread_folder_path / "data"
-    max_page_number = get_max_page_number(data_folder_path)
-
-    for page_number in range(1, max_page_number+1):
-        data_file_path = data_folder_path / f"{page_number}.data"
-        with open(data_file_path) as data_file:
-            data_raw = data_file.read()[11:-2]
-            thread_page = json.loads(data_raw, object_pairs_hook=OrderedDict)
-            last_dumped_post_id = int(thread_page["replys"][-1]["id"])
-
-            if page_number == max_page_number:
-                thread_body = OrderedDict(thread_page)
-                thread_body.pop("replys")
-                thread_body.pop("replyCount")
-                with open(args.dump_folder_path / "thread.json", "w+") as thread_file:
-                    json.dump(thread_body, thread_file,
-                              indent=2, ensure_ascii=False)
-                    thread_file.write("\n")
-
-            replies = list(filter(
-                lambda post: post["userid"] != "芦苇", thread_page["replys"]))
-            with open(args.dump_folder_path / "pages" / f"{page_number}.json", "w+") as page_file:
-                json.dump(replies, page_file, indent=2, ensure_ascii=False)
-                page_file.write("\n")
-
-
-def get_max_page_number(data_folder_path: Path) -> int:
-    max_page_number = 0
-    for data_file_path in data_folder_path.glob("*"):
-        name = os.path.splitext(data_file_path.name)[0]
-        page_number = int(name)
-        max_page_number = max(max_page_number, page_number)
-    return max_page_number
+    (args.dump_folder_path / "pages").mkdir(parents=True, exist_ok=True)
+
+    state_file_path = args.dump_folder_path / STATE_FILE_NAME
+    old_state = {} if args.force else load_state(state_file_path)
+    state = {}
+
+    thread_file_path = args.dump_folder_path / "thread.json"
+    thread_file_exists = thread_file_path.exists()
+    max_page_number, max_page_data = 0, None
+    converted_count = 0
+
+    jobs = args.jobs or os.cpu_count() or 1
+    # 只有一个进程时直接在本进程中转换，省去进程间传递页面的开销
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    try:
+        # 限制尚未完成的页面数量，以免将整个来源读入内存
+        pending = deque()
+
+        for page in iterate_source_pages(args.luwei_downloaded_thread_source_path):
+            page_file_path = args.dump_folder_path / \
+                "pages" / f"{page.number}.json"
+            old_source_state = old_state.get(str(page.number), None)
+
+            data = None
+            if old_source_state != None \
+                    and old_source_state["size"] == page.size \
+                    and old_source_state["mtime_ns"] == page.mtime_ns:
+                state[str(page.number)] = old_source_state
+            else:
+                data = page.read()
+                state[str(page.number)] = {
+                    "size": page.size,
+                    "mtime_ns": page.mtime_ns,
+                    "sha256": sha256(data).hexdigest(),
+                }
+
+            # 重新下载后修改时间会改变，但内容未必改变，因此以散列值为准
+            if old_source_state == None \
+                    or state[str(page.number)]["sha256"] != old_source_state["sha256"] \
+                    or not page_file_path.exists():
+                if data == None:
+                    data = page.read()
+                if executor == None:
+                    convert_page(data, page_file_path)
+                else:
+                    pending.append(executor.submit(
+                        convert_page, data, page_file_path))
+                    if len(pending) >= jobs * 4:
+                        pending.popleft().result()
+                converted_count += 1
+            else:
+                data = None
+
+            if page.number > max_page_number:
+                max_page_number = page.number
+                # 串的内容取自最后一页，只在最后一页有变化时才需要更新
+                if data == None and not thread_file_exists:
+                    data = page.read()
+                max_page_data = data
+
+        while len(pending) > 0:
+            pending.popleft().result()
+    finally:
+        if executor != None:
+            executor.shutdown()
+
+    if max_page_data != None:
+        thread_body = decode_page(max_page_data)
+        thread_body.pop("replys")
+        thread_body.pop("replyCount")
+        write_json(thread_file_path, thread_body)
+
+    # 来源中已不存在的页面
+    for page_number in map(int, old_state.keys()):
+        if page_number > max_page_number:
+            page_file_path = args.dump_folder_path / \
+                "pages" / f"{page_number}.json"
+            if page_file_path.exists():
+                os.remove(page_file_path)
+
+    logging.info(f"共{max_page_number}页，其中{converted_count}页有变化")
+
+    save_state(state_file_path, state)
+
+
+def iterate_source_pages(source_path: Path) -> Iterator[SourcePage]:
+    """
+    迭代芦苇下载的各页。
+
+    来源可以是芦苇下载串文件夹，也可以是包含其内容的 zip 或 tar 文档。
+    文档中的页面直接从文档读取，不会解压到磁盘上。
+    """
+
+    if source_path.is_dir():
+        data_file_paths = {}
+        for data_file_path in (source_path / "data").glob("*"):
+            page_number = int(os.path.splitext(data_file_path.name)[0])
+            data_file_paths[page_number] = data_file_path
+        for page_number in sorted(data_file_paths.keys()):
+            data_file_path = data_file_paths[page_number]
+            stat = os.stat(data_file_path)
+            yield SourcePage(
+                number=page_number,
+                size=stat.st_size,
+                mtime_ns=stat.st_mtime_ns,
+                read=data_file_path.read_bytes,
+            )
+
+    elif zipfile.is_zipfile(source_path):
+        with zipfile.ZipFile(source_path) as zip_file:
+            # 页数范围取自 zip 的中央目录，无需读取各页
+            infos = {}
+            for info in zip_file.infolist():
+                m = DATA_FILE_NAME_PATTERN.search(info.filename)
+                if m != None:
+                    infos[int(m.group(1))] = info
+            for page_number in sorted(infos.keys()):
+                info = infos[page_number]
+                yield SourcePage(
+                    number=page_number,
+                    size=info.file_size,
+                    mtime_ns=int(time.mktime(
+                        info.date_time + (0, 0, -1))) * 10**9,
+                    read=lambda info=info: zip_file.read(info),
+                )
+
+    elif tarfile.is_tarfile(source_path):
+        # 按顺序流式读取，压缩的 tar 也只需解压一遍
+        with tarfile.open(source_path, "r:*") as tar_file:
+            for member in tar_file:
+                m = DATA_FILE_NAME_PATTERN.search(member.name)
+                if m == None or not member.isfile():
+                    continue
+                yield SourcePage(
+                    number=int(m.group(1)),
+                    size=member.size,
+                    mtime_ns=int(member.mtime) * 10**9,
+                    read=lambda member=member: tar_file.extractfile(
+                        member).read(),
+                )
+
+    else:
+        raise ValueError(f"无法识别的芦苇下载：{source_path}")
+
+
+def decode_page(data: bytes) -> Dict[str, Any]:
+    # 与以文本模式打开文件时一样处理换行
+    data_raw = io.TextIOWrapper(io.BytesIO(data)).read()[11:-2]
+    return json.loads(data_raw)
+
+
+def convert_page(data: bytes, page_file_path: Path):
+    """
+    将芦苇下载的一页转换为转存文件夹中的一页。
+    """
+    thread_page = decode_page(data)
+    replies = list(filter(
+        lambda post: post["userid"] != "芦苇", thread_page["replys"]))
+    write_json(page_file_path, replies)
+
+
+def write_json(file_path: Path, obj: Any):
+    # 先写入临时文件再替换，中途中断不会留下不完整的文件，
+    # 也会让 `pages` 文件夹的修改时间改变，从而使转存文件夹中过时的页面清单失效
+    tmp_file_path = file_path.parent / f"_{file_path.name}"
+    with open(tmp_file_path, "w+") as file:
+        json.dump(obj, file, indent=2, ensure_ascii=False)
+        file.write("\n")
+    os.replace(tmp_file_path, file_path)
+
+
+def load_state(state_file_path: Path) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(state_file_path) as state_file:
+            return json.load(state_file)["pages"]
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(state_file_path: Path, state: Dict[str, Dict[str, Any]]):
+    tmp_state_file_path = state_file_path.parent / f"_{state_file_path.name}"
+    with open(tmp_state_file_path, "w+") as state_file:
+        json.dump({"pages": state}, state_file, indent=2)
+    os.replace(tmp_state_file_path, state_file_path)
 
 
 def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         prog=prog,
-        description="将芦苇下载的串转换为thread dump",
+        description="将芦苇下载的串转换为thread dump。再次转换到同一文件夹时，只转换来源有变化的页面",
     )
 
     parser.add_argument("-i", "--input", '--input-luwei-downloaded-thread-folder',
-                        help="输入的芦苇下载串文件夹路径", metavar="<path to luwei downloaded thread folder `tXXXXXXXX`>",
-                        type=Path, dest="luwei_downloaded_thread_folder_path", required=True)
+                        help="输入的芦苇下载串文件夹路径，也可以是包含其内容的zip或tar文档", metavar="<path to luwei downloaded thread folder `tXXXXXXXX` or archive>",
+                        type=Path, dest="luwei_downloaded_thread_source_path", required=True)
     parser.add_argument("-o", "--output", '--output-dump-folder',
                         help="输出的转存文件夹路径，默认为芦苇下载串文件夹同目录下的`dump`文件夹", metavar="<path to dump folder>",
                         type=Path, dest="dump_folder_path")
+    parser.add_argument("-j", "--jobs",
+                        help="同时转换页面的进程数量，默认为CPU核心数", metavar="<count>",
+                        type=int, dest="jobs", default=None)
+    parser.add_argument("--force",
+                        help="无视上次转换的记录，重新转换所有页面",
+                        dest="force", action="store_true", default=False)
 
     args = parser.parse_args(args)
     if args.dump_folder_path == None:
-        args.dump_folder_path = args.luwei_downloaded_thread_folder_path.parent / "dump"
+        args.dump_folder_path = args.luwei_downloaded_thread_source_path.parent / "dump"
 
     return args
 
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+from typing import List
+
+import sys
+import logging
+import logging.config
+import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent / "commons"))
+from packeddump import PackedPageStore, convert_to_packed, convert_to_legacy  # noqa: E402
+
+
+def main(args: List[str]):
+    logging.debug(f"args: {args}")
+    args = parse_args(prog=args[0], args=args[1:])
+
+    is_packed = PackedPageStore.exists(args.dump_folder_path)
+    if args.to_format == "packed":
+        if is_packed:
+            logging.info("转存文件夹已是打包格式")
+            if args.compact:
+                with PackedPageStore.open(args.dump_folder_path) as store:
+                    store.compact()
+                logging.info("已整理打包文件")
+            return
+        convert_to_packed(args.dump_folder_path)
+        logging.info("已转换为打包格式")
+    else:
+        if not is_packed:
+            logging.info("转存文件夹已是逐页存放的格式")
+            return
+        convert_to_legacy(args.dump_folder_path)
+        logging.info("已转换为逐页存放的格式")
+
+
+def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="在逐页存放与打包两种格式之间转换转存文件夹",
+    )
+
+    parser.add_argument("dump_folder_path",
+                        help="转存文件夹路径", metavar="<path to dump folder>",
+                        type=Path)
+    parser.add_argument("--to", "--to-format",
+                        help="要转换成的格式，`legacy`为逐页存放于`pages`文件夹，`packed`为打包格式",
+                        choices=["legacy", "packed"], dest="to_format", required=True)
+    parser.add_argument("--compact",
+                        help="如果已是打包格式，抛弃其中被取代的旧记录",
+                        dest="compact", action="store_true", default=False)
+    parser.add_argument("--log-config", "--logging-configuration",
+                        help="python logging配置文件的路径", metavar="<path to python logging.conf>",
+                        type=Path, dest="log_config")
+
+    args = parser.parse_args(args)
+
+    if args.log_config != None:
+        logging.config.fileConfig(
+            args.log_config, disable_existing_loggers=False)
+
+    return args
+
+
+if __name__ == "__main__":
+    main(sys.argv)
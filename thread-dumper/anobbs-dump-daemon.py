@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+from typing import List
+
+import sys
+import logging
+import logging.config
+import argparse
+from pathlib import Path
+
+from src.client import create_client_from_environ
+from src.scheduler import add_scheduler_arguments, scheduler_configuration_from_args
+from src.daemon import DumpDaemon, PollingPolicy
+
+
+def main(args: List[str]):
+    logging.debug(f"args: {args}")
+    args = parse_args(prog=args[0], args=args[1:])
+
+    # 所有串共用同一个客户端，从而共用连接池与请求速率限制
+    client = create_client_from_environ(
+        max_connections_per_host=args.max_connections_per_host,
+        scheduler_cfg=scheduler_configuration_from_args(args),
+    )
+
+    state_file_path = args.state_file_path
+    if state_file_path == None:
+        state_file_path = args.manifest_path.parent / \
+            f".{args.manifest_path.name}.daemon-state.json"
+
+    DumpDaemon(
+        client=client,
+        manifest_path=args.manifest_path,
+        state_file_path=state_file_path,
+        policy=PollingPolicy(
+            min_interval=args.min_interval,
+            max_interval=args.max_interval,
+            target_new_reply_count=args.target_new_reply_count,
+        ),
+        thread_concurrency=args.thread_concurrency,
+        page_concurrency=args.page_concurrency,
+        dump_format=args.dump_format,
+        on_update_command=args.on_update_command,
+    ).run()
+
+
+def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="根据清单持续转存A岛串。各串的检查间隔随其回应速率自动调整，活跃的串检查得更频繁",
+    )
+
+    parser.add_argument("manifest_path",
+                        help="清单文件的路径，格式同`anobbs-dump-threads.py`。运行期间修改清单会被自动读取", metavar="<path to manifest>",
+                        type=Path)
+    parser.add_argument("--state-file",
+                        help="记录各串活跃程度的状态文件的路径，默认为清单同目录下的`.<清单文件名>.daemon-state.json`", metavar="<path to state file>",
+                        type=Path, dest="state_file_path")
+    parser.add_argument("-j", "--thread-concurrency",
+                        help="同时转存的串的最大数量，默认为4", metavar="<count>",
+                        type=int, dest="thread_concurrency", default=4)
+    parser.add_argument("--page-concurrency",
+                        help="每个串同时获取页面的最大数量，默认为1", metavar="<count>",
+                        type=int, dest="page_concurrency", default=1)
+    parser.add_argument("--max-connections-per-host",
+                        help="同时向主机发出的请求数量的上限，由所有串共享，默认为4", metavar="<count>",
+                        type=int, dest="max_connections_per_host", default=4)
+    parser.add_argument("--dump-format",
+                        help="新建转存文件夹时页面的存储格式，`legacy`为逐页存放于`pages`文件夹，`packed`为打包格式。默认为`legacy`。已存在的转存文件夹沿用原有格式",
+                        choices=["legacy", "packed"], dest="dump_format", default="legacy")
+    parser.add_argument("--min-interval",
+                        help="同一个串两次检查之间的最短间隔（秒），默认为60", metavar="<seconds>",
+                        type=float, dest="min_interval", default=60)
+    parser.add_argument("--max-interval",
+                        help="同一个串两次检查之间的最长间隔（秒），默认为86400，即一天", metavar="<seconds>",
+                        type=float, dest="max_interval", default=24*60*60)
+    parser.add_argument("--target-new-reply-count",
+                        help="期望平均每次检查时发现的新回应数，越小检查越频繁，默认为19，即一页", metavar="<count>",
+                        type=float, dest="target_new_reply_count", default=19)
+    parser.add_argument("--on-update",
+                        help="串有新回应并转存完成后执行的命令，如调用渲染程序。`{thread_id}`与`{dump_folder_path}`会被替换为对应的值", metavar="<command>",
+                        dest="on_update_command")
+    add_scheduler_arguments(parser)
+    parser.add_argument("--log-config", "--logging-configuration",
+                        help="python logging配置文件的路径", metavar="<path to python logging.conf>",
+                        type=Path, dest="log_config")
+
+    args = parser.parse_args(args)
+
+    if args.log_config != None:
+        logging.config.fileConfig(
+            args.log_config, disable_existing_loggers=False)
+
+    return args
+
+
+if __name__ == "__main__":
+    main(sys.argv)
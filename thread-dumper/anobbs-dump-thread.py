@@ -1,127 +1,53 @@
 #!/usr/bin/env python3
 
-from typing import List, Tuple, Dict, Any
-from dataclasses import dataclass
+from typing import List
 
-import os
 import sys
 import logging
 import logging.config
 import argparse
 from pathlib import Path
-import json
 
-import anobbsclient
-
-from src.fetchpages import fetch_page_range_back_to_front
-from src.dumppages import dump_page_range_back_to_front
-
-sys.path.append(str(Path(__file__).parent.parent / "commons"))
-from dumpedpages import PageInfo, get_page_info_list, get_page_ranges_for_dumping, get_page_name_and_status  # noqa: E402
-
-HOST = os.environ["ANOBBS_HOST"]
-USER_AGENT = os.environ["ANOBBS_CLIENT_ENVIRON"]
-APPID = os.environ["ANOBBS_CLIENT_APPID"]
-USERHASH = os.environ.get("ANOBBS_USERHASH", None)
-
-client = anobbsclient.Client(
-    user_agent=USER_AGENT,
-    host=HOST,
-    appid=APPID,
-    default_request_options={
-        "user_cookie": anobbsclient.UserCookie(userhash=USERHASH),
-        "login_policy": "when_required",
-        "gatekeeper_page_number": 100,
-        "uses_luwei_cookie_format": {
-            "expires": "Friday,24-Jan-2027 16:24:36 GMT",
-        },
-    },
-)
+from src.client import create_client_from_environ
+from src.scheduler import add_scheduler_arguments, scheduler_configuration_from_args
+from src.dumpthread import dump_thread
+from src.attachments import DEFAULT_ATTACHMENT_BASE_URL, mirror_attachments
+from src.exceptions import ThreadIDMismatchException
 
 
 def main(args: List[str]):
     logging.debug(f"args: {args}")
     args = parse_args(prog=args[0], args=args[1:])
 
-    if args.dump_folder_path.exists():
-        # 旧转存文件夹存在，检查串号前后是否一致
-        dumped_thread_path = args.dump_folder_path / "thread.json"
-        with open(dumped_thread_path) as dumped_thread_file:
-            dumped_thread = json.load(dumped_thread_file)
-        dumped_thread_id = int(dumped_thread["id"])
-        if args.thread_id != dumped_thread_id:
-            logging.critical(
-                f'指定的串号 {args.thread_id} 与先前转存生成的 `thread.json` 中的串号 {dumped_thread_id} 不一致，将终止')
-            exit(1)
-
-    (first_page, _) = client.get_thread_page(
-        args.thread_id, page=1, for_analysis=True)
-    page_count = (int(first_page.total_reply_count) - 1) // 19 + 1
-
-    if args.dump_folder_path.exists():
-        # 旧转存文件夹存在，检查旧文件夹来找出之前尚未完成的页数范围
-        page_info_list = get_page_info_list(
-            dump_folder_path=args.dump_folder_path)
-        page_ranges = get_page_ranges_for_dumping(page_info_list, 100)
-
-    pages_folder_path = args.dump_folder_path / "pages"
-
-    if not args.dump_folder_path.exists():
-        args.dump_folder_path.mkdir(parents=True)
-        pages_folder_path.mkdir(parents=True)
-        page_ranges = [(1, None)]
-
-    logging.info(f"所有将要转存的页面的范围：{page_ranges}")
-
-    needs_extra_round, should_abort = False, False
-    max_seen_id = None
-    reply_count = None
-    for (i, page_range) in enumerate(page_ranges):
-        logging.info(f"第{i+1}/{len(page_ranges)}轮，范围：{page_range}")
-        (start_page, end_page) = page_range
-        if end_page == None:
-            if start_page < 100 and page_count > 100:
-                needs_extra_round = True
-                end_page = 100
-            else:
-                end_page = page_count
-        if end_page > 100:
-            if not client.has_cookie():
-                logging.warning("守门页后仍有待转存页面，但由于尚未登陆，无法获取。将结束")
-                should_abort = True
-                break
-            if max_seen_id == None:
-                (page100, _) = client.get_thread_page(
-                    args.thread_id, page=100,
-                    for_analysis=True,
-                )
-                max_seen_id = int(page100.replies[-1].id)
-        (max_seen_id, should_abort, reply_count) = dump_page_range_back_to_front(
-            dump_folder_path=args.dump_folder_path,
+    client = create_client_from_environ(
+        max_connections_per_host=max(args.concurrency, 1),
+        scheduler_cfg=scheduler_configuration_from_args(args),
+    )
+
+    try:
+        is_complete = dump_thread(
             client=client,
             thread_id=args.thread_id,
-            from_upper_bound_page_number=end_page,
-            to_lower_bound_page_number=start_page,
-            gatekeeper_post_id=max_seen_id,
+            dump_folder_path=args.dump_folder_path,
+            concurrency=args.concurrency,
+            uses_trace=not args.ignore_trace,
+            dump_format=args.dump_format,
+            probe_cache_ttl=args.probe_cache_ttl,
         )
-        if should_abort:
-            break
-    if (not should_abort) and needs_extra_round:
-        if reply_count == None:
-            (page100, _) = client.get_thread_page(
-                args.thread_id, page=100,
-                for_analysis=True,
-            )
-            reply_count = int(page100.total_reply_count)
-
-        dump_page_range_back_to_front(
+    except ThreadIDMismatchException as e:
+        logging.critical(
+            f'指定的串号 {e.thread_id} 与先前转存生成的 `thread.json` 中的串号 {e.dumped_thread_id} 不一致，将终止')
+        exit(1)
+
+    if args.mirror_attachments and is_complete:
+        result = mirror_attachments(
             dump_folder_path=args.dump_folder_path,
-            client=client,
-            thread_id=args.thread_id,
-            from_upper_bound_page_number=(reply_count-1)//19+1,
-            to_lower_bound_page_number=100,
-            gatekeeper_post_id=max_seen_id
+            base_url=args.attachment_base_url,
+            concurrency=args.attachment_concurrency,
+            scheduler_cfg=scheduler_configuration_from_args(args),
         )
+        logging.info(
+            f"附件：新下载{result.downloaded_count}个，已存在{result.skipped_count}个，失败{len(result.failed_keys)}个")
 
 
 def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
@@ -143,6 +69,28 @@ def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
     #                     help="最多转存到的页数", metavar="<page number>",
     #                     type=int, dest="u
     # ntil_page_number", default=None)
+    parser.add_argument("-j", "--concurrency",
+                        help="同时获取页面的最大数量，默认为1，即逐页获取。大于1时，待转存的各范围也会同时进行", metavar="<count>",
+                        type=int, dest="concurrency", default=1)
+    parser.add_argument("--ignore-trace",
+                        help="无视状态追踪文件，检查整个转存文件夹来找出尚未完成的部分",
+                        dest="ignore_trace", action="store_true", default=False)
+    parser.add_argument("--dump-format",
+                        help="新建转存文件夹时页面的存储格式，`legacy`为逐页存放于`pages`文件夹，`packed`为打包格式。默认为`legacy`。已存在的转存文件夹沿用原有格式",
+                        choices=["legacy", "packed"], dest="dump_format", default="legacy")
+    parser.add_argument("--probe-cache-ttl",
+                        help="转存前试探性获取的第一页与守门页在转存文件夹中缓存的有效期（秒），有效期内再次转存时直接使用缓存，因此期间新增的回应要等缓存过期后才会被发现。默认为0，即不缓存", metavar="<seconds>",
+                        type=float, dest="probe_cache_ttl", default=0)
+    parser.add_argument("--mirror-attachments",
+                        help="转存完成后，将回应引用到的附件下载到转存文件夹的`attachments`中",
+                        dest="mirror_attachments", action="store_true", default=False)
+    parser.add_argument("--attachment-base-url",
+                        help=f"附件的基础URL，默认为`{DEFAULT_ATTACHMENT_BASE_URL}`", metavar="<url>",
+                        dest="attachment_base_url", default=DEFAULT_ATTACHMENT_BASE_URL)
+    parser.add_argument("--attachment-concurrency",
+                        help="同时下载附件的最大数量，默认为4", metavar="<count>",
+                        type=int, dest="attachment_concurrency", default=4)
+    add_scheduler_arguments(parser)
     parser.add_argument("--log-config", "--logging-configuration",
                         help="python logging配置文件的路径", metavar="<path to python logging.conf>",
                         type=Path, dest="log_config")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+from typing import List, Dict
+
+import sys
+import logging
+import logging.config
+import argparse
+from pathlib import Path
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from src.client import create_client_from_environ
+from src.scheduler import add_scheduler_arguments, scheduler_configuration_from_args
+from src.dumpthread import dump_thread
+from src.exceptions import ThreadIDMismatchException
+from src.threadmanifest import load_thread_manifest, ThreadManifestEntry
+
+
+def main(args: List[str]):
+    logging.debug(f"args: {args}")
+    args = parse_args(prog=args[0], args=args[1:])
+
+    entries = load_thread_manifest(args.manifest_path)
+    logging.info(f"清单中共有{len(entries)}个串")
+
+    # 所有串共用同一个客户端，从而共用连接池与请求预算
+    client = create_client_from_environ(
+        max_connections_per_host=args.max_connections_per_host,
+        scheduler_cfg=scheduler_configuration_from_args(args),
+    )
+
+    interrupt_event = threading.Event()
+
+    def dump(entry: ThreadManifestEntry) -> bool:
+        if interrupt_event.is_set():
+            return False
+        logging.info(f"开始转存串 {entry.thread_id}")
+        return dump_thread(
+            client=client,
+            thread_id=entry.thread_id,
+            dump_folder_path=entry.dump_folder_path,
+            concurrency=args.page_concurrency,
+            interrupt_event=interrupt_event,
+            uses_trace=not args.ignore_trace,
+            dump_format=args.dump_format,
+            probe_cache_ttl=args.probe_cache_ttl,
+        )
+
+    futures: Dict[ThreadManifestEntry, Future] = {}
+    with ThreadPoolExecutor(max_workers=args.thread_concurrency) as executor:
+        for entry in entries:
+            futures[entry] = executor.submit(dump, entry)
+        for future in futures.values():
+            while True:
+                try:
+                    future.exception()
+                    break
+                except KeyboardInterrupt:
+                    # 键盘中断只会发送到主线程，需要转告给各转存任务
+                    logging.warning("收到用户键盘中断，将通知各转存任务中断")
+                    interrupt_event.set()
+
+    failed_count = 0
+    for (entry, future) in futures.items():
+        e = future.exception()
+        if e == None and future.result():
+            logging.info(f"串 {entry.thread_id}：成功")
+            continue
+        failed_count += 1
+        if e == None:
+            logging.error(f"串 {entry.thread_id}：中断，转存尚未完成")
+        elif isinstance(e, ThreadIDMismatchException):
+            logging.error(
+                f'串 {entry.thread_id}：失败，与转存文件夹 `{entry.dump_folder_path}` 中的串号 {e.dumped_thread_id} 不一致')
+        else:
+            logging.error(f"串 {entry.thread_id}：失败，{e!r}", exc_info=e)
+
+    logging.info(f"共{len(entries)}个串，成功{len(entries)-failed_count}个，失败{failed_count}个")
+    if failed_count > 0:
+        exit(1)
+
+
+def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="根据清单批量转存A岛串",
+    )
+
+    parser.add_argument("manifest_path",
+                        help="清单文件的路径。每行为一个串，格式为`<串号> <转存文件夹路径>`", metavar="<path to manifest>",
+                        type=Path)
+    parser.add_argument("-j", "--thread-concurrency",
+                        help="同时转存的串的最大数量，默认为4", metavar="<count>",
+                        type=int, dest="thread_concurrency", default=4)
+    parser.add_argument("--page-concurrency",
+                        help="每个串同时获取页面的最大数量，默认为1", metavar="<count>",
+                        type=int, dest="page_concurrency", default=1)
+    parser.add_argument("--max-connections-per-host",
+                        help="同时向主机发出的请求数量的上限，由所有串共享，默认为4", metavar="<count>",
+                        type=int, dest="max_connections_per_host", default=4)
+    parser.add_argument("--ignore-trace",
+                        help="无视状态追踪文件，检查整个转存文件夹来找出尚未完成的部分",
+                        dest="ignore_trace", action="store_true", default=False)
+    parser.add_argument("--dump-format",
+                        help="新建转存文件夹时页面的存储格式，`legacy`为逐页存放于`pages`文件夹，`packed`为打包格式。默认为`legacy`。已存在的转存文件夹沿用原有格式",
+                        choices=["legacy", "packed"], dest="dump_format", default="legacy")
+    parser.add_argument("--probe-cache-ttl",
+                        help="转存前试探性获取的第一页与守门页在转存文件夹中缓存的有效期（秒），有效期内再次转存时直接使用缓存，因此期间新增的回应要等缓存过期后才会被发现。默认为0，即不缓存", metavar="<seconds>",
+                        type=float, dest="probe_cache_ttl", default=0)
+    add_scheduler_arguments(parser)
+    parser.add_argument("--log-config", "--logging-configuration",
+                        help="python logging配置文件的路径", metavar="<path to python logging.conf>",
+                        type=Path, dest="log_config")
+
+    args = parser.parse_args(args)
+
+    if args.log_config != None:
+        logging.config.fileConfig(
+            args.log_config, disable_existing_loggers=False)
+
+    return args
+
+
+if __name__ == "__main__":
+    main(sys.argv)
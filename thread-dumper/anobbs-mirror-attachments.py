@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+from typing import List
+
+import sys
+import logging
+import logging.config
+import argparse
+from pathlib import Path
+
+from src.scheduler import add_scheduler_arguments, scheduler_configuration_from_args
+from src.attachments import DEFAULT_ATTACHMENT_BASE_URL, mirror_attachments
+
+
+def main(args: List[str]):
+    logging.debug(f"args: {args}")
+    args = parse_args(prog=args[0], args=args[1:])
+
+    result = mirror_attachments(
+        dump_folder_path=args.dump_folder_path,
+        base_url=args.attachment_base_url,
+        concurrency=args.concurrency,
+        scheduler_cfg=scheduler_configuration_from_args(args),
+    )
+    logging.info(
+        f"新下载{result.downloaded_count}个附件，已存在{result.skipped_count}个，失败{len(result.failed_keys)}个")
+    if len(result.failed_keys) > 0:
+        exit(1)
+
+
+def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="将转存文件夹中的回应引用到的附件下载到转存文件夹中。可重复执行，已下载的附件会被跳过，未下载完的附件会从中断处继续",
+    )
+
+    parser.add_argument("dump_folder_path",
+                        help="转存文件夹的路径", metavar="<path to dump folder>",
+                        type=Path)
+    parser.add_argument("-j", "--concurrency",
+                        help="同时下载附件的最大数量，默认为4", metavar="<count>",
+                        type=int, dest="concurrency", default=4)
+    parser.add_argument("--attachment-base-url",
+                        help=f"附件的基础URL，默认为`{DEFAULT_ATTACHMENT_BASE_URL}`", metavar="<url>",
+                        dest="attachment_base_url", default=DEFAULT_ATTACHMENT_BASE_URL)
+    add_scheduler_arguments(parser)
+    parser.add_argument("--log-config", "--logging-configuration",
+                        help="python logging配置文件的路径", metavar="<path to python logging.conf>",
+                        type=Path, dest="log_config")
+
+    args = parser.parse_args(args)
+
+    if args.log_config != None:
+        logging.config.fileConfig(
+            args.log_config, disable_existing_loggers=False)
+
+    return args
+
+
+if __name__ == "__main__":
+    main(sys.argv)
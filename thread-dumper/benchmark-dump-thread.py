@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+from typing import List, Set
+from dataclasses import dataclass
+
+import sys
+import os
+import logging
+import logging.config
+import argparse
+from pathlib import Path
+import resource
+import subprocess
+import tempfile
+import time
+
+from src.fakeserver import start_fake_server, add_fake_thread_arguments, fake_thread_configuration_from_args
+
+sys.path.append(str(Path(__file__).parent.parent / "commons"))
+from packeddump import open_page_store  # noqa: E402
+
+
+@dataclass(frozen=True)
+class BenchmarkResult:
+    succeeded: bool
+    elapsed: float
+    page_count: int
+    request_count: int
+    failed_request_count: int
+    missing_reply_count: int
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.page_count / self.elapsed
+
+    @property
+    def requests_per_page(self) -> float:
+        return self.request_count / max(self.page_count, 1)
+
+
+def main(args: List[str]):
+    logging.debug(f"args: {args}")
+    args = parse_args(prog=args[0], args=args[1:])
+
+    results = []
+    for i in range(args.repeat):
+        with tempfile.TemporaryDirectory(prefix="benchmark-dump-") as tmp_folder_path:
+            result = run_once(args, Path(tmp_folder_path) / "dump")
+        results.append(result)
+        print(f"第{i+1}/{args.repeat}次：" + format_result(result))
+
+    # 所有已结束的子进程中内存峰值最高者；Linux 上单位为 KiB，macOS 上为字节
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform != "darwin":
+        max_rss *= 1024
+
+    best = min(results, key=lambda result: result.elapsed)
+    print(f"最快一次：{format_result(best)}")
+    print(f"转存进程内存峰值：{max_rss / 1024 / 1024:.1f} MiB")
+
+    if not all(map(lambda result: result.succeeded and result.missing_reply_count == 0, results)):
+        exit(1)
+
+
+def run_once(args: argparse.Namespace, dump_folder_path: Path) -> BenchmarkResult:
+    server = start_fake_server(fake_thread_configuration_from_args(args))
+    try:
+        env = dict(os.environ)
+        env.update({
+            "ANOBBS_HOST": "127.0.0.1",
+            "ANOBBS_BASE_URL": server.base_url,
+            "ANOBBS_CLIENT_ENVIRON": "benchmark",
+            "ANOBBS_CLIENT_APPID": "benchmark",
+            "NO_PROXY": "127.0.0.1",
+        })
+        if args.without_cookie:
+            env.pop("ANOBBS_USERHASH", None)
+        else:
+            env["ANOBBS_USERHASH"] = "benchmark"
+
+        command = [
+            sys.executable, str(
+                Path(__file__).parent / "anobbs-dump-thread.py"),
+            str(args.thread_id),
+            "-o", str(dump_folder_path),
+            "-j", str(args.concurrency),
+            "--dump-format", args.dump_format,
+        ]
+        if args.log_config != None:
+            command += ["--log-config", str(args.log_config)]
+        command += args.dumper_args
+
+        started_at = time.perf_counter()
+        completed = subprocess.run(command, env=env)
+        elapsed = time.perf_counter() - started_at
+
+        dumped_reply_ids = load_dumped_reply_ids(dump_folder_path)
+        expected_reply_ids = server.thread.visible_reply_ids
+        if args.without_cookie:
+            expected_reply_ids = expected_reply_ids[:server.cfg.gatekeeper_page_number * 19]
+        missing_reply_count = len(
+            set(expected_reply_ids) - dumped_reply_ids)
+
+        return BenchmarkResult(
+            succeeded=completed.returncode == 0,
+            elapsed=elapsed,
+            page_count=-(-len(expected_reply_ids) // 19),
+            request_count=server.statistics.request_count,
+            failed_request_count=server.statistics.failed_request_count,
+            missing_reply_count=missing_reply_count,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def load_dumped_reply_ids(dump_folder_path: Path) -> Set[int]:
+    if not dump_folder_path.exists():
+        return set()
+    reply_ids = set()
+    page_store = open_page_store(dump_folder_path, read_only=True)
+    for page_info in page_store.page_info_list():
+        for post in page_store.read_page_replies(page_info):
+            reply_ids.add(int(post["id"]))
+    return reply_ids
+
+
+def format_result(result: BenchmarkResult) -> str:
+    text = f"用时{result.elapsed:.2f}秒，{result.page_count}页，" + \
+        f"{result.pages_per_second:.1f}页/秒，" + \
+        f"{result.request_count}次请求，{result.requests_per_page:.2f}次请求/页"
+    if result.failed_request_count > 0:
+        text += f"（其中{result.failed_request_count}次返回503）"
+    if not result.succeeded:
+        text += "，转存进程异常退出"
+    if result.missing_reply_count > 0:
+        text += f"，缺少{result.missing_reply_count}个回应"
+    return text
+
+
+def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="以本地假服务器为对象，端到端地评测转存程序的速度、请求次数与内存峰值",
+    )
+
+    add_fake_thread_arguments(parser)
+    parser.add_argument("-j", "--concurrency",
+                        help="传给转存程序的同时获取页面的最大数量，默认为1", metavar="<count>",
+                        type=int, dest="concurrency", default=1)
+    parser.add_argument("--dump-format",
+                        help="转存文件夹的格式，默认为`legacy`",
+                        choices=["legacy", "packed"], dest="dump_format", default="legacy")
+    parser.add_argument("--without-cookie",
+                        help="不带饼干进行转存，此时守门页之后的页面无法获取",
+                        dest="without_cookie", action="store_true", default=False)
+    parser.add_argument("--repeat",
+                        help="重复评测的次数，默认为1", metavar="<count>",
+                        type=int, dest="repeat", default=1)
+    parser.add_argument("--log-config", "--logging-configuration",
+                        help="python logging配置文件的路径，也会传给转存程序", metavar="<path to python logging.conf>",
+                        type=Path, dest="log_config")
+
+    parser.add_argument("dumper_args", nargs=argparse.REMAINDER,
+                        help="之后的参数会原样传给转存程序，如`-- --max-request-rate 10`", metavar="...")
+
+    args = parser.parse_args(args)
+    if args.dumper_args[:1] == ["--"]:
+        args.dumper_args = args.dumper_args[1:]
+
+    if args.log_config != None:
+        logging.config.fileConfig(
+            args.log_config, disable_existing_loggers=False)
+
+    return args
+
+
+if __name__ == "__main__":
+    main(sys.argv)
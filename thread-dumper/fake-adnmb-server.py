@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+from typing import List
+
+import sys
+import logging
+import logging.config
+import argparse
+from pathlib import Path
+
+from src.fakeserver import FakeADNMBServer, add_fake_thread_arguments, fake_thread_configuration_from_args
+
+
+def main(args: List[str]):
+    logging.debug(f"args: {args}")
+    args = parse_args(prog=args[0], args=args[1:])
+
+    server = FakeADNMBServer(
+        (args.bind, args.port), fake_thread_configuration_from_args(args))
+    logging.info(
+        f"假服务器已启动：{server.base_url}，串号：{args.thread_id}，页数：{args.page_count}")
+    logging.info(
+        f"转存时请设置环境变量 `ANOBBS_BASE_URL={server.base_url}`")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logging.info(
+            f"共收到{server.statistics.request_count}次请求，其中「卡99」{server.statistics.gatekept_request_count}次")
+
+
+def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="在本地模拟A岛串接口的假服务器，用于测试与评测转存程序",
+    )
+
+    parser.add_argument("--bind",
+                        help="监听的地址，默认为127.0.0.1", metavar="<address>",
+                        dest="bind", default="127.0.0.1")
+    parser.add_argument("--port",
+                        help="监听的端口，默认为8080", metavar="<port>",
+                        type=int, dest="port", default=8080)
+    add_fake_thread_arguments(parser)
+    parser.add_argument("--log-config", "--logging-configuration",
+                        help="python logging配置文件的路径", metavar="<path to python logging.conf>",
+                        type=Path, dest="log_config")
+
+    args = parser.parse_args(args)
+
+    if args.log_config != None:
+        logging.config.fileConfig(
+            args.log_config, disable_existing_loggers=False)
+
+    return args
+
+
+if __name__ == "__main__":
+    main(sys.argv)
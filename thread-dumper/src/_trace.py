@@ -12,31 +12,49 @@ class Trace:
     thread_id: int
     known_reply_count: int
     last_dumped_post_id: int
+    last_dumped_page_number: int
 
     @staticmethod
     def __load_from_obj(obj: Dict[Any]) -> Trace:
+        known_reply_count = obj.get("known_reply_count", 0)
         return Trace(
-            known_reply_count=obj.get("known_reply_count", 0),
+            thread_id=obj["thread_id"],
+            known_reply_count=known_reply_count,
             last_dumped_post_id=obj.get("last_dumped_post_id", 0),
+            last_dumped_page_number=obj.get(
+                "last_dumped_page_number", max(known_reply_count - 1, 0) // 19 + 1),
         )
 
+    def as_obj(self) -> Dict[str, Any]:
+        obj = dict(self.__dict__)
+        # 串号以 `thread.json` 为准
+        obj.pop("thread_id")
+        return obj
+
     @staticmethod
     def load(trace_file_path: Path) -> Optional[Trace]:
         if trace_file_path.exists():
             with open(trace_file_path) as trace_file:
                 obj = json.load(trace_file)
             thread_file_path = trace_file_path.parent / "thread.json"
-            obj.update(("thread_id", Trace.__get_thread_id(thread_file_path)))
+            obj["thread_id"] = Trace.__get_thread_id(thread_file_path)
             return Trace.__load_from_obj(obj)
         else:
             return None
 
+    def save(self, trace_file_path: Path):
+        tmp_trace_file_path = trace_file_path.parent / \
+            f"_{trace_file_path.name}"
+        with open(tmp_trace_file_path, "w+") as trace_file:
+            json.dump(self.as_obj(), trace_file, indent=2)
+        os.replace(tmp_trace_file_path, trace_file_path)
+
     @staticmethod
     def load_by_examining_dump_folder(dump_folder_path: Path):
         pages_folder_path = dump_folder_path / "pages"
         page_file_paths = (pages_folder_path).glob("*")
-        page_count = max(filter(lambda path: int(
-            os.path.splitext(path.name)[0]), page_file_paths))
+        page_count = max(map(lambda path: int(
+            path.name.partition(".")[0]), page_file_paths))
 
         last_page_path = pages_folder_path / f"{page_count}.json"
         with open(last_page_path) as last_page_file:
@@ -46,6 +64,7 @@ class Trace:
             thread_id=Trace.__get_thread_id(dump_folder_path / "thread.json"),
             known_reply_count=int(last_page["replyCount"]),
             last_dumped_post_id=int(last_page["replys"][-1]["id"]),
+            last_dumped_page_number=page_count,
         )
 
     @staticmethod
@@ -55,5 +74,5 @@ class Trace:
         return int(thread["id"])
 
 
-def needs_update(old_trace: Trace, current_thread: Dict[Any]) -> bool:
-    return int(current_thread["replyCount"]) > old_trace.known_reply_count
+def needs_update(old_trace: Trace, current_reply_count: int) -> bool:
+    return current_reply_count > old_trace.known_reply_count
@@ -0,0 +1,157 @@
+from typing import Optional, Set, List
+from dataclasses import dataclass
+
+import logging
+from pathlib import Path
+import json
+from hashlib import sha256
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .scheduler import RequestScheduler, SchedulerConfiguration
+
+import sys
+sys.path.append(str(Path(__file__).parent.parent.parent / "commons"))
+from attachmentstore import AttachmentStore  # noqa: E402
+from packeddump import open_page_store  # noqa: E402
+
+
+DEFAULT_ATTACHMENT_BASE_URL = "https://nmbimg.fastmirror.org/image/"
+
+
+@dataclass(frozen=True)
+class MirrorResult:
+    downloaded_count: int
+    skipped_count: int
+    failed_keys: List[str]
+
+
+def collect_attachment_keys(dump_folder_path: Path) -> Set[str]:
+    """
+    找出转存文件夹中的串与各页回应引用到的所有附件。
+    """
+    keys = set()
+
+    def collect(post):
+        if post["img"] != "":
+            keys.add(AttachmentStore.key(post["img"], post["ext"]))
+
+    with open(dump_folder_path / "thread.json") as thread_file:
+        collect(json.load(thread_file))
+
+    page_store = open_page_store(dump_folder_path, read_only=True)
+    for page_info in page_store.page_info_list():
+        for post in page_store.read_page_replies(page_info):
+            collect(post)
+    page_store.close()
+
+    return keys
+
+
+def mirror_attachments(
+    dump_folder_path: Path,
+    base_url: str = DEFAULT_ATTACHMENT_BASE_URL,
+    concurrency: int = 4,
+    scheduler_cfg: Optional[SchedulerConfiguration] = None,
+) -> MirrorResult:
+    """
+    将转存文件夹中引用到的附件下载到按内容寻址的附件存储中。
+
+    已存储的附件会被跳过。
+    未下载完的附件会留在 `attachments/partial` 中，下次从中断处继续下载。
+
+    Parameters
+    ----------
+    base_url : str
+        附件的基础 URL，附件的 URL 为 `{base_url}{img}{ext}`。
+
+    concurrency : int
+        同时下载的附件数量。
+
+    scheduler_cfg : SchedulerConfiguration?
+        请求的速率与重试的配置。为空时使用默认配置。
+    """
+
+    store = AttachmentStore.load(dump_folder_path)
+    keys = collect_attachment_keys(dump_folder_path)
+    missing_keys = sorted(filter(lambda key: key not in store, keys))
+    logging.info(f"共引用{len(keys)}个附件，其中{len(missing_keys)}个尚未下载")
+    if len(missing_keys) == 0:
+        return MirrorResult(0, len(keys), [])
+
+    store.partial_folder_path.mkdir(parents=True, exist_ok=True)
+    scheduler = RequestScheduler(scheduler_cfg or SchedulerConfiguration())
+    session = requests.Session()
+    session.mount("https://", requests.adapters.HTTPAdapter(
+        pool_maxsize=concurrency))
+    session.mount("http://", requests.adapters.HTTPAdapter(
+        pool_maxsize=concurrency))
+
+    def mirror(key: str) -> bool:
+        partial_path = store.partial_path(key)
+        try:
+            scheduler.call(
+                lambda: download(session, base_url + key, partial_path),
+                description=f"下载附件 {key}",
+            )
+        except Exception as e:
+            logging.error(f"下载附件 {key} 失败：{e}")
+            return False
+        store.add(key, partial_path, file_sha256(partial_path))
+        return True
+
+    failed_keys = []
+    downloaded_count = 0
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for (i, (key, succeeded)) in enumerate(zip(missing_keys, executor.map(mirror, missing_keys))):
+                if succeeded:
+                    downloaded_count += 1
+                else:
+                    failed_keys.append(key)
+                if (i + 1) % 50 == 0:
+                    logging.info(f"附件下载进度：{i+1}/{len(missing_keys)}")
+                    store.save()
+    finally:
+        store.save()
+        session.close()
+
+    return MirrorResult(
+        downloaded_count=downloaded_count,
+        skipped_count=len(keys) - len(missing_keys),
+        failed_keys=failed_keys,
+    )
+
+
+def download(session: requests.Session, url: str, partial_path: Path):
+    """
+    将 URL 的内容下载到 `partial_path`。
+    如果文件已存在，则以 Range 请求从已下载的部分之后继续。
+    """
+    downloaded_size = partial_path.stat().st_size if partial_path.exists() else 0
+    headers = {}
+    if downloaded_size > 0:
+        headers["Range"] = f"bytes={downloaded_size}-"
+
+    with session.get(url, headers=headers, stream=True, timeout=60) as resp:
+        if resp.status_code == 416:
+            # 已下载的部分就是全部内容
+            return
+        resp.raise_for_status()
+        # 服务器不支持 Range 时会返回整个文件，此时从头写入
+        mode = "ab" if resp.status_code == 206 else "wb"
+        with open(partial_path, mode) as partial_file:
+            for chunk in resp.iter_content(chunk_size=64 * 1024):
+                partial_file.write(chunk)
+
+
+def file_sha256(file_path: Path) -> str:
+    h = sha256()
+    with open(file_path, "rb") as file:
+        while True:
+            chunk = file.read(1024 * 1024)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,112 @@
+from typing import Optional
+from dataclasses import dataclass
+
+import os
+import threading
+
+import requests
+import anobbsclient
+from anobbsclient.options import RequestOptions
+
+from .scheduler import RequestScheduler, SchedulerConfiguration
+
+
+@dataclass
+class PooledClient(anobbsclient.Client):
+    """
+    可在多个线程间共用的客户端。
+
+    `anobbsclient.Client` 每次请求都会新建会话，连接无法复用。
+    本类让所有会话共用同一个连接池，
+    并限制同时向主机发出的请求数量，作为同一进程中各转存任务共享的请求预算。
+
+    如果设置了 `scheduler`，各请求还会经由其控制速率与重试。
+    此时应将请求选项 `max_attempts` 设为 1，以免 `anobbsclient` 再自行重试。
+    """
+
+    max_connections_per_host: int = 4
+    """同时向主机发出的请求数量的上限，也是连接池的大小。"""
+
+    base_url: Optional[str] = None
+    """
+    请求的基础 URL，如 `http://127.0.0.1:8080`。
+    为空时为 `https://{host}`。用于连接本地的假服务器，此时 `host` 仍用于设置饼干。
+    """
+
+    scheduler: Optional[RequestScheduler] = None
+
+    def __post_init__(self):
+        self.__adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.max_connections_per_host,
+        )
+        self.__budget = threading.BoundedSemaphore(
+            self.max_connections_per_host)
+
+    def _make_session(self, options: RequestOptions, needs_login: bool = False) -> requests.Session:
+        session = super(PooledClient, self)._make_session(
+            options=options, needs_login=needs_login)
+        session.mount("https://", self.__adapter)
+        session.mount("http://", self.__adapter)
+        return session
+
+    def _make_request_url(self, path: str, **queries) -> str:
+        url = super(PooledClient, self)._make_request_url(path=path, **queries)
+        if self.base_url != None:
+            url = self.base_url + url[len(f"https://{self.host}"):]
+        return url
+
+    def _get_json(self, path: str, options: RequestOptions, needs_login: bool = False, **queries):
+        def request_fn():
+            with self.__budget:
+                return super(PooledClient, self)._get_json(
+                    path=path, options=options, needs_login=needs_login, **queries)
+
+        if self.scheduler == None:
+            return request_fn()
+        description = f"请求 {path}"
+        if "page" in queries:
+            description += f" 第 {queries['page']} 页"
+        return self.scheduler.call(request_fn, description)
+
+
+def create_client_from_environ(
+    max_connections_per_host: int = 4,
+    scheduler_cfg: Optional[SchedulerConfiguration] = None,
+) -> PooledClient:
+    """
+    根据环境变量创建客户端。
+    请求经由按 `scheduler_cfg` 创建的调度器进行，为空时使用默认配置。
+
+    Environment Variables
+    ---------------------
+    ANOBBS_HOST
+    ANOBBS_CLIENT_ENVIRON
+    ANOBBS_CLIENT_APPID
+    ANOBBS_USERHASH : optional
+    ANOBBS_BASE_URL : optional
+    """
+
+    userhash = os.environ.get("ANOBBS_USERHASH", None)
+
+    if scheduler_cfg == None:
+        scheduler_cfg = SchedulerConfiguration()
+
+    return PooledClient(
+        user_agent=os.environ["ANOBBS_CLIENT_ENVIRON"],
+        host=os.environ["ANOBBS_HOST"],
+        appid=os.environ["ANOBBS_CLIENT_APPID"],
+        default_request_options={
+            "user_cookie": anobbsclient.UserCookie(userhash=userhash),
+            "login_policy": "when_required",
+            "gatekeeper_page_number": 100,
+            # 重试由调度器负责
+            "max_attempts": 1,
+            "uses_luwei_cookie_format": {
+                "expires": "Friday,24-Jan-2027 16:24:36 GMT",
+            },
+        },
+        max_connections_per_host=max_connections_per_host,
+        base_url=os.environ.get("ANOBBS_BASE_URL", None),
+        scheduler=RequestScheduler(scheduler_cfg),
+    )
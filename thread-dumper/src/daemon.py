@@ -0,0 +1,318 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Any, Tuple
+from dataclasses import dataclass
+
+import logging
+from pathlib import Path
+import json
+import os
+import heapq
+import shlex
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+
+import anobbsclient
+
+from .dumpthread import dump_thread
+from .exceptions import ThreadIDMismatchException
+from .threadmanifest import load_thread_manifest
+from ._trace import Trace
+
+
+@dataclass(frozen=True)
+class PollingPolicy:
+    """
+    决定各串下次检查时间的策略。
+
+    每个串的回应速率以指数滑动平均估计，
+    检查间隔取为平均每次检查能发现 `target_new_reply_count` 个新回应所需的时间，
+    并限制在 `min_interval` 与 `max_interval` 之间。
+    没有新回应时速率估计会随之下降，间隔也就逐渐拉长；一旦有新回应，间隔会立刻缩短。
+    """
+
+    min_interval: float = 60
+    """检查间隔的下限（秒）。"""
+    max_interval: float = 24 * 60 * 60
+    """检查间隔的上限（秒）。"""
+    target_new_reply_count: float = 19
+    """期望平均每次检查时发现的新回应数。"""
+    smoothing: float = 0.5
+    """估计回应速率时，最近一次观测所占的权重。"""
+
+    def next_interval(self, reply_rate: float) -> float:
+        if reply_rate <= 0:
+            return self.max_interval
+        interval = self.target_new_reply_count / reply_rate
+        return min(max(interval, self.min_interval), self.max_interval)
+
+
+@dataclass
+class ThreadActivity:
+    """
+    守护进程所知的某个串的活跃程度。
+    """
+
+    thread_id: int
+    dump_folder_path: Path
+
+    reply_count: Optional[int] = None
+    """上次检查时的回应数。"""
+    reply_rate: float = 0.0
+    """估计的回应速率，单位为每秒回应数。"""
+    last_checked_at: Optional[float] = None
+    next_check_at: float = 0
+
+    def as_obj(self) -> Dict[str, Any]:
+        obj = dict(self.__dict__)
+        obj["dump_folder_path"] = str(self.dump_folder_path)
+        return obj
+
+    @staticmethod
+    def load_from_obj(obj: Dict[str, Any]) -> ThreadActivity:
+        obj = dict(obj)
+        obj["dump_folder_path"] = Path(obj["dump_folder_path"])
+        return ThreadActivity(**obj)
+
+    def observe(self, reply_count: int, checked_at: float, policy: PollingPolicy) -> bool:
+        """
+        记录一次成功的检查，并据此安排下次检查的时间。
+
+        Returns
+        -------
+        bool
+            回应数是否比上次检查时有所增加。首次检查时为真。
+        """
+        grew = self.reply_count == None or reply_count > self.reply_count
+        if self.reply_count == None or self.last_checked_at == None:
+            # 首次检查，尚无从估计速率，尽快再检查一次
+            interval = policy.min_interval
+        else:
+            elapsed = max(checked_at - self.last_checked_at, 1)
+            observed_rate = max(reply_count - self.reply_count, 0) / elapsed
+            self.reply_rate = policy.smoothing * observed_rate + \
+                (1 - policy.smoothing) * self.reply_rate
+            interval = policy.next_interval(self.reply_rate)
+        self.reply_count = reply_count
+        self.last_checked_at = checked_at
+        self.next_check_at = checked_at + interval
+        return grew
+
+
+class DumpDaemon:
+    """
+    持续按清单转存串的守护进程。
+
+    所有串放在以下次检查时间排序的堆中，到期的串会被交给线程池转存，
+    完成后根据回应数的变化重新安排下次检查的时间。
+    所有转存共用同一个客户端，因此也共用其连接池与请求调度器的速率限制。
+
+    清单文件在运行期间被修改时会被重新读取。
+    各串的活跃程度保存在状态文件中，重启后沿用。
+    """
+
+    MANIFEST_POLL_INTERVAL = 30
+
+    def __init__(
+        self,
+        client: anobbsclient.Client,
+        manifest_path: Path,
+        state_file_path: Path,
+        policy: PollingPolicy,
+        thread_concurrency: int = 4,
+        page_concurrency: int = 1,
+        dump_format: str = "legacy",
+        on_update_command: Optional[str] = None,
+    ):
+        """
+        Parameters
+        ----------
+        on_update_command : str?
+            串有新回应并转存完成后执行的命令，如调用渲染程序。
+            命令中的 `{thread_id}` 与 `{dump_folder_path}` 会被替换为对应的值。
+        """
+        self.client = client
+        self.manifest_path = manifest_path
+        self.state_file_path = state_file_path
+        self.policy = policy
+        self.thread_concurrency = thread_concurrency
+        self.page_concurrency = page_concurrency
+        self.dump_format = dump_format
+        self.on_update_command = on_update_command
+
+        self.interrupt_event = threading.Event()
+        self.__activities: Dict[int, ThreadActivity] = self.__load_state()
+        self.__heap: List[Tuple[float, int]] = []
+        self.__manifest_mtime = None
+
+    def run(self):
+        """
+        运行直到收到键盘中断。
+        """
+        running: Dict[Future, ThreadActivity] = {}
+        last_manifest_polled_at = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.thread_concurrency) as executor:
+                # 需要在离开 `with` 之前中断各转存任务，
+                # 否则 `executor` 会先等待正在进行的转存完整结束
+                try:
+                    while not self.interrupt_event.is_set():
+                        now = time.time()
+                        if now - last_manifest_polled_at >= DumpDaemon.MANIFEST_POLL_INTERVAL:
+                            self.__reload_manifest_if_modified()
+                            last_manifest_polled_at = now
+
+                        running_thread_ids = set(
+                            map(lambda activity: activity.thread_id, running.values()))
+                        while len(running) < self.thread_concurrency:
+                            activity = self.__pop_due(now, running_thread_ids)
+                            if activity == None:
+                                break
+                            running[executor.submit(
+                                self.__check, activity)] = activity
+                            running_thread_ids.add(activity.thread_id)
+
+                        timeout = DumpDaemon.MANIFEST_POLL_INTERVAL
+                        if len(self.__heap) > 0 and len(running) < self.thread_concurrency:
+                            timeout = min(timeout, max(
+                                self.__heap[0][0] - now, 0))
+                        if len(running) > 0:
+                            (done, _) = wait(running.keys(), timeout=timeout,
+                                             return_when=FIRST_COMPLETED)
+                            for future in done:
+                                self.__finish_check(
+                                    running.pop(future), future)
+                        else:
+                            self.interrupt_event.wait(timeout)
+                except KeyboardInterrupt:
+                    logging.warning("收到用户键盘中断，将等待正在进行的转存中断后退出")
+                    self.interrupt_event.set()
+                    for (future, activity) in running.items():
+                        self.__finish_check(activity, future)
+        finally:
+            self.__save_state()
+
+    def __pop_due(self, now: float, running_thread_ids: set) -> Optional[ThreadActivity]:
+        while len(self.__heap) > 0 and self.__heap[0][0] <= now:
+            (next_check_at, thread_id) = heapq.heappop(self.__heap)
+            activity = self.__activities.get(thread_id, None)
+            # 堆中可能残留已从清单移除、或已被重新安排的旧条目
+            if activity == None or activity.next_check_at != next_check_at \
+                    or thread_id in running_thread_ids:
+                continue
+            return activity
+        return None
+
+    def __schedule(self, activity: ThreadActivity):
+        heapq.heappush(self.__heap, (activity.next_check_at,
+                                     activity.thread_id))
+
+    def __check(self, activity: ThreadActivity) -> Optional[int]:
+        """
+        转存串，并返回转存后的回应数。转存中断时返回空。
+        """
+        logging.info(f"检查串 {activity.thread_id}")
+        is_complete = dump_thread(
+            client=self.client,
+            thread_id=activity.thread_id,
+            dump_folder_path=activity.dump_folder_path,
+            concurrency=self.page_concurrency,
+            interrupt_event=self.interrupt_event,
+            dump_format=self.dump_format,
+        )
+        if not is_complete:
+            return None
+        trace = Trace.load(activity.dump_folder_path / ".trace.json")
+        if trace == None:
+            return None
+        return trace.known_reply_count
+
+    def __finish_check(self, activity: ThreadActivity, future: Future):
+        now = time.time()
+        e = future.exception()
+        if isinstance(e, ThreadIDMismatchException):
+            logging.error(
+                f'串 {activity.thread_id} 与转存文件夹 `{activity.dump_folder_path}` 中的串号 {e.dumped_thread_id} 不一致，将不再检查')
+            self.__activities.pop(activity.thread_id, None)
+            self.__save_state()
+            return
+        reply_count = future.result() if e == None else None
+        if e != None:
+            logging.error(f"检查串 {activity.thread_id} 失败，{e!r}", exc_info=e)
+
+        if reply_count == None:
+            # 转存未完成，不更新速率估计，稍后重试
+            activity.next_check_at = now + self.policy.min_interval
+        else:
+            old_reply_count = activity.reply_count
+            grew = activity.observe(reply_count, now, self.policy)
+            logging.info(
+                f"串 {activity.thread_id}：回应数 {old_reply_count} → {reply_count}，"
+                + f"估计每小时 {activity.reply_rate*3600:.2f} 个新回应，"
+                + f"{activity.next_check_at - now:.0f} 秒后再次检查")
+            # 首次检查时无从得知是否有更新，也交给更新命令自行判断
+            if grew and not self.interrupt_event.is_set():
+                self.__run_on_update_command(activity)
+
+        if activity.thread_id in self.__activities:
+            self.__schedule(activity)
+        self.__save_state()
+
+    def __run_on_update_command(self, activity: ThreadActivity):
+        if self.on_update_command == None:
+            return
+        command = list(map(lambda arg: arg.format(
+            thread_id=activity.thread_id,
+            dump_folder_path=activity.dump_folder_path,
+        ), shlex.split(self.on_update_command)))
+        logging.info(f"串 {activity.thread_id} 有更新，执行：{command}")
+        result = subprocess.run(command)
+        if result.returncode != 0:
+            logging.error(
+                f"串 {activity.thread_id} 的更新命令以 {result.returncode} 退出")
+
+    def __reload_manifest_if_modified(self):
+        mtime = os.stat(self.manifest_path).st_mtime
+        if mtime == self.__manifest_mtime:
+            return
+        self.__manifest_mtime = mtime
+
+        entries = load_thread_manifest(self.manifest_path)
+        thread_ids = set(map(lambda entry: entry.thread_id, entries))
+        for thread_id in list(self.__activities.keys()):
+            if thread_id not in thread_ids:
+                logging.info(f"串 {thread_id} 已从清单中移除")
+                self.__activities.pop(thread_id)
+        for entry in entries:
+            activity = self.__activities.get(entry.thread_id, None)
+            if activity == None:
+                activity = ThreadActivity(
+                    thread_id=entry.thread_id,
+                    dump_folder_path=entry.dump_folder_path,
+                )
+                self.__activities[entry.thread_id] = activity
+            else:
+                activity.dump_folder_path = entry.dump_folder_path
+        self.__heap = list(map(lambda activity: (
+            activity.next_check_at, activity.thread_id), self.__activities.values()))
+        heapq.heapify(self.__heap)
+        logging.info(f"清单中共有{len(entries)}个串")
+
+    def __load_state(self) -> Dict[int, ThreadActivity]:
+        try:
+            with open(self.state_file_path) as state_file:
+                obj = json.load(state_file)
+        except FileNotFoundError:
+            return {}
+        return dict(map(lambda activity_obj: (
+            activity_obj["thread_id"], ThreadActivity.load_from_obj(activity_obj)), obj["threads"]))
+
+    def __save_state(self):
+        tmp_state_file_path = self.state_file_path.parent / \
+            f"_{self.state_file_path.name}"
+        with open(tmp_state_file_path, "w+") as state_file:
+            json.dump({
+                "threads": list(map(lambda activity: activity.as_obj(), self.__activities.values())),
+            }, state_file, indent=2)
+        os.replace(tmp_state_file_path, self.state_file_path)
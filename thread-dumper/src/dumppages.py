@@ -1,18 +1,23 @@
-from typing import Optional, OrderedDict, Any, List, Tuple
+from typing import Optional, OrderedDict, Any, List, Tuple, Dict
 
 from pathlib import Path
+from concurrent.futures import Executor
 import shutil
 import json
 import os
+import threading
+import queue
+import tempfile
 
 import anobbsclient
 
-from .fetchpages import fetch_page_range_back_to_front
+from .fetchpages import fetch_page_range_back_to_front, Page
 
 
 import sys
 sys.path.append(str(Path(__file__).parent.parent.parent / "commons"))
 from dumpedpages import PageInfo, get_page_name_and_status  # noqa: E402
+from packeddump import PageStore, open_page_store  # noqa: E402
 
 
 def dump_page_range_back_to_front(
@@ -21,9 +26,36 @@ def dump_page_range_back_to_front(
     thread_id: int,
     from_upper_bound_page_number: int,
     to_lower_bound_page_number: int,
-    gatekeeper_post_id: Optional[int]
+    gatekeeper_post_id: Optional[int],
+    lower_bound_post_id: Optional[int] = None,
+    page_store: Optional[PageStore] = None,
+    page_cache: Optional["PageCache"] = None,
+    concurrency: int = 1,
+    executor: Optional[Executor] = None,
+    interrupt_event: Optional[threading.Event] = None,
 ) -> Tuple[Optional[int], bool, Optional[int]]:
     """
+    Parameters
+    ----------
+    lower_bound_post_id : int?
+        预先确定的串号下界。
+        如果为空且页数下界大于 1，则会从已转存的页面中读取。
+        多轮同时进行时，应在各轮开始前预先确定，以免读到其他轮正在改写的页面。
+
+    page_store : PageStore?
+        转存文件夹的页面存储，即原格式的页面清单或打包格式的页面存储。
+        提交页面时会一并更新。
+        多轮同时进行时应共用同一个页面存储。
+        如果为空，则会打开转存文件夹中的页面存储。
+
+    page_cache : PageCache?
+        已转存页面的缓存，多轮之间应共用同一个缓存。
+
+    concurrency : int
+    executor : Executor?
+    interrupt_event : threading.Event?
+        见 `fetch_page_range_back_to_front`。
+
     Returns
     -------
     int?
@@ -37,69 +69,237 @@ def dump_page_range_back_to_front(
         当前回应数
     """
 
-    lower_bound_post_id = None
-    if to_lower_bound_page_number > 1:
+    if page_store == None:
+        page_store = open_page_store(dump_folder_path, examines_pages=True)
+
+    if lower_bound_post_id == None and to_lower_bound_page_number > 1:
         lower_bound_post_id = get_lower_bound_post_id(
             pages_folder_path=dump_folder_path / "pages",
             page_number=to_lower_bound_page_number,
+            page_store=page_store,
         )
 
-    (pages, current_round_max_seen_post_id, aborted) = fetch_page_range_back_to_front(
-        client=client,
-        thread_id=thread_id,
-        from_upper_bound_page_number=from_upper_bound_page_number,
-        to_lower_bound_page_number=to_lower_bound_page_number,
-        lower_bound_post_id=lower_bound_post_id,
-        gatekeeper_post_id=gatekeeper_post_id,
+    writer = StagedPageWriter(
+        dump_folder_path=dump_folder_path,
+        page_store=page_store,
+        page_cache=page_cache,
     )
+    try:
+        (last_page, current_round_max_seen_post_id, aborted) = fetch_page_range_back_to_front(
+            client=client,
+            thread_id=thread_id,
+            from_upper_bound_page_number=from_upper_bound_page_number,
+            to_lower_bound_page_number=to_lower_bound_page_number,
+            lower_bound_post_id=lower_bound_post_id,
+            gatekeeper_post_id=gatekeeper_post_id,
+            page_consumer=writer.put,
+            concurrency=concurrency,
+            executor=executor,
+            interrupt_event=interrupt_event,
+        )
+    except BaseException:
+        writer.discard()
+        raise
 
-    if pages == None:
+    if last_page == None:
+        writer.discard()
         return current_round_max_seen_post_id, aborted, None
 
-    pages_folder_path = dump_folder_path / "pages"
+    writer.put(last_page, is_last=True, aborted=aborted)
+    writer.commit()
 
-    for (i, page) in enumerate(pages):
-        (previous_name, _) = get_page_name_and_status(
-            pages_folder_path=pages_folder_path,
-            page_number=page.page_number,
-        )
+    thread_body = last_page.thread_body
+    reply_count = thread_body.total_reply_count
+    # 多轮同时进行时可能会同时写入，因此先写入临时文件再替换
+    thread_file_path = dump_folder_path / "thread.json"
+    tmp_thread_file_path = dump_folder_path / \
+        f"_thread.json.{threading.get_ident()}"
+    with open(tmp_thread_file_path, "w+") as thread_file:
+        json.dump(thread_body.raw_copy(keeps_reply_count=False),
+                  thread_file, indent=2, ensure_ascii=False)
+    os.replace(tmp_thread_file_path, thread_file_path)
+
+    return current_round_max_seen_post_id, aborted, reply_count
+
+
+class StagedPageWriter:
+    """
+    在后台线程中将获取到的页面逐页与已转存的内容合并，并写入暂存文件夹。
+
+    获取与写入之间以有界队列相连，因此内存中只会保留有限的几页。
+    由于本轮结果在遇到「卡99」、未登陆等情况时需要整体抛弃，
+    写入的页面只有在 `commit` 后才会提交到页面存储中，
+    即替换 `pages` 文件夹中的页面并更新页面清单，或是追加到打包格式的分段文件中。
+    """
+
+    STAGING_FOLDER_PREFIX = ".staging-"
+
+    def __init__(
+        self, dump_folder_path: Path, page_store: PageStore,
+        page_cache: Optional["PageCache"] = None, queue_size: int = 4,
+    ):
+        self.page_store = page_store
+        self.page_cache = page_cache
+        self.staging_folder_path = Path(tempfile.mkdtemp(
+            prefix=StagedPageWriter.STAGING_FOLDER_PREFIX, dir=dump_folder_path))
+
+        self.__staged: List[PageInfo] = []
+        # 本轮的第一页与最后一页最有可能被之后的轮次再次用到，
+        # 保留其合并后的内容，在提交后放入缓存
+        self.__retained_pages: Dict[int, List[Dict[str, Any]]] = {}
+        self.__written_count = 0
+        self.__error: Optional[BaseException] = None
+
+        self.__queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def put(self, page: Page, is_last: bool = False, aborted: bool = False):
+        """
+        将页面加入写入队列。
+        队列已满时会阻塞，直到后台线程写入了之前的页面。
+
+        页面需按获取的顺序，即页数从大到小的顺序加入。
+        """
+        self.__queue.put((page, is_last, aborted))
+
+    def commit(self):
+        """
+        等待所有页面写入暂存文件夹，之后将暂存的页面提交到页面存储中。
+        """
+        self.__join()
+
+        self.page_store.commit_staged_pages(
+            self.staging_folder_path, self.__staged)
+
+        if self.page_cache != None:
+            for page_info in self.__staged:
+                replies = self.__retained_pages.get(page_info.number, None)
+                if replies != None:
+                    self.page_cache.put(page_info.number, replies)
+                else:
+                    self.page_cache.invalidate(page_info.number)
+
+        shutil.rmtree(self.staging_folder_path, ignore_errors=True)
+
+    def discard(self):
+        """
+        抛弃所有暂存的页面。
+        """
+        try:
+            self.__join(raises=False)
+        finally:
+            shutil.rmtree(self.staging_folder_path, ignore_errors=True)
+
+    def __join(self, raises: bool = True):
+        self.__queue.put(None)
+        self.__thread.join()
+        if raises and self.__error != None:
+            raise self.__error
 
-        current_page_replies = page.replies
-        if previous_name != None:
-            previous_page_path = pages_folder_path / previous_name
-            with open(previous_page_path) as previous_page_file:
-                previous_page_replies = list(
-                    map(lambda post: anobbsclient.Post(post), json.load(previous_page_file)))
-                current_page_replies = merge_posts(
-                    previous_page_replies, current_page_replies)
-
-            tmp_path = pages_folder_path / f"_{previous_name}"
-            shutil.move(previous_page_path, tmp_path)
-
-        if i == 0 and len(page.replies) != 19:
-            current_name = f"{page.page_number}.incomplete.json"
-        elif aborted and i == len(pages) - 1:
-            current_name = f"{page.page_number}.previous-page-unchecked.json"
+    def __run(self):
+        while True:
+            item = self.__queue.get()
+            if item == None:
+                return
+            if self.__error != None:
+                # 出错后只消耗队列，以免获取页面的一方阻塞
+                continue
+            try:
+                self.__write(*item)
+            except BaseException as e:
+                self.__error = e
+
+    def __write(self, page: Page, is_last: bool, aborted: bool):
+        previous_page_info = self.page_store.get(page.page_number)
+
+        current_page_raw_replies = list(
+            map(lambda post: post.raw_copy(), page.replies))
+        if previous_page_info != None:
+            previous_page_raw_replies = None
+            if self.page_cache != None:
+                previous_page_raw_replies = self.page_cache.get(
+                    page.page_number)
+            if previous_page_raw_replies == None:
+                previous_page_raw_replies = self.page_store.read_page_replies(
+                    previous_page_info)
+            current_page_raw_replies = merge_posts(
+                previous_page_raw_replies, current_page_raw_replies)
+
+        if self.__written_count == 0 and len(page.replies) != 19:
+            current_status = PageInfo.Status.INCOMPLETE
+        elif aborted and is_last:
+            current_status = PageInfo.Status.PREVIOUS_PAGE_UNCHECKED
         else:
-            current_name = f"{page.page_number}.json"
+            current_status = PageInfo.Status.COMPLETE
 
-        with open(pages_folder_path / current_name, "w+") as current_file:
-            json.dump(list(map(lambda post: post.raw_copy(), current_page_replies)), current_file,
-                      indent=2, ensure_ascii=False)
+        page_info = PageInfo.from_replies(
+            page.page_number, current_status, current_page_raw_replies)
 
-        if previous_name != None:
-            os.remove(tmp_path)
+        with open(self.staging_folder_path / page_info.filename(), "wb+") as current_file:
+            current_file.write(
+                self.page_store.encode_page(current_page_raw_replies))
 
-    thread_body = pages[-1].thread_body
-    reply_count = thread_body.total_reply_count
-    with open(dump_folder_path / "thread.json", "w+") as thread_file:
-        json.dump(thread_body.raw_copy(keeps_reply_count=False),
-                  thread_file, indent=2, ensure_ascii=False)
+        self.__staged.append(page_info)
+        self.__written_count += 1
 
-    return current_round_max_seen_post_id, aborted, reply_count
+        if self.page_cache != None:
+            if self.__written_count == 1 or is_last:
+                self.__retained_pages[page.page_number] = current_page_raw_replies
+
+
+class PageCache:
+    """
+    已转存页面的 LRU 缓存，以页数为键，值为页面中各回应的原始数据。
+
+    只缓存已提交的页面，用于让之后的轮次合并页面时不必再读取并解析同一页。
+    缓存中的数据不应被修改。
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.capacity = capacity
+        self.__pages: OrderedDict[int, List[Dict[str, Any]]] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, page_number: int) -> Optional[List[Dict[str, Any]]]:
+        with self.__lock:
+            replies = self.__pages.get(page_number, None)
+            if replies != None:
+                self.__pages.move_to_end(page_number)
+            return replies
+
+    def put(self, page_number: int, replies: List[Dict[str, Any]]):
+        with self.__lock:
+            self.__pages[page_number] = replies
+            self.__pages.move_to_end(page_number)
+            while len(self.__pages) > self.capacity:
+                self.__pages.popitem(last=False)
 
+    def invalidate(self, page_number: int):
+        with self.__lock:
+            self.__pages.pop(page_number, None)
+
+
+def remove_stale_staging_folders(dump_folder_path: Path):
+    """
+    移除之前因程序意外退出而残留的暂存文件夹。
+    """
+    for path in dump_folder_path.glob(f"{StagedPageWriter.STAGING_FOLDER_PREFIX}*"):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def get_lower_bound_post_id(
+    pages_folder_path: Path, page_number: int,
+    page_store: Optional[PageStore] = None,
+) -> int:
+    if page_store != None:
+        page_info = page_store.get(
+            page_number) or page_store.get(page_number-1)
+        if page_info.last_post_id != None:
+            return page_info.last_post_id
+        posts = page_store.read_page_replies(page_info)
+        return int(posts[-1]["id"])
 
-def get_lower_bound_post_id(pages_folder_path: Path, page_number: int) -> int:
     (name, _) = get_page_name_and_status(
         pages_folder_path=pages_folder_path,
         page_number=page_number,
@@ -115,10 +315,36 @@ def get_lower_bound_post_id(pages_folder_path: Path, page_number: int) -> int:
         return int(posts[-1]["id"])
 
 
-def merge_posts(a: List[anobbsclient.Post], b: List[anobbsclient.Post]):
-    a = {int(post.id): post for post in a}
-    b = {int(post.id): post for post in b}
-    a.update(b)
-    a = [post for (_, post) in a.items()]
-    a = sorted(a, key=lambda post: int(post.id))
-    return a
+def merge_posts(a: List[Dict[str, Any]], b: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    合并两组回应的原始数据，串号相同时以 `b` 为准，结果按串号排序。
+
+    两组回应通常都已按串号排序，因此线性地归并即可；
+    但越过页数下界获取到的回应会接在后面，此时需要先排序。
+    """
+    (a, b) = (sort_posts_if_needed(a), sort_posts_if_needed(b))
+
+    merged = []
+    (i, j) = (0, 0)
+    while i < len(a) and j < len(b):
+        a_id, b_id = int(a[i]["id"]), int(b[j]["id"])
+        if a_id < b_id:
+            merged.append(a[i])
+            i += 1
+        elif a_id > b_id:
+            merged.append(b[j])
+            j += 1
+        else:
+            merged.append(b[j])
+            (i, j) = (i + 1, j + 1)
+    merged.extend(a[i:])
+    merged.extend(b[j:])
+    return merged
+
+
+def sort_posts_if_needed(posts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    if all(int(posts[i-1]["id"]) < int(posts[i]["id"]) for i in range(1, len(posts))):
+        return posts
+    # 与原先的做法一致，串号重复时保留靠后的那个
+    posts = {int(post["id"]): post for post in posts}
+    return [posts[post_id] for post_id in sorted(posts.keys())]
@@ -0,0 +1,342 @@
+from typing import List, Tuple, Optional, Dict
+
+import logging
+from pathlib import Path
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import anobbsclient
+
+from .dumppages import dump_page_range_back_to_front, get_lower_bound_post_id, remove_stale_staging_folders, PageCache
+from .exceptions import ThreadIDMismatchException
+from .responsecache import ResponseCache
+from ._trace import Trace, needs_update
+
+import sys
+sys.path.append(str(Path(__file__).parent.parent.parent / "commons"))
+from dumpedpages import PageManifest, get_page_ranges_for_dumping  # noqa: E402
+from packeddump import PageStore, PackedPageStore, open_page_store  # noqa: E402
+
+
+def dump_thread(
+    client: anobbsclient.Client,
+    thread_id: int,
+    dump_folder_path: Path,
+    concurrency: int = 1,
+    interrupt_event: Optional[threading.Event] = None,
+    uses_trace: bool = True,
+    dump_format: str = "legacy",
+    page_cache: Optional[PageCache] = None,
+    probe_cache_ttl: float = 0,
+) -> bool:
+    """
+    将串转存到转存文件夹中。
+    如果转存文件夹已存在，只转存之前尚未完成的部分。
+
+    完整结束后会在转存文件夹中记录状态追踪文件 `.trace.json`。
+    之后再次转存时，如果状态追踪文件存在，
+    便只需对比第一页的回应数来判断有无更新，
+    有更新时也只需从上次转存的最后一页开始获取，而不必检查整个转存文件夹。
+
+    Parameters
+    ----------
+    concurrency : int
+        同时获取页面的最大数量。
+
+    interrupt_event : threading.Event?
+        在非主线程中转存时，用于转达用户的键盘中断。
+
+    uses_trace : bool
+        是否使用状态追踪文件。
+        如果为假，则总是检查整个转存文件夹来找出尚未完成的部分。
+
+    dump_format : str
+        新建转存文件夹时页面的存储格式。
+        `legacy` 为在 `pages` 文件夹下逐页存放，`packed` 为打包格式。
+        已存在的转存文件夹沿用其原有的格式。
+
+    page_cache : PageCache?
+        已转存页面的缓存，在本次转存的各轮之间共用。
+        如果为空，则会为本次转存新建一个。
+        多次转存同一个串时可以传入同一个缓存。
+
+    probe_cache_ttl : float
+        转存前试探性请求的第一页与守门页的响应在磁盘上缓存的有效期，单位为秒。
+        有效期内再次转存时会直接使用缓存，因此在此期间内新增的回应要等缓存过期后才会被发现。
+        为 0 时不缓存。
+
+    Returns
+    -------
+    bool
+        是否完整结束，即没有因「卡99」、未登陆、用户中断等原因而中断。
+
+    Raises
+    ------
+    ThreadIDMismatchException
+        如果串号与先前转存的串号不一致。
+    """
+
+    if dump_folder_path.exists():
+        # 旧转存文件夹存在，检查串号前后是否一致
+        dumped_thread_path = dump_folder_path / "thread.json"
+        with open(dumped_thread_path) as dumped_thread_file:
+            dumped_thread = json.load(dumped_thread_file)
+        dumped_thread_id = int(dumped_thread["id"])
+        if thread_id != dumped_thread_id:
+            raise ThreadIDMismatchException(
+                thread_id=thread_id,
+                dumped_thread_id=dumped_thread_id,
+            )
+
+    response_cache = ResponseCache(
+        dump_folder_path / ".response-cache", ttl=probe_cache_ttl)
+
+    first_page = response_cache.get_thread_page(client, thread_id, page=1)
+    page_count = (int(first_page.total_reply_count) - 1) // 19 + 1
+
+    trace_file_path = dump_folder_path / ".trace.json"
+    trace = None
+    if uses_trace and dump_folder_path.exists():
+        trace = Trace.load(trace_file_path)
+
+    # 已知的各页的串号下界，用于省去从转存文件中读取
+    known_lower_bound_post_ids = {}
+
+    if trace != None:
+        if not needs_update(trace, first_page.total_reply_count):
+            logging.info(
+                f"串 {thread_id} 的回应数 {first_page.total_reply_count} 没有增加，无需转存")
+            return True
+        # 之前完整转存过，只需从上次转存的最后一页开始
+        page_ranges = [(trace.last_dumped_page_number, None)]
+        if trace.last_dumped_page_number > 1:
+            known_lower_bound_post_ids[trace.last_dumped_page_number] = trace.last_dumped_post_id
+
+    pages_folder_path = dump_folder_path / "pages"
+
+    if dump_folder_path.exists():
+        # 有状态追踪文件时只会转存末尾几页，无需读取各页来补全清单中的串号范围
+        page_store = open_page_store(
+            dump_folder_path, examines_pages=trace == None)
+        if trace == None:
+            # 旧转存文件夹存在，检查旧文件夹来找出之前尚未完成的页数范围
+            page_ranges = get_page_ranges_for_dumping(
+                page_store.page_info_list(), 100)
+    else:
+        dump_folder_path.mkdir(parents=True)
+        if dump_format == "packed":
+            page_store = PackedPageStore.create(dump_folder_path)
+        else:
+            pages_folder_path.mkdir(parents=True)
+            page_store = PageManifest(dump_folder_path, {})
+        page_ranges = [(1, None)]
+
+    # 中途出错时也要关闭页面存储，以免打包格式的 mmap 泄漏
+    try:
+        if trace_file_path.exists():
+            # 转存中途中断时，之前的状态追踪文件便不再可信
+            os.remove(trace_file_path)
+        remove_stale_staging_folders(dump_folder_path)
+
+        logging.info(f"所有将要转存的页面的范围：{page_ranges}")
+
+        if page_cache == None:
+            page_cache = PageCache()
+
+        needs_extra_round, should_abort = False, False
+        resolved_page_ranges = []
+        for page_range in page_ranges:
+            (start_page, end_page) = page_range
+            if end_page == None:
+                if start_page < 100 and page_count > 100:
+                    needs_extra_round = True
+                    end_page = 100
+                else:
+                    end_page = page_count
+            resolved_page_ranges.append((start_page, end_page))
+
+        max_seen_id = None
+        reply_count = None
+        last_page_number = None
+        i = 0
+        if concurrency > 1:
+            # 不超过守门页的各轮用不到守门串号，彼此独立，可以同时进行；
+            # 之后的各轮依旧逐轮进行，以便像原来一样将上一轮见到的最大串号作为守门串号
+            concurrent_page_ranges = list(filter(
+                lambda page_range: page_range[1] <= 100, resolved_page_ranges))
+            if len(concurrent_page_ranges) > 1:
+                (max_seen_id, should_abort, reply_count) = dump_page_ranges_concurrently(
+                    dump_folder_path=dump_folder_path,
+                    client=client,
+                    thread_id=thread_id,
+                    page_ranges=concurrent_page_ranges,
+                    page_store=page_store,
+                    page_cache=page_cache,
+                    known_lower_bound_post_ids=known_lower_bound_post_ids,
+                    concurrency=concurrency,
+                    interrupt_event=interrupt_event,
+                )
+                i = len(concurrent_page_ranges)
+                last_page_number = concurrent_page_ranges[-1][1]
+        while (not should_abort) and i < len(resolved_page_ranges):
+            (start_page, end_page) = resolved_page_ranges[i]
+            logging.info(
+                f"第{i+1}/{len(page_ranges)}轮，范围：{page_ranges[i]}")
+            if end_page > 100:
+                if not client.has_cookie():
+                    logging.warning("守门页后仍有待转存页面，但由于尚未登陆，无法获取。将结束")
+                    should_abort = True
+                    break
+                if max_seen_id == None:
+                    page100 = response_cache.get_thread_page(
+                        client, thread_id, page=100)
+                    max_seen_id = int(page100.replies[-1].id)
+            (max_seen_id, should_abort, reply_count) = dump_page_range_back_to_front(
+                dump_folder_path=dump_folder_path,
+                client=client,
+                thread_id=thread_id,
+                from_upper_bound_page_number=end_page,
+                to_lower_bound_page_number=start_page,
+                gatekeeper_post_id=max_seen_id,
+                lower_bound_post_id=known_lower_bound_post_ids.get(start_page),
+                page_store=page_store,
+                page_cache=page_cache,
+                concurrency=concurrency,
+                interrupt_event=interrupt_event,
+            )
+            last_page_number = end_page
+            i += 1
+        if (not should_abort) and needs_extra_round:
+            if reply_count == None:
+                page100 = response_cache.get_thread_page(
+                    client, thread_id, page=100)
+                reply_count = int(page100.total_reply_count)
+
+            last_page_number = (reply_count-1)//19+1
+            (_, should_abort, _) = dump_page_range_back_to_front(
+                dump_folder_path=dump_folder_path,
+                client=client,
+                thread_id=thread_id,
+                from_upper_bound_page_number=last_page_number,
+                to_lower_bound_page_number=100,
+                gatekeeper_post_id=max_seen_id,
+                page_store=page_store,
+                page_cache=page_cache,
+                concurrency=concurrency,
+                interrupt_event=interrupt_event,
+            )
+
+        # 被改写过的页面的缓存已经过时
+        for (start_page, end_page) in resolved_page_ranges:
+            response_cache.invalidate_range(thread_id, start_page, end_page)
+        if needs_extra_round:
+            response_cache.invalidate_range(thread_id, 100, None)
+
+        if isinstance(page_store, PackedPageStore) and page_store.garbage_ratio() > 0.5:
+            logging.info("打包转存中被取代的旧记录已过半，将进行整理")
+            page_store.compact()
+    finally:
+        page_store.close()
+
+    if not should_abort and last_page_number != None:
+        save_trace(
+            trace_file_path=trace_file_path,
+            page_store=page_store,
+            thread_id=thread_id,
+            known_reply_count=first_page.total_reply_count,
+            last_page_number=last_page_number,
+        )
+
+    return not should_abort
+
+
+def save_trace(
+    trace_file_path: Path, page_store: PageStore,
+    thread_id: int, known_reply_count: int, last_page_number: int,
+):
+    last_page_info = page_store.get(last_page_number)
+    if last_page_info == None or last_page_info.last_post_id == None:
+        return
+
+    Trace(
+        thread_id=thread_id,
+        known_reply_count=known_reply_count,
+        last_dumped_post_id=last_page_info.last_post_id,
+        last_dumped_page_number=last_page_number,
+    ).save(trace_file_path)
+
+
+def dump_page_ranges_concurrently(
+    dump_folder_path: Path,
+    client: anobbsclient.Client,
+    thread_id: int,
+    page_ranges: List[Tuple[int, int]],
+    concurrency: int,
+    page_store: PageStore,
+    page_cache: Optional[PageCache] = None,
+    known_lower_bound_post_ids: Dict[int, int] = {},
+    interrupt_event: Optional[threading.Event] = None,
+) -> Tuple[Optional[int], bool, Optional[int]]:
+    """
+    同时转存多个互不相交、且都不超过守门页的页数范围。
+
+    各轮共用同一个获取页面的执行器，因此同时进行的请求数不会超过 `concurrency`。
+
+    Returns
+    -------
+    同 `dump_page_range_back_to_front`，
+    其中最大串号与回应数取自页数最大的一轮，与逐轮进行时最后一轮的结果对应。
+    """
+
+    pages_folder_path = dump_folder_path / "pages"
+
+    # 某轮的串号下界可能来自上一轮的最后一页，
+    # 为了不读到正在被改写的页面，在开始前统一确定
+    lower_bound_post_ids = list(map(
+        lambda page_range: known_lower_bound_post_ids.get(page_range[0]) or get_lower_bound_post_id(
+            pages_folder_path=pages_folder_path,
+            page_number=page_range[0],
+            page_store=page_store,
+        ) if page_range[0] > 1 else None,
+        page_ranges,
+    ))
+
+    logging.info(f"将同时转存{len(page_ranges)}轮，范围：{page_ranges}")
+
+    if interrupt_event == None:
+        interrupt_event = threading.Event()
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as page_executor, \
+            ThreadPoolExecutor(max_workers=len(page_ranges)) as round_executor:
+        futures = []
+        for ((start_page, end_page), lower_bound_post_id) in zip(page_ranges, lower_bound_post_ids):
+            futures.append(round_executor.submit(
+                dump_page_range_back_to_front,
+                dump_folder_path=dump_folder_path,
+                client=client,
+                thread_id=thread_id,
+                from_upper_bound_page_number=end_page,
+                to_lower_bound_page_number=start_page,
+                gatekeeper_post_id=None,
+                lower_bound_post_id=lower_bound_post_id,
+                page_store=page_store,
+                page_cache=page_cache,
+                concurrency=concurrency,
+                executor=page_executor,
+                interrupt_event=interrupt_event,
+            ))
+        for future in futures:
+            while True:
+                try:
+                    results.append(future.result())
+                    break
+                except KeyboardInterrupt:
+                    # 键盘中断只会发送到主线程，需要转告给各轮
+                    logging.warning("收到用户键盘中断，将通知各轮中断")
+                    interrupt_event.set()
+
+    should_abort = any(map(lambda result: result[1], results))
+    (max_seen_id, _, reply_count) = results[-1]
+    return (max_seen_id, should_abort, reply_count)
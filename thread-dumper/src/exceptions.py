@@ -0,0 +1,22 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class ThreadIDMismatchException(Exception):
+    """
+    指定的串号与转存文件夹中 `thread.json` 的串号不一致时会抛出的异常。
+    """
+
+    thread_id: int
+    dumped_thread_id: int
+
+
+@dataclass
+class RequestRetriesExhaustedException(Exception):
+    """
+    请求持续遇到暂时性错误，超过最大尝试次数时会抛出的异常。
+    """
+
+    description: str
+    attempts: int
+    last_exception: Exception
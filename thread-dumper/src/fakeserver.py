@@ -0,0 +1,365 @@
+from __future__ import annotations
+from typing import List, Any, Optional, OrderedDict, Set
+from dataclasses import dataclass, field
+
+import logging
+import json
+import random
+import time
+import threading
+import argparse
+from hashlib import sha256
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+@dataclass
+class FakeThreadConfiguration:
+    """
+    假服务器上合成的串的配置。
+    """
+
+    thread_id: int = 10000000
+    page_count: int = 200
+    """串的页数。最后一页的回应数由 `last_page_reply_count` 决定。"""
+    last_page_reply_count: int = 7
+
+    latency: float = 0.05
+    """每次请求的基础延迟，单位为秒。"""
+    jitter: float = 0.0
+    """在基础延迟上随机增加的延迟的上限，单位为秒。"""
+
+    deletion_count: int = 0
+    """会被删除的回应的数量。被删除的回应之后的回应会前移，使分页发生位移。"""
+    delete_after_request_count: int = 0
+    """在收到这么多次请求后才删除回应，以模拟转存途中发生的删除。"""
+
+    attachment_rate: float = 0.0
+    """带有附件的回应所占的比例。"""
+    attachment_pool_size: int = 50
+    """不同附件的数量。多个回应可能引用同一个附件。"""
+
+    error_rate: float = 0.0
+    """请求以此概率返回 503，以模拟服务器繁忙。"""
+
+    gatekeeper_page_number: int = 100
+    """未带饼干获取超过此页数的页面时，服务器会返回此页的内容，即「卡99」。"""
+
+    injects_tip_post: bool = True
+    """是否像真实的服务器那样，在每页回应中插入一条「芦苇」的提示串。"""
+
+    seed: int = 0
+
+
+@dataclass
+class FakeServerStatistics:
+    request_count: int = 0
+    gatekept_request_count: int = 0
+    failed_request_count: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, gatekept: bool = False, failed: bool = False):
+        with self.lock:
+            self.request_count += 1
+            if gatekept:
+                self.gatekept_request_count += 1
+            if failed:
+                self.failed_request_count += 1
+
+
+class FakeThread:
+
+    PAGE_SIZE = 19
+    TIP_POST_ID = 9999999
+
+    def __init__(self, cfg: FakeThreadConfiguration):
+        self.cfg = cfg
+        self.__random = random.Random(cfg.seed)
+        reply_count = (cfg.page_count - 1) * FakeThread.PAGE_SIZE + \
+            cfg.last_page_reply_count
+        # 回应串号有间隔，以模拟其他串的回应穿插其中
+        self.__reply_ids: List[int] = []
+        post_id = cfg.thread_id + 1
+        for _ in range(reply_count):
+            post_id += self.__random.randint(1, 5)
+            self.__reply_ids.append(post_id)
+        self.__deleted_post_ids: Set[int] = set()
+        self.__visible_reply_ids = self.__reply_ids
+        self.__lock = threading.Lock()
+
+    @property
+    def visible_reply_ids(self) -> List[int]:
+        """当前未被删除的回应的串号。"""
+        return self.__visible_reply_ids
+
+    @property
+    def reply_count(self) -> int:
+        return len(self.__visible_reply_ids)
+
+    def delete_random_replies(self, count: int):
+        with self.__lock:
+            candidates = [
+                post_id for post_id in self.__reply_ids if post_id not in self.__deleted_post_ids]
+            for post_id in self.__random.sample(candidates, min(count, len(candidates))):
+                self.__deleted_post_ids.add(post_id)
+            self.__visible_reply_ids = [
+                post_id for post_id in self.__reply_ids if post_id not in self.__deleted_post_ids]
+            logging.info(f"已删除{count}个回应，当前回应数：{self.reply_count}")
+
+    def page(self, page_number: int) -> OrderedDict[str, Any]:
+        visible_reply_ids = self.__visible_reply_ids
+        start = (page_number - 1) * FakeThread.PAGE_SIZE
+        replies = list(map(
+            lambda post_id: self.__post(post_id, is_thread=False),
+            visible_reply_ids[start: start + FakeThread.PAGE_SIZE],
+        ))
+        if self.cfg.injects_tip_post:
+            tip_post = self.__post(FakeThread.TIP_POST_ID, is_thread=False)
+            tip_post["userid"] = "芦苇"
+            tip_post["content"] = "这是芦苇"
+            replies.insert(0, tip_post)
+
+        thread = self.__post(self.cfg.thread_id, is_thread=True)
+        thread["replyCount"] = str(len(visible_reply_ids))
+        thread["replys"] = replies
+        return thread
+
+    @staticmethod
+    def attachment_img(i: int) -> str:
+        return f"2020-08-15/{i:013x}"
+
+    @staticmethod
+    def attachment_content(key: str) -> bytes:
+        """
+        附件的内容，由附件的路径决定，大小在 1KiB 至 26KiB 之间。
+        """
+        digest = sha256(key.encode("utf-8")).digest()
+        size = 1024 + digest[0] * 100
+        return (digest * (size // len(digest) + 1))[:size]
+
+    def __post(self, post_id: int, is_thread: bool) -> OrderedDict[str, Any]:
+        post = OrderedDict()
+        post["id"] = str(post_id)
+        post["img"] = ""
+        post["ext"] = ""
+        if random.Random(post_id).random() < self.cfg.attachment_rate:
+            post["img"] = FakeThread.attachment_img(
+                post_id % self.cfg.attachment_pool_size)
+            post["ext"] = ".jpg"
+        post["now"] = "2020-08-15(六)12:34:56"
+        post["userid"] = "AAAAAAAA" if is_thread else f"U{post_id % 97:07d}"
+        post["name"] = "无名氏"
+        post["email"] = ""
+        post["title"] = "无标题"
+        post["content"] = f"第{post_id}号的内容" + "。" * (post_id % 50)
+        post["sage"] = "0"
+        post["admin"] = "0"
+        return post
+
+
+class FakeADNMBServer(ThreadingHTTPServer):
+    """
+    在本地模拟A岛 `/Api/thread` 接口的 HTTP 服务器，用于测试与评测转存程序。
+
+    只提供一个合成的串。
+    可以配置延迟、转存途中删除回应而导致的分页位移，
+    以及未带饼干获取守门页之后的页面时的「卡99」行为。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, cfg: FakeThreadConfiguration):
+        super(FakeADNMBServer, self).__init__(address, FakeADNMBRequestHandler)
+        self.cfg = cfg
+        self.thread = FakeThread(cfg)
+        self.statistics = FakeServerStatistics()
+        self.__random = random.Random(cfg.seed)
+        self.__random_lock = threading.Lock()
+        self.__has_deleted = False
+
+    @property
+    def base_url(self) -> str:
+        (host, port) = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_thread_request(self, thread_id: int, page_number: int, has_cookie: bool) -> Optional[Any]:
+        """
+        Returns
+        -------
+        Any?
+            响应的内容。如果为空，代表模拟服务器繁忙，应返回 503。
+        """
+        with self.__random_lock:
+            delay = self.cfg.latency + self.__random.uniform(0, self.cfg.jitter)
+            fails = self.__random.random() < self.cfg.error_rate
+        time.sleep(delay)
+        if fails:
+            self.statistics.record(failed=True)
+            return None
+
+        gatekept = page_number > self.cfg.gatekeeper_page_number and not has_cookie
+        self.statistics.record(gatekept=gatekept)
+        self.__maybe_delete_replies()
+
+        if thread_id != self.cfg.thread_id:
+            return "该主题不存在"
+        if gatekept:
+            page_number = self.cfg.gatekeeper_page_number
+        return self.thread.page(page_number)
+
+    def handle_attachment_request(self) -> bool:
+        """
+        Returns
+        -------
+        bool
+            是否正常返回。为假时代表模拟服务器繁忙，应返回 503。
+        """
+        with self.__random_lock:
+            delay = self.cfg.latency + self.__random.uniform(0, self.cfg.jitter)
+            fails = self.__random.random() < self.cfg.error_rate
+        time.sleep(delay)
+        self.statistics.record(failed=fails)
+        return not fails
+
+    def __maybe_delete_replies(self):
+        if self.cfg.deletion_count == 0:
+            return
+        with self.__random_lock:
+            if self.__has_deleted or \
+                    self.statistics.request_count < self.cfg.delete_after_request_count:
+                return
+            self.__has_deleted = True
+        self.thread.delete_random_replies(self.cfg.deletion_count)
+
+
+class FakeADNMBRequestHandler(BaseHTTPRequestHandler):
+
+    server: FakeADNMBServer
+    protocol_version = "HTTP/1.1"
+    # 头部与内容分两次写出，不禁用 Nagle 算法的话每次请求都会多出数十毫秒的延迟
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith("/image/"):
+            self.__send_attachment(url.path[len("/image/"):])
+            return
+        queries = parse_qs(url.query)
+        path_parts = url.path.strip("/").split("/")
+        if len(path_parts) != 4 or path_parts[:3] != ["Api", "thread", "id"]:
+            self.__send(404, "Not Found")
+            return
+        try:
+            thread_id = int(path_parts[3])
+            page_number = int(queries.get("page", ["1"])[0])
+        except ValueError:
+            self.__send(400, "Bad Request")
+            return
+
+        # 芦苇岛格式的 cookies 中含有 `SimpleCookie` 无法解析的值，因此手动解析
+        cookies = dict(map(
+            lambda item: tuple(map(str.strip, item.partition("=")[::2])),
+            self.headers.get("Cookie", "").split(";"),
+        ))
+        has_cookie = cookies.get("userhash", "") != ""
+
+        obj = self.server.handle_thread_request(
+            thread_id, page_number, has_cookie)
+        if obj == None:
+            self.__send(503, "Service Unavailable")
+            return
+        self.__send(200, json.dumps(obj, ensure_ascii=False))
+
+    def __send_attachment(self, key: str):
+        """
+        发送附件，支持 `Range: bytes=<start>-` 形式的断点续传。
+        """
+        if not self.server.handle_attachment_request():
+            self.__send(503, "Service Unavailable")
+            return
+        content = FakeThread.attachment_content(key)
+        status = 200
+        range_header = self.headers.get("Range", None)
+        if range_header != None and range_header.startswith("bytes=") and range_header.endswith("-"):
+            start = int(range_header[len("bytes="):-1])
+            if start >= len(content):
+                self.__send(416, "Range Not Satisfiable")
+                return
+            status, content = 206, content[start:]
+        self.send_response(status)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def __send(self, status: int, body: str):
+        raw_body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(raw_body)))
+        self.end_headers()
+        self.wfile.write(raw_body)
+
+    def log_message(self, format: str, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+def start_fake_server(cfg: FakeThreadConfiguration, host: str = "127.0.0.1", port: int = 0) -> FakeADNMBServer:
+    """
+    在后台线程中启动假服务器。`port` 为 0 时随机选择可用的端口。
+    """
+    server = FakeADNMBServer((host, port), cfg)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def fake_thread_configuration_from_args(args: argparse.Namespace) -> FakeThreadConfiguration:
+    return FakeThreadConfiguration(
+        thread_id=args.thread_id,
+        page_count=args.page_count,
+        last_page_reply_count=args.last_page_reply_count,
+        latency=args.latency,
+        jitter=args.jitter,
+        deletion_count=args.deletion_count,
+        error_rate=args.error_rate,
+        attachment_rate=args.attachment_rate,
+        delete_after_request_count=args.delete_after_request_count,
+        gatekeeper_page_number=args.gatekeeper_page_number,
+        seed=args.seed,
+    )
+
+
+def add_fake_thread_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--thread-id",
+                        help="合成的串的串号，默认为10000000", metavar="<thread id>",
+                        type=int, dest="thread_id", default=10000000)
+    parser.add_argument("--page-count",
+                        help="合成的串的页数，默认为200", metavar="<count>",
+                        type=int, dest="page_count", default=200)
+    parser.add_argument("--last-page-reply-count",
+                        help="最后一页的回应数，默认为7", metavar="<count>",
+                        type=int, dest="last_page_reply_count", default=7)
+    parser.add_argument("--latency",
+                        help="每次请求的基础延迟（秒），默认为0.05", metavar="<seconds>",
+                        type=float, dest="latency", default=0.05)
+    parser.add_argument("--jitter",
+                        help="在基础延迟上随机增加的延迟的上限（秒），默认为0", metavar="<seconds>",
+                        type=float, dest="jitter", default=0.0)
+    parser.add_argument("--deletion-count",
+                        help="会被删除的回应的数量，删除后分页会发生位移，默认为0", metavar="<count>",
+                        type=int, dest="deletion_count", default=0)
+    parser.add_argument("--delete-after-request-count",
+                        help="收到多少次请求后才删除回应，默认为0，即一开始便删除", metavar="<count>",
+                        type=int, dest="delete_after_request_count", default=0)
+    parser.add_argument("--attachment-rate",
+                        help="带有附件的回应所占的比例，附件可从`/image/`下获取，默认为0", metavar="<ratio>",
+                        type=float, dest="attachment_rate", default=0.0)
+    parser.add_argument("--error-rate",
+                        help="请求返回503的概率，默认为0", metavar="<probability>",
+                        type=float, dest="error_rate", default=0.0)
+    parser.add_argument("--gatekeeper-page-number",
+                        help="守门页的页数，未带饼干获取之后的页面时会返回守门页的内容，默认为100", metavar="<page number>",
+                        type=int, dest="gatekeeper_page_number", default=100)
+    parser.add_argument("--seed",
+                        help="随机数种子，默认为0", metavar="<seed>",
+                        type=int, dest="seed", default=0)
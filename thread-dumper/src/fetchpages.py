@@ -1,12 +1,17 @@
-from typing import Optional, Dict, Any, List, Tuple, Optional, Iterable, Callable, OrderedDict
+from typing import Optional, Dict, Any, List, Tuple, Optional, Iterable, Callable, OrderedDict, Deque
 from dataclasses import dataclass
 
 import logging
 from pathlib import Path
+import threading
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor, Future
 
 import anobbsclient
 from anobbsclient.walk import create_walker, ReversalThreadWalkTarget
 
+from .exceptions import RequestRetriesExhaustedException
+
 
 @dataclass
 class Page:
@@ -21,14 +26,43 @@ def fetch_page_range_back_to_front(
     from_upper_bound_page_number: int,
     to_lower_bound_page_number: int,
     lower_bound_post_id: int,
-    gatekeeper_post_id: Optional[int]
-) -> Tuple[List[Page], Optional[int], bool]:
+    gatekeeper_post_id: Optional[int],
+    page_consumer: Callable[[Page], None],
+    concurrency: int = 1,
+    executor: Optional[Executor] = None,
+    interrupt_event: Optional[threading.Event] = None,
+) -> Tuple[Optional[Page], Optional[int], bool]:
     """
+    获取到的页面会按页数从大到小的顺序，逐页交给 `page_consumer` 处理，而不会在内存中积攒。
+    页数最小的那页除外：由于之后越过页数下界获取到的回应需要合并到这一页中，
+    它会在获取结束后作为返回值返回。
+
+    Parameters
+    ----------
+    page_consumer : Callable[[Page], None]
+        处理获取到的页面的函数，
+        在当前线程中调用。
+
+    concurrency : int
+        同时获取的页面数量上限。
+        大于 1 时，会预先并行获取之后将要遍历到的页面，
+        但检查「卡99」等仍按页数从后向前逐页进行，与逐页获取时一致。
+
+    executor : Executor?
+        用于并行获取页面的执行器。
+        多轮同时进行时可以共用同一个执行器，以限制总的并发请求数。
+        如果为空且 `concurrency` 大于 1，会在本轮内自行创建。
+
+    interrupt_event : threading.Event?
+        在非主线程中进行时，用于转达用户的键盘中断。
+        被设置后，会在处理下一页前视同收到键盘中断。
+
     Returns
     -------
-    Optional[List[Page]]
-        获取到的页面的列表。
-        如果为空，代表本轮结果被抛弃。
+    Optional[Page]
+        页数最小的那页，即获取到的最后一页。
+        如果为空，代表本轮结果被抛弃，之前交给 `page_consumer` 的页面也应一并抛弃；
+        或者本轮没有获取到任何页面。
 
     Optional[int]
         本轮见到的最大的串号。
@@ -44,36 +78,58 @@ def fetch_page_range_back_to_front(
     # 是否应该抛弃已经获取到的各页，以防止损害已有数据
     should_abandon = False
 
-    pages: List[Page] = []
+    # 最近获取到的一页。
+    # 在确定之后的回应不会再合并进来后，才会交给 `page_consumer`
+    pending_page: Optional[Page] = None
+    # 最先获取到的至多两页，用于确定本轮见到的最大的串号
+    leading_pages: List[Page] = []
 
-    try:
-        for (n, page, _) in create_walker(
-            target=ReversalThreadWalkTarget(
-                thread_id=thread_id,
-                start_page_number=from_upper_bound_page_number,
-                gatekeeper_post_id=gatekeeper_post_id,
-                stop_before_post_id=lower_bound_post_id,
-                expected_stop_page_number=to_lower_bound_page_number,
-            ),
+    target = ReversalThreadWalkTarget(
+        thread_id=thread_id,
+        start_page_number=from_upper_bound_page_number,
+        gatekeeper_post_id=gatekeeper_post_id,
+        stop_before_post_id=lower_bound_post_id,
+        expected_stop_page_number=to_lower_bound_page_number,
+    )
+    if concurrency > 1 or executor != None:
+        walker = create_prefetching_walker(
+            target=target,
             client=client,
-        ):
+            concurrency=concurrency,
+            executor=executor,
+        )
+    else:
+        walker = create_walker(target=target, client=client)
+
+    try:
+        for (n, page, _) in walker:
+            if interrupt_event != None and interrupt_event.is_set():
+                raise KeyboardInterrupt
             msg = f"范围：从第{from_upper_bound_page_number}页至第{to_lower_bound_page_number}页，"
             msg += f"获取处理：第{n}页"
             if n < to_lower_bound_page_number:
                 msg += f"（将合并至第{to_lower_bound_page_number}页）"
             logging.info(msg)
-            if len(pages) == 0 or pages[-1].page_number != to_lower_bound_page_number:
-                pages.append(Page(
+            if pending_page == None or pending_page.page_number != to_lower_bound_page_number:
+                if pending_page != None:
+                    page_consumer(pending_page)
+                pending_page = Page(
                     thread_body=page.body,
                     page_number=n,
                     replies=page.replies,
-                ))
+                )
+                if len(leading_pages) < 2:
+                    leading_pages.append(pending_page)
             else:
-                pages[-1].replies.extend(page.replies)
+                pending_page.replies.extend(page.replies)
             logging.info(f"获取完成：第{n}页")
     except KeyboardInterrupt:
         logging.warning("收到用户键盘中断，将中断")
         aborted = True
+    except RequestRetriesExhaustedException as e:
+        # 已获取的页面本身没有问题，保留下来，下次从中断处继续
+        logging.error(f"「{e.description}」持续失败，将中断")
+        aborted = True
     except anobbsclient.RequiresLoginException:
         logging.error("未登陆，将中断")
         aborted, should_abandon = True, True
@@ -88,22 +144,108 @@ def fetch_page_range_back_to_front(
         logging.error(
             f"在预期之外的大于页数下界的页面遇到了下界串号 {e.lower_bound_post_id}，当前页面页数：{e.current_page_number}，页数下界：{e.expected_lower_bound_page_number}")
         aborted, should_abandon = True, True
+    finally:
+        # 及时结束遍历，以取消尚未开始的预取
+        walker.close()
 
     if should_abandon:
         logging.error("将遗弃已获取的页面")
-        pages = None
+        pending_page = None
 
     # 本轮见过的最大的串号。
     # 由于外层每一轮是从前向后的顺序进行处理，
     # 当本轮页数超过守门页时，可以让下一轮有效检测「卡99」
-    if pages != None:
-        if len(pages[0].replies) != 0:
-            current_round_max_seen_post_id = int(pages[0].replies[-1].id)
-        elif len(pages) > 1:
-            current_round_max_seen_post_id = int(pages[1].replies[-1].id)
+    if pending_page != None:
+        if len(leading_pages[0].replies) != 0:
+            current_round_max_seen_post_id = int(
+                leading_pages[0].replies[-1].id)
+        elif len(leading_pages) > 1:
+            current_round_max_seen_post_id = int(
+                leading_pages[1].replies[-1].id)
         else:
             current_round_max_seen_post_id = None
     else:
         current_round_max_seen_post_id = None
 
-    return (pages, current_round_max_seen_post_id, aborted)
+    return (pending_page, current_round_max_seen_post_id, aborted)
+
+
+def create_prefetching_walker(
+    target: ReversalThreadWalkTarget,
+    client: anobbsclient.Client,
+    concurrency: int,
+    executor: Optional[Executor] = None,
+    options: Optional[anobbsclient.RequestOptions] = None,
+):
+    """
+    与 `anobbsclient.walk.create_walker` 相同，但会并行预取之后的页面。
+
+    页面依旧按遍历顺序逐页交由 `target` 检查是否卡页、是否应该停止，
+    因此检查的严格程度与逐页获取时一致，
+    只是页面的获取不再需要等待前一页检查完毕。
+
+    预取不会越过 `target.expected_stop_page_number`，
+    只有在确实需要越过时才逐页获取，以免浪费请求。
+
+    逐页获取时，较小页数的页面总是在较大页数的页面之后获取，
+    期间删除回应导致的位移只会让回应重复出现，而不会遗漏。
+    并行预取时这一顺序无法保证，
+    因此如果某页的回应数多于遍历顺序上前一页的回应数，
+    说明该页获取于回应被删除之前，可能缺少前移过来的回应，会重新获取该页。
+    """
+
+    g = {}
+    if options is None:
+        options = {}
+
+    owns_executor = executor == None
+    if owns_executor:
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    floor_page_number = target.expected_stop_page_number or 1
+    pending: Deque[Tuple[int, Future]] = deque()
+    next_pn_to_submit = target.start_page_number
+
+    def submit_more():
+        nonlocal next_pn_to_submit
+        while len(pending) < concurrency and next_pn_to_submit >= 1:
+            if next_pn_to_submit < floor_page_number and len(pending) > 0:
+                break
+            pending.append((next_pn_to_submit, executor.submit(
+                target.get_page, next_pn_to_submit, client, options)))
+            next_pn_to_submit = target.get_next_page_number(
+                next_pn_to_submit)
+
+    # 遍历顺序上前一页的回应数
+    last_reply_count: Optional[int] = None
+
+    try:
+        current_pn = target.start_page_number
+        while True:
+            submit_more()
+            (pn, future) = pending.popleft()
+            assert(pn == current_pn)
+            (current_page, usage) = future.result()
+            reply_count = int(current_page.body.total_reply_count)
+            if last_reply_count != None and reply_count > last_reply_count:
+                logging.info(
+                    f"第{current_pn}页的回应数 {reply_count} 多于前一页的 {last_reply_count}，期间可能有回应被删除，将重新获取")
+                (current_page, usage) = target.get_page(
+                    current_pn, client, options)
+                reply_count = int(current_page.body.total_reply_count)
+            last_reply_count = reply_count
+            target.check_gatekept(current_pn, current_page,
+                                  client, options, g)
+            next_pn = target.get_next_page_number(current_pn)
+            should_stop = target.should_stop(current_page, next_pn, g)
+
+            yield (current_pn, current_page, usage)
+
+            if should_stop:
+                break
+            current_pn = next_pn
+    finally:
+        for (_, future) in pending:
+            future.cancel()
+        if owns_executor:
+            executor.shutdown(wait=True)
@@ -0,0 +1,98 @@
+from typing import Optional, OrderedDict
+
+import logging
+from pathlib import Path
+import json
+import os
+import threading
+import time
+
+import anobbsclient
+
+
+class ResponseCache:
+    """
+    转存前试探性请求（第一页、守门页）的响应在磁盘上的缓存。
+
+    以 (串号, 页数, 是否登陆) 为键，每个响应存为缓存文件夹下的一个文件，
+    因此在同一次转存中、以及紧接着的下一次转存中都可以直接使用，
+    直到超过有效期，或是该页被转存程序改写而被显式作废。
+
+    只缓存 `for_analysis=True` 获取的页面。
+    """
+
+    def __init__(self, folder_path: Path, ttl: float):
+        """
+        Parameters
+        ----------
+        folder_path : Path
+            缓存文件夹。只有在其所在的文件夹已存在时才会写入缓存。
+
+        ttl : float
+            缓存的有效期，单位为秒。
+        """
+        self.folder_path = folder_path
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+
+    def get_thread_page(self, client: anobbsclient.Client, thread_id: int, page: int) -> anobbsclient.Thread:
+        """
+        获取串的某页，缓存有效时直接使用缓存。
+        """
+        needs_login = client.thread_page_requires_login(page)
+        cache_file_path = self.__cache_file_path(thread_id, page, needs_login)
+
+        thread_page = self.__load(cache_file_path)
+        if thread_page != None:
+            logging.debug(f"使用缓存的串 {thread_id} 第 {page} 页")
+            return thread_page
+
+        (thread_page, _) = client.get_thread_page(
+            thread_id, page=page, for_analysis=True)
+        self.__save(cache_file_path, thread_page)
+        return thread_page
+
+    def invalidate_range(self, thread_id: int, from_page: int, to_page: Optional[int]):
+        """
+        作废页数在 `from_page` 与 `to_page` 之间（含两端）的各页的缓存。
+        `to_page` 为空时没有上限。
+        """
+        if not self.folder_path.exists():
+            return
+        with self.__lock:
+            for cache_file_path in self.folder_path.glob(f"{thread_id}-*-*.json"):
+                page = int(cache_file_path.name.split("-")[1])
+                if page >= from_page and (to_page == None or page <= to_page):
+                    os.remove(cache_file_path)
+
+    def __cache_file_path(self, thread_id: int, page: int, needs_login: bool) -> Path:
+        login_state = "login" if needs_login else "guest"
+        return self.folder_path / f"{thread_id}-{page}-{login_state}.json"
+
+    def __load(self, cache_file_path: Path) -> Optional[anobbsclient.Thread]:
+        with self.__lock:
+            try:
+                with open(cache_file_path) as cache_file:
+                    obj = json.load(cache_file, object_pairs_hook=OrderedDict)
+            except (FileNotFoundError, ValueError):
+                return None
+            if time.time() - obj["fetched_at"] > self.ttl:
+                os.remove(cache_file_path)
+                return None
+        return anobbsclient.Thread(obj["page"])
+
+    def __save(self, cache_file_path: Path, thread_page: anobbsclient.Thread):
+        if self.ttl <= 0 or not self.folder_path.parent.exists():
+            return
+        page = thread_page.body.raw_copy()
+        page["replys"] = list(
+            map(lambda post: post.raw_copy(), thread_page.replies))
+        with self.__lock:
+            self.folder_path.mkdir(exist_ok=True)
+            tmp_file_path = cache_file_path.parent / f"_{cache_file_path.name}"
+            with open(tmp_file_path, "w+") as cache_file:
+                json.dump({
+                    "fetched_at": time.time(),
+                    "page": page,
+                }, cache_file, ensure_ascii=False)
+            os.replace(tmp_file_path, cache_file_path)
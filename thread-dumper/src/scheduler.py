@@ -0,0 +1,207 @@
+from typing import Optional, Callable, TypeVar
+from dataclasses import dataclass
+
+import logging
+import argparse
+import json
+import random
+import threading
+import time
+
+import requests
+
+from .exceptions import RequestRetriesExhaustedException
+
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class SchedulerConfiguration:
+
+    max_rate: Optional[float] = None
+    """每秒请求数的上限。为空时不限制请求速率，也不会自动调节。"""
+    min_rate: Optional[float] = None
+    """自动调节时每秒请求数的下限。为空时为上限的十分之一。"""
+    target_latency: float = 2.0
+    """请求用时超过此值（秒）时，视为服务器繁忙，会降低请求速率。"""
+
+    max_attempts: int = 5
+    """每个请求最多尝试的次数。"""
+    backoff_base: float = 1.0
+    """第一次重试前等待的时间（秒），之后每次翻倍。"""
+    backoff_max: float = 60.0
+    """重试前等待时间的上限（秒）。"""
+
+
+class RequestScheduler:
+    """
+    位于转存程序与 `anobbsclient` 之间的请求调度层。
+
+    * 以令牌桶控制请求速率，桶的容量为一秒的请求数；
+    * 对连接错误、超时、服务器 5xx/429 等暂时性错误，以带随机抖动的指数退避进行重试；
+    * 按 AIMD 调节速率：请求顺利时逐渐加速，直至上限；
+      出错或用时超过目标值时速率减半，但每秒至多减半一次，
+      以免同时进行的请求一起出错时速率骤降。
+
+    可在多个线程间共用，用于让同一进程中的所有请求共享同一个速率。
+    """
+
+    def __init__(self, cfg: SchedulerConfiguration):
+        self.cfg = cfg
+        self.__lock = threading.Lock()
+        self.__random = random.Random()
+
+        self.__rate = cfg.max_rate
+        self.__tokens = cfg.max_rate or 0
+        self.__last_refilled_at = time.monotonic()
+        self.__last_slowed_down_at = 0
+
+        self.request_count = 0
+        self.retry_count = 0
+        self.error_count = 0
+
+    @property
+    def rate(self) -> Optional[float]:
+        """当前每秒请求数的限制。"""
+        return self.__rate
+
+    @property
+    def min_rate(self) -> Optional[float]:
+        if self.cfg.max_rate == None:
+            return None
+        return self.cfg.min_rate or self.cfg.max_rate / 10
+
+    def call(self, fn: Callable[[], T], description: str) -> T:
+        """
+        按调度进行请求，遇到暂时性错误时退避重试。
+
+        Raises
+        ------
+        RequestRetriesExhaustedException
+            如果暂时性错误持续到超过最大尝试次数。
+            其他错误会原样抛出。
+        """
+        for i in range(1, self.cfg.max_attempts + 1):
+            self.__acquire()
+            started_at = time.monotonic()
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_transient_error(e):
+                    raise
+                with self.__lock:
+                    self.request_count += 1
+                    self.error_count += 1
+                self.__slow_down()
+                if i == self.cfg.max_attempts:
+                    logging.error(
+                        f"「{description}」失败：{e}。已经失败 {i} 次，放弃")
+                    raise RequestRetriesExhaustedException(
+                        description=description, attempts=i, last_exception=e)
+                delay = self.__backoff_delay(i)
+                logging.warning(
+                    f"「{description}」失败：{e}。将在 {delay:.1f} 秒后重试。尝试次数：{i}/{self.cfg.max_attempts}")
+                with self.__lock:
+                    self.retry_count += 1
+                time.sleep(delay)
+                continue
+
+            latency = time.monotonic() - started_at
+            with self.__lock:
+                self.request_count += 1
+            if latency > self.cfg.target_latency:
+                logging.debug(
+                    f"「{description}」用时 {latency:.2f} 秒，超过目标值，将降低请求速率")
+                self.__slow_down()
+            else:
+                self.__speed_up()
+            return result
+
+    def __acquire(self):
+        if self.cfg.max_rate == None:
+            return
+        with self.__lock:
+            now = time.monotonic()
+            capacity = max(self.__rate, 1)
+            self.__tokens = min(
+                capacity, self.__tokens + (now - self.__last_refilled_at) * self.__rate)
+            self.__last_refilled_at = now
+            # 令牌不足时预支，之后的请求需要等待更久
+            self.__tokens -= 1
+            wait = -self.__tokens / self.__rate if self.__tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+    def __speed_up(self):
+        if self.cfg.max_rate == None:
+            return
+        with self.__lock:
+            # 每秒大约增加 1 次/秒
+            self.__rate = min(self.cfg.max_rate, self.__rate + 1 / self.__rate)
+
+    def __slow_down(self):
+        if self.cfg.max_rate == None:
+            return
+        with self.__lock:
+            now = time.monotonic()
+            if now - self.__last_slowed_down_at < 1:
+                return
+            self.__last_slowed_down_at = now
+            self.__rate = max(self.min_rate, self.__rate / 2)
+            rate = self.__rate
+        logging.info(f"请求速率降低至每秒 {rate:.2f} 次")
+
+    def __backoff_delay(self, attempt: int) -> float:
+        delay = min(self.cfg.backoff_max,
+                    self.cfg.backoff_base * 2 ** (attempt - 1))
+        with self.__lock:
+            # 「完全抖动」，使同时失败的请求错开重试的时间
+            return self.__random.uniform(0, delay)
+
+
+def is_transient_error(e: Exception) -> bool:
+    """
+    判断请求错误是否是暂时性的，即重试后有可能成功。
+    """
+    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(e, requests.exceptions.HTTPError):
+        response = e.response
+        return response != None and (response.status_code == 429 or response.status_code >= 500)
+    if isinstance(e, (requests.exceptions.ChunkedEncodingError, json.JSONDecodeError)):
+        # 服务器繁忙时可能返回不完整的内容或错误页面
+        return True
+    return False
+
+
+def scheduler_configuration_from_args(args: argparse.Namespace) -> SchedulerConfiguration:
+    return SchedulerConfiguration(
+        max_rate=args.max_request_rate,
+        min_rate=args.min_request_rate,
+        target_latency=args.target_latency,
+        max_attempts=args.max_attempts,
+        backoff_base=args.backoff_base,
+        backoff_max=args.backoff_max,
+    )
+
+
+def add_scheduler_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--max-request-rate",
+                        help="每秒请求数的上限，由所有请求共享。设置后会根据请求的用时与出错情况在上下限之间自动调节。默认不限制", metavar="<requests per second>",
+                        type=float, dest="max_request_rate", default=None)
+    parser.add_argument("--min-request-rate",
+                        help="自动调节时每秒请求数的下限，默认为上限的十分之一", metavar="<requests per second>",
+                        type=float, dest="min_request_rate", default=None)
+    parser.add_argument("--target-latency",
+                        help="请求用时超过此值时降低请求速率，默认为2秒", metavar="<seconds>",
+                        type=float, dest="target_latency", default=2.0)
+    parser.add_argument("--max-attempts",
+                        help="遇到连接错误、超时、服务器错误等暂时性错误时，每个请求最多尝试的次数，默认为5", metavar="<count>",
+                        type=int, dest="max_attempts", default=5)
+    parser.add_argument("--backoff-base",
+                        help="第一次重试前等待的时间，之后每次翻倍，默认为1秒", metavar="<seconds>",
+                        type=float, dest="backoff_base", default=1.0)
+    parser.add_argument("--backoff-max",
+                        help="重试前等待时间的上限，默认为60秒", metavar="<seconds>",
+                        type=float, dest="backoff_max", default=60.0)
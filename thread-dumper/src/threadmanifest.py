@@ -0,0 +1,37 @@
+from typing import List
+from dataclasses import dataclass
+
+from pathlib import Path
+
+
+@dataclass(frozen=True)
+class ThreadManifestEntry:
+    thread_id: int
+    dump_folder_path: Path
+
+
+def load_thread_manifest(manifest_path: Path) -> List[ThreadManifestEntry]:
+    """
+    读取批量转存用的清单文件。
+
+    清单每行为一个串，格式为 `<串号> <转存文件夹路径>`，以空白分隔。
+    相对路径相对于清单文件所在的文件夹。
+    空行及 `#` 之后的内容会被忽略。
+    """
+
+    entries = []
+    with open(manifest_path) as manifest_file:
+        for (i, line) in enumerate(manifest_file):
+            line = line.partition("#")[0].strip()
+            if line == "":
+                continue
+            fields = line.split(None, 1)
+            if len(fields) < 2:
+                raise ValueError(
+                    f"清单第{i+1}行缺少转存文件夹路径：{line}")
+            (thread_id, dump_folder_path) = (fields[0], fields[1].strip())
+            entries.append(ThreadManifestEntry(
+                thread_id=int(thread_id),
+                dump_folder_path=manifest_path.parent / dump_folder_path,
+            ))
+    return entries
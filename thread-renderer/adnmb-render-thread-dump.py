@@ -23,9 +23,11 @@ import yaml
 # this library
 from src.trace import Trace, get_processable_page_info_list, needs_update
 from src.configloader import DivisionsConfiguration
-from src.thread import Thread
+from src.poststore import PostStore
+from src.lazypostpool import LazyPostPool
+from src.snapshot import PostStoreSnapshot
 from src.divisiontree import TreeBuilder
-from src.generating import OutputsGenerator
+from src.generating import OutputsGenerator, AttachmentResolver, RenderCache
 
 
 def main(args: List[str]):
@@ -35,6 +37,7 @@ def main(args: List[str]):
     logging.info(f"配置文件路径：{args.div_cfg_path}")
     logging.info(f"输入转存文件夹路径：{args.dump_folder_path}")
     logging.info(f"输出文件夹路径：{args.output_folder_path}")
+    logging.info(f"缓存文件夹路径：{args.cache_folder_path}")
 
     if (not args.overwrite_output) and args.output_folder_path.exists():
         logging.critical("配置未允许覆写输出文件夹，呃输出文件夹已存在")
@@ -58,8 +61,27 @@ def main(args: List[str]):
 
     div_cfg = load_divisions_configuration(args.div_cfg_path)
 
-    thread = Thread.load_from_dump_folder(
-        args.dump_folder_path, page_info_list)
+    snapshot = None
+    if args.max_resident_page_count > 0:
+        post_pool = LazyPostPool(
+            args.dump_folder_path, page_info_list,
+            max_resident_page_count=args.max_resident_page_count,
+        )
+    elif args.no_snapshot:
+        post_pool = PostStore.load_from_dump_folder(
+            args.dump_folder_path, page_info_list)
+    else:
+        snapshot = PostStoreSnapshot.build(
+            args.dump_folder_path, page_info_list,
+            previous=PostStoreSnapshot.load(
+                args.cache_folder_path / PostStoreSnapshot.FILE_NAME),
+        )
+        post_pool = snapshot.store
+
+    render_cache = None
+    if not args.no_render_cache:
+        render_cache = RenderCache.load(
+            args.cache_folder_path / RenderCache.FILE_NAME)
 
     if args.output_folder_path.exists():
         logging.info(f"输出文件夹已存在。根据配置，将覆写该文件夹")
@@ -67,7 +89,6 @@ def main(args: List[str]):
 
     args.output_folder_path.mkdir(parents=True)
 
-    post_pool = thread.flattened_post_dict()
     (tree, post_claims) = TreeBuilder.build_tree(
         post_pool=post_pool,
         div_cfg=div_cfg,
@@ -79,7 +100,27 @@ def main(args: List[str]):
         div_cfg_folder_path=args.div_cfg_path.parent,
         division_tree=tree,
         post_claims=post_claims,
+        attachment_resolver=AttachmentResolver(
+            mode=args.local_attachments,
+            dump_folder_path=args.dump_folder_path,
+            output_folder_path=args.output_folder_path,
+        ),
+        render_cache=render_cache,
+        worker_count=args.worker_count,
     )
+    if isinstance(post_pool, LazyPostPool):
+        logging.info(
+            f"共{len(page_info_list)}页，按需读取页面{post_pool.loaded_page_count}次")
+        post_pool.close()
+
+    if snapshot != None or render_cache != None:
+        args.cache_folder_path.mkdir(parents=True, exist_ok=True)
+    if snapshot != None:
+        snapshot.save(args.cache_folder_path / PostStoreSnapshot.FILE_NAME)
+    if render_cache != None:
+        logging.info(
+            f"回应渲染缓存：命中{render_cache.hit_count}次，未命中{render_cache.miss_count}次，命中率{render_cache.hit_ratio:.1%}")
+        render_cache.save(args.cache_folder_path / RenderCache.FILE_NAME)
 
     if not args.no_generate_trace:
         with open(args.output_folder_path / ".trace.json", 'w') as trace_file:
@@ -100,15 +141,33 @@ def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
     parser.add_argument("-o", "--output",
                         help="输出文件夹路径，默认为配置文件同目录下的`book`文件夹", metavar="<path to output folder>",
                         type=Path, dest="output_folder_path")
+    parser.add_argument("--cache-folder",
+                        help="存放已读取回应的快照与回应渲染缓存的文件夹路径，不应与他人共享。默认为输出文件夹旁的`.<输出文件夹名>-cache`文件夹", metavar="<path to cache folder>",
+                        type=Path, dest="cache_folder_path")
     parser.add_argument("--allow-overwrite-output",
                         help="如果输出文件夹存在，删除并重建该文件夹",
                         dest="overwrite_output", action="store_true", default=False)
+    parser.add_argument("--local-attachments",
+                        help="使用转存文件夹中已下载的附件：`link`为直接指向转存文件夹中的附件，`copy`为复制到输出文件夹的`attachments`中。尚未下载的附件仍使用远程地址。默认总是使用远程地址",
+                        choices=["link", "copy"], dest="local_attachments", default=None)
+    parser.add_argument("--max-resident-pages",
+                        help="按需读取页面，而非预先读取整个串，并限制同时驻留于内存的页数。只用到串的一部分时可减少读取的页面。默认为0，即预先读取整个串", metavar="<count>",
+                        type=int, dest="max_resident_page_count", default=0)
+    parser.add_argument("-j", "--jobs",
+                        help="并行生成各个文件的工作进程数量，结果与逐个生成相同。默认为1，即逐个生成", metavar="<count>",
+                        type=int, dest="worker_count", default=1)
     parser.add_argument("--log-config", "--logging-configuration",
                         help="python logging配置文件的路径", metavar="<path to python logging.conf>",
                         type=Path, dest="log_config")
     parser.add_argument("--no-generate-trace",
                         help="不记录往后用于检查是否需要更新的状态追踪文件",
                         dest="no_generate_trace", action="store_true", default=False)
+    parser.add_argument("--no-snapshot",
+                        help="不使用也不记录缓存文件夹中已读取回应的快照，总是重新读取所有页面",
+                        dest="no_snapshot", action="store_true", default=False)
+    parser.add_argument("--no-render-cache",
+                        help="不使用也不记录缓存文件夹中的回应渲染缓存，总是重新渲染所有回应",
+                        dest="no_render_cache", action="store_true", default=False)
     parser.add_argument("--ignore-trace",
                         help="无视状态追踪文件，强制进行生成",
                         dest="ignore_trace", action="store_true", default=False)
@@ -119,6 +178,10 @@ def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
         args.dump_folder_path = default_base_folder_path / "dump"
     if args.output_folder_path == None:
         args.output_folder_path = default_base_folder_path / "book"
+    if args.cache_folder_path == None:
+        # 缓存以 pickle 存储，读取时可能执行任意代码，因此不放在会被分享出去的输出文件夹中
+        args.cache_folder_path = args.output_folder_path.parent / \
+            f".{args.output_folder_path.name}-cache"
     if args.log_config != None:
         logging.config.fileConfig(
             args.log_config, disable_existing_loggers=False)
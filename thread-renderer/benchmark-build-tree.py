@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+from typing import List, Any
+
+import sys
+import io
+import logging
+import argparse
+import random
+
+import yaml
+
+from src.poststore import PostStore
+from src.trace import get_processable_page_info_list
+from src.configloader import DivisionsConfiguration, MatchUntil
+from src.divisiontree import TreeBuilder, PostInNode
+from src import benchmarking
+from src.benchmarking import describe_tree, build_tree_with
+
+
+class ReferenceTreeBuilder(TreeBuilder):
+    """
+    原来逐个回应判断 `until` 规则的方式，用于对照结果与速度。
+    """
+
+    def _TreeBuilder__collect_match_until_posts(self, match_until: MatchUntil) -> List[PostInNode]:
+        posts: PostInNode = []
+
+        while self.post_i < len(self.post_ids):
+            post_id = self.post_ids[self.post_i]
+            if post_id > match_until.id:
+                break
+
+            after_text = None
+            if self.remain_post != None:
+                if self.remain_post[0] == post_id:
+                    after_text = self.remain_post[1]
+                else:
+                    posts.append(PostInNode(
+                        post_id=post_id,
+                        is_weak=True,
+                        after_text=self.remain_post[1],
+                    ))
+                self.remain_post = None
+
+            post = self.post_pool[post_id]
+
+            is_not_excluded = post_id not in (match_until.excluded or [])
+            is_po = post.user_id in self.div_cfg.po_cookies
+            if is_not_excluded and is_po:
+                if post_id == match_until.id:
+                    until_text = match_until.text_until
+                else:
+                    until_text = None
+                posts.append(PostInNode(
+                    post_id=post_id,
+                    is_weak=True,
+                    after_text=after_text,
+                    until_text=until_text,
+                ))
+
+            if match_until.text_until != None and post_id == match_until.id:
+                self.remain_post = (post_id, match_until.text_until)
+                break
+            self.post_i += 1
+
+        return posts
+
+
+def main(args: List[str]):
+    logging.debug(f"args: {args}")
+    args = parse_args(prog=args[0], args=args[1:])
+
+    (page_info_list, _) = get_processable_page_info_list(args.dump_folder_path)
+    post_pool = PostStore.load_from_dump_folder(
+        args.dump_folder_path, page_info_list)
+    div_cfg = generate_divisions_configuration(
+        post_pool, args.rule_count, args.excluded_count)
+    print(f"共{len(post_pool)}个回应，{args.rule_count}条`until`规则，" +
+          f"每条规则排除{args.excluded_count}个串号")
+
+    results = []
+    for builder_type in [ReferenceTreeBuilder, TreeBuilder]:
+        (builder, tree, elapsed) = build_tree_with(
+            builder_type, post_pool, div_cfg)
+        results.append((describe_tree(tree), builder.post_claims, elapsed))
+    ((reference_tree, reference_claims, reference_elapsed),
+     (tree, post_claims, elapsed)) = results
+
+    print(f"逐个回应判断：{reference_elapsed:.3f}秒")
+    print(f"使用索引：{elapsed:.3f}秒，为原来的{reference_elapsed / elapsed:.2f}倍速")
+    if tree != reference_tree or post_claims.keys() != reference_claims.keys():
+        print("切割结果不一致")
+        exit(1)
+    print("切割结果一致")
+
+
+def generate_divisions_configuration(
+    post_pool: PostStore, rule_count: int, excluded_count: int,
+) -> DivisionsConfiguration:
+    """
+    生成将串平均切割为 `rule_count` 段的配置，部分规则带有 `text-until`。
+    """
+    rng = random.Random(0)
+    post_ids = list(post_pool.keys())
+    user_ids = list(map(lambda post_id: post_pool[post_id].user_id,
+                        post_ids[:: max(len(post_ids) // 100, 1)]))
+
+    def until_rule(i: int) -> Any:
+        until = {
+            "id": post_ids[min((i + 1) * len(post_ids) // rule_count, len(post_ids) - 1)],
+            "excluded": rng.sample(post_ids, min(excluded_count, len(post_ids))),
+        }
+        if i % 7 == 3:
+            until["text-until"] = "分割"
+        return {"title": f"第{i + 1}段", "until": until}
+
+    rules = list(map(until_rule, range(rule_count - 1)))
+    # 最后一条规则需要有子规则，剩余的回应会归入其中
+    last_rule = until_rule(rule_count - 1)
+    last_rule["children"] = [until_rule(rule_count - 1)]
+    rules.append(last_rule)
+
+    obj = {
+        "title": "评测",
+        "po": sorted(set(user_ids))[:5],
+        "divisions": [{
+            "title": "全部",
+            "division-type": "file",
+            "children": rules,
+        }],
+    }
+    return DivisionsConfiguration.load(io.StringIO(yaml.safe_dump(obj)), root_folder_path=".")
+
+
+def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
+    parser = benchmarking.new_argument_parser(
+        prog=prog,
+        description="以大量`until`规则评测构建切割树的速度，并检查结果与原来逐个回应判断的方式一致",
+    )
+
+    parser.add_argument("--rule-count",
+                        help="`until`规则的数量，默认为2000", metavar="<count>",
+                        type=int, dest="rule_count", default=2000)
+    parser.add_argument("--excluded-count",
+                        help="每条规则排除的串号数量，默认为200", metavar="<count>",
+                        type=int, dest="excluded_count", default=200)
+
+    return benchmarking.parse_args(parser, args)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+from typing import List, Any, Optional
+
+import sys
+import io
+import logging
+import argparse
+
+import yaml
+
+from src.poststore import PostStore
+from src.trace import get_processable_page_info_list
+from src.configloader import DivisionsConfiguration, Collect
+from src.divisiontree import TreeBuilder, DivisionNode
+from src.divisiontree.utils import githubize_heading_name
+from src import benchmarking
+from src.benchmarking import describe_tree, build_tree_with
+
+
+def reference_collect_nodes(
+    node: DivisionNode,
+    rule: Collect,
+    collecting_nodes: List[DivisionNode]
+) -> Optional[List[DivisionNode]]:
+    """
+    原来从根节点开始逐层查找的方式，用于对照结果与速度。
+    """
+
+    if node.children == None or node in collecting_nodes:
+        return None
+
+    collected_nodes = []
+
+    for child in node.children:
+        if not isinstance(child, DivisionNode):
+            continue
+        if child.title == rule.parent_title_matches:
+            collected_nodes.extend(child.children)
+        else:
+            child_collect_nodes = reference_collect_nodes(
+                node=child,
+                rule=rule,
+                collecting_nodes=collecting_nodes,
+            )
+            if child_collect_nodes != None:
+                collected_nodes.extend(child_collect_nodes)
+
+    if len(collected_nodes) > 0:
+        return collected_nodes
+    return None
+
+
+class ReferenceTreeBuilder(TreeBuilder):
+    """
+    为每条 `Collect` 规则遍历整棵树的构建方式。
+    """
+
+    def _TreeBuilder__build_root(self) -> DivisionNode:
+        assert(not self.has_been_built)
+        self.has_been_built = True
+
+        root = DivisionNode(
+            parent=None,
+            title=self.div_cfg.title,
+            title_number_in_parent_file=1,
+            intro=self.div_cfg.intro,
+            type=None,
+            posts=[],
+            post_rules=None,
+            children=None,
+        )
+        root.children = list(map(lambda rule: self._TreeBuilder__build_node(
+            rule=rule,
+            parent_node=root,
+            heading_name_counts={
+                githubize_heading_name(root.top_heading_name): 1,
+            },
+        ), self.div_cfg.division_rules))
+
+        for node in self.collecting_nodes:
+            assert(isinstance(node.children, Collect))
+            node.children = reference_collect_nodes(
+                node=root,
+                rule=node.children,
+                collecting_nodes=self.collecting_nodes,
+            )
+
+        return root
+
+
+def main(args: List[str]):
+    logging.debug(f"args: {args}")
+    args = parse_args(prog=args[0], args=args[1:])
+
+    (page_info_list, _) = get_processable_page_info_list(args.dump_folder_path)
+    post_pool = PostStore.load_from_dump_folder(
+        args.dump_folder_path, page_info_list)
+    div_cfg = generate_divisions_configuration(
+        post_pool, args.depth, args.width, args.collector_count)
+
+    results = []
+    for builder_type in [ReferenceTreeBuilder, TreeBuilder]:
+        (_, tree, elapsed) = build_tree_with(builder_type, post_pool, div_cfg)
+        results.append((describe_tree(tree), elapsed))
+    ((reference_tree, reference_elapsed), (tree, elapsed)) = results
+
+    print(f"展开收集到的节点后共{len(tree)}个节点，其中{args.collector_count}个收集节点")
+    print(f"逐条规则遍历整棵树：{reference_elapsed:.3f}秒")
+    print(f"使用标题索引：{elapsed:.3f}秒，为原来的{reference_elapsed / elapsed:.2f}倍速")
+    if tree != reference_tree:
+        print("切割结果不一致")
+        exit(1)
+    print("切割结果一致")
+
+
+def generate_divisions_configuration(
+    post_pool: PostStore, depth: int, width: int, collector_count: int,
+) -> DivisionsConfiguration:
+    """
+    生成每层有 `width` 个分支、共 `depth` 层的配置，不同分支中有许多同名的节点。
+    收集节点都位于第一层，收集的标题分布在第二层到倒数第二层。
+    """
+    first_post = post_pool[next(iter(post_pool.keys()))]
+
+    def title_at(level: int, i: int) -> str:
+        return f"第{level}层·{i % (width + level)}"
+
+    def rule_at(level: int, i: int) -> Any:
+        rule = {"title": title_at(level, i)}
+        if level < depth:
+            rule["children"] = list(
+                map(lambda j: rule_at(level + 1, i * width + j), range(width)))
+        return rule
+
+    rules = list(map(lambda i: rule_at(1, i), range(width)))
+    for i in range(collector_count):
+        level = 2 + i % (depth - 2)
+        rules.insert(len(rules) - 1, {
+            "title": f"汇总{i}",
+            "collect": {"parent-title-matches": title_at(level, i)},
+        })
+
+    obj = {
+        "title": "评测",
+        "po": [first_post.user_id],
+        "divisions": rules,
+    }
+    return DivisionsConfiguration.load(io.StringIO(yaml.safe_dump(obj)), root_folder_path=".")
+
+
+def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
+    parser = benchmarking.new_argument_parser(
+        prog=prog,
+        description="以层数多、分支多的配置评测`collect`规则的速度，并检查结果与原来遍历整棵树的方式一致",
+    )
+
+    parser.add_argument("--depth",
+                        help="切割规则的层数，至少为3，默认为4", metavar="<count>",
+                        type=int, dest="depth", default=4)
+    parser.add_argument("--width",
+                        help="每层的分支数量，默认为6", metavar="<count>",
+                        type=int, dest="width", default=6)
+    parser.add_argument("--collectors",
+                        help="`collect`规则的数量，默认为200", metavar="<count>",
+                        type=int, dest="collector_count", default=200)
+
+    return benchmarking.parse_args(parser, args)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+from typing import List, Callable
+
+import sys
+import logging
+import logging.config
+import argparse
+from pathlib import Path
+import json
+import time
+
+import src.thread
+from src.thread import Thread, Post
+from src.trace import get_processable_page_info_list, PageInfo
+
+
+def main(args: List[str]):
+    logging.debug(f"args: {args}")
+    args = parse_args(prog=args[0], args=args[1:])
+
+    (page_info_list, _) = get_processable_page_info_list(args.dump_folder_path)
+    print(f"共{len(page_info_list)}页")
+
+    reference = load_reference(args.dump_folder_path, page_info_list)
+    reference_elapsed = measure(lambda: load_reference(
+        args.dump_folder_path, page_info_list), args.repeat)
+    print(f"逐页读取、标准库 json、逐个构建回应：{reference_elapsed:.3f}秒")
+
+    orjson = src.thread.orjson
+    cases = [("标准库 json", None)]
+    if orjson != None:
+        cases.append(("orjson", orjson))
+    else:
+        print("未安装 orjson，跳过")
+    for (decoder_name, decoder_module) in cases:
+        src.thread.orjson = decoder_module
+        thread = Thread.load_from_dump_folder(
+            args.dump_folder_path, page_info_list)
+        if thread != reference:
+            print(f"{decoder_name}：结果与逐页读取不一致")
+            exit(1)
+        elapsed = measure(lambda: Thread.load_from_dump_folder(
+            args.dump_folder_path, page_info_list), args.repeat)
+        print(f"{decoder_name}，批量构建回应：{elapsed:.3f}秒，" +
+              f"为原来的{reference_elapsed / elapsed:.2f}倍速")
+    src.thread.orjson = orjson
+
+
+def load_reference(dump_folder_path: Path, page_info_list: List[PageInfo]) -> Thread:
+    """
+    原来的读取方式，用于对照结果与速度。只支持逐页存放的转存文件夹。
+    """
+    with open(dump_folder_path / "thread.json") as thread_file:
+        thread_object = json.load(thread_file)
+    thread_id = thread_object["id"]
+    body = Post.load_from_object(
+        thread_object, thread_id=thread_id, page_number=1)
+    pages = []
+    for page_info in page_info_list:
+        with open(dump_folder_path / "pages" / page_info.filename()) as page_file:
+            page_object = json.load(page_file)
+        pages.append(list(map(lambda post_object: Post.load_from_object(
+            post_object, thread_id=thread_id, page_number=page_info.number), page_object)))
+    return Thread(body=body, pages=pages)
+
+
+def measure(fn: Callable[[], None], repeat: int) -> float:
+    """
+    Returns
+    -------
+    float
+        多次执行中最快一次的用时（秒）。
+    """
+    best = None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started_at
+        best = elapsed if best == None else min(best, elapsed)
+    return best
+
+
+def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="评测从转存文件夹读取串的速度，并检查结果与原来的读取方式一致",
+    )
+
+    parser.add_argument("dump_folder_path",
+                        help="逐页存放的转存文件夹路径", metavar="<path to dump folder>",
+                        type=Path)
+    parser.add_argument("--repeat",
+                        help="每种方式重复的次数，取最快一次，默认为3", metavar="<count>",
+                        type=int, dest="repeat", default=3)
+    parser.add_argument("--log-config", "--logging-configuration",
+                        help="python logging配置文件的路径", metavar="<path to python logging.conf>",
+                        type=Path, dest="log_config")
+
+    args = parser.parse_args(args)
+
+    if args.log_config != None:
+        logging.config.fileConfig(
+            args.log_config, disable_existing_loggers=False)
+
+    return args
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+from typing import List, Any
+
+import sys
+import io
+import tempfile
+import filecmp
+from contextlib import contextmanager
+from types import ModuleType
+import logging
+import logging.config
+import argparse
+from pathlib import Path
+import time
+import urllib.parse
+import unicodedata
+
+import yaml
+from emoji import UNICODE_EMOJI
+
+from src.poststore import PostStore
+from src.trace import get_processable_page_info_list
+from src.configloader import DivisionsConfiguration, DivisionType
+import src.divisiontree.buildtree
+import src.generating.generating
+from src.divisiontree import TreeBuilder, Node, DivisionNode, IncludeNode
+from src.generating import OutputsGenerator
+
+
+def reference_githubize_heading_name(name: str) -> str:
+    result = ""
+    for char in name:
+        category = unicodedata.category(char)
+        if category.startswith("P") or category.startswith("S"):
+            continue
+        if char in UNICODE_EMOJI:
+            continue
+        result += char
+    return result
+
+
+def reference_path(node: Node) -> List[Node]:
+    nodes = []
+    while True:
+        nodes.append(node)
+        if node.parent == None:
+            break
+        node = node.parent
+    return list(reversed(nodes))
+
+
+def reference_global_nest_level(node: Node) -> int:
+    l = 0
+    while node.parent != None:
+        l += 1
+        node = node.parent
+    return l
+
+
+def reference_heading_id(node: Node) -> str:
+    id = urllib.parse.quote(reference_githubize_heading_name(node.title))
+    if node.title_number_in_parent_file != 1:
+        id += f"-{node.title_number_in_parent_file-1}"
+    return id
+
+
+def reference_file_base_name(node: Node) -> str:
+    if node.parent == None:
+        return "README"
+    return "·".join(list(map(lambda node: node.title, reference_path(node)))[1:])
+
+
+def reference_nest_level_in_parent_file(node: DivisionNode) -> int:
+    l = 0
+    if node.type == DivisionType.FILE:
+        l += 1
+        node = node.parent
+    while node.type == DivisionType.SECTION:
+        l += 1
+        node = node.parent
+    return l
+
+
+@contextmanager
+def reference_implementations():
+    """
+    临时换回原来每次沿父节点链计算的实现。
+    """
+    replacements = [
+        (Node, "githubized_title", property(
+            lambda node: reference_githubize_heading_name(node.title))),
+        (Node, "global_nest_level", property(reference_global_nest_level)),
+        (Node, "heading_id", property(reference_heading_id)),
+        (Node, "file_base_name", property(reference_file_base_name)),
+        (Node, "path", property(lambda node: iter(reference_path(node)))),
+        (Node, "title_path", property(
+            lambda node: map(lambda node: node.title, reference_path(node)))),
+        (DivisionNode, "nest_level_in_parent_file",
+         property(reference_nest_level_in_parent_file)),
+        (IncludeNode, "nest_level_in_parent_file",
+         property(reference_nest_level_in_parent_file)),
+        (src.divisiontree.buildtree, "githubize_heading_name",
+         reference_githubize_heading_name),
+        (src.generating.generating, "githubize_heading_name",
+         reference_githubize_heading_name),
+    ]
+    originals = list(map(lambda r: (r[0], r[1], getattr(r[0], r[1]) if isinstance(r[0], ModuleType) else r[0].__dict__[r[1]]),
+                         replacements))
+    for (owner, name, value) in replacements:
+        setattr(owner, name, value)
+    try:
+        yield
+    finally:
+        for (owner, name, value) in originals:
+            setattr(owner, name, value)
+
+
+def main(args: List[str]):
+    logging.debug(f"args: {args}")
+    args = parse_args(prog=args[0], args=args[1:])
+
+    (page_info_list, _) = get_processable_page_info_list(args.dump_folder_path)
+    post_pool = PostStore.load_from_dump_folder(
+        args.dump_folder_path, page_info_list)
+    div_cfg = generate_divisions_configuration(args.division_count)
+
+    with tempfile.TemporaryDirectory() as output_root_path:
+        reference_output_path = Path(output_root_path) / "reference"
+        output_path = Path(output_root_path) / "cached"
+        with reference_implementations():
+            reference_elapsed = render(
+                post_pool, div_cfg, reference_output_path)
+        elapsed = render(post_pool, div_cfg, output_path)
+
+        print(f"共{args.division_count}个切割")
+        print(f"每次沿父节点链计算：{reference_elapsed:.3f}秒")
+        print(f"缓存于节点：{elapsed:.3f}秒，为原来的{reference_elapsed / elapsed:.2f}倍速")
+        comparison = filecmp.dircmp(reference_output_path, output_path)
+        if len(comparison.left_only) + len(comparison.right_only) > 0 \
+                or len(filecmp.cmpfiles(reference_output_path, output_path, comparison.common_files, shallow=False)[0]) != len(comparison.common_files):
+            print("输出不一致")
+            exit(1)
+        print(f"输出一致，共{len(comparison.common_files)}个文件")
+
+
+def render(post_pool: PostStore, div_cfg: DivisionsConfiguration, output_folder_path: Path) -> float:
+    """
+    Returns
+    -------
+    float
+        构建切割树并生成输出的用时（秒）。
+    """
+    output_folder_path.mkdir()
+    started_at = time.perf_counter()
+    (tree, post_claims) = TreeBuilder.build_tree(
+        post_pool=post_pool, div_cfg=div_cfg)
+    OutputsGenerator.generate_outputs(
+        output_folder_path=output_folder_path,
+        post_pool=post_pool,
+        div_cfg=div_cfg,
+        div_cfg_folder_path=Path("."),
+        division_tree=tree,
+        post_claims=post_claims,
+    )
+    return time.perf_counter() - started_at
+
+
+def generate_divisions_configuration(division_count: int) -> DivisionsConfiguration:
+    """
+    生成约有 `division_count` 个切割的配置。
+    第一、二层为单独的文件，之后为文件内的章节；标题带有标点与 emoji。
+    PO 的饼干不存在，以免渲染回应的用时掩盖节点信息的用时。
+    """
+    width = 10
+    depth = 1
+    while sum(map(lambda level: width ** level, range(1, depth + 1))) < division_count:
+        depth += 1
+
+    def rule_at(level: int, i: int) -> Any:
+        rule = {
+            "title": f"第{level}层：第{i % 97}节！🎉",
+            "division-type": "file" if level <= 2 else "section",
+        }
+        if level < depth:
+            rule["children"] = list(
+                map(lambda j: rule_at(level + 1, i * width + j), range(width)))
+        return rule
+
+    obj = {
+        "title": "评测",
+        "po": ["-"],
+        "divisions": list(map(lambda i: rule_at(1, i), range(width))),
+    }
+    return DivisionsConfiguration.load(io.StringIO(yaml.safe_dump(obj)), root_folder_path=".")
+
+
+def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="以大量切割评测构建切割树与生成输出的速度，比较每次沿父节点链计算节点信息（层级、标题锚点、文件名等）与缓存于节点的方式，并检查两者输出一致",
+    )
+
+    parser.add_argument("dump_folder_path",
+                        help="转存文件夹路径", metavar="<path to dump folder>",
+                        type=Path)
+    parser.add_argument("--divisions",
+                        help="切割的数量，默认为10000", metavar="<count>",
+                        type=int, dest="division_count", default=10000)
+    parser.add_argument("--log-config", "--logging-configuration",
+                        help="python logging配置文件的路径", metavar="<path to python logging.conf>",
+                        type=Path, dest="log_config")
+
+    args = parser.parse_args(args)
+
+    if args.log_config != None:
+        logging.config.fileConfig(
+            args.log_config, disable_existing_loggers=False)
+
+    return args
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+from typing import List, Callable, Any, Tuple
+
+import sys
+import logging
+import logging.config
+import argparse
+from pathlib import Path
+import time
+import tracemalloc
+
+from src.thread import Thread
+from src.poststore import PostStore
+from src.trace import get_processable_page_info_list
+
+
+def main(args: List[str]):
+    logging.debug(f"args: {args}")
+    args = parse_args(prog=args[0], args=args[1:])
+
+    (page_info_list, _) = get_processable_page_info_list(args.dump_folder_path)
+
+    (post_dict, dict_memory, dict_elapsed) = measure(lambda: Thread.load_from_dump_folder(
+        args.dump_folder_path, page_info_list).flattened_post_dict())
+    print(f"共{len(page_info_list)}页，{len(post_dict)}个回应")
+    print(f"Thread + OrderedDict：占用{dict_memory / 1024 / 1024:.1f} MiB，" +
+          f"读取用时{dict_elapsed:.2f}秒（开启 tracemalloc 时）")
+
+    (post_store, store_memory, store_elapsed) = measure(lambda: PostStore.load_from_dump_folder(
+        args.dump_folder_path, page_info_list))
+    print(f"PostStore：占用{store_memory / 1024 / 1024:.1f} MiB，" +
+          f"读取用时{store_elapsed:.2f}秒（开启 tracemalloc 时），" +
+          f"内存为原来的{store_memory / dict_memory * 100:.1f}%")
+
+    if list(post_dict.keys()) != list(post_store.keys()):
+        print("串号或顺序不一致")
+        exit(1)
+    started_at = time.perf_counter()
+    for (post_id, post) in post_dict.items():
+        if post_store[post_id] != post:
+            print(f"回应 {post_id} 不一致")
+            exit(1)
+    print(f"所有回应一致，逐个取出用时{time.perf_counter() - started_at:.2f}秒")
+
+
+def measure(fn: Callable[[], Any]) -> Tuple[Any, int, float]:
+    """
+    Returns
+    -------
+    Tuple[Any, int, float]
+        结果，结果所占用的内存（字节），以及用时（秒）。
+    """
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started_at
+    (memory, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (result, memory, elapsed)
+
+
+def parse_args(prog: str, args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="对比以 `OrderedDict` 持有所有回应与以 `PostStore` 紧凑存储时的内存占用，并检查两者内容一致",
+    )
+
+    parser.add_argument("dump_folder_path",
+                        help="转存文件夹路径", metavar="<path to dump folder>",
+                        type=Path)
+    parser.add_argument("--log-config", "--logging-configuration",
+                        help="python logging配置文件的路径", metavar="<path to python logging.conf>",
+                        type=Path, dest="log_config")
+
+    args = parser.parse_args(args)
+
+    if args.log_config != None:
+        logging.config.fileConfig(
+            args.log_config, disable_existing_loggers=False)
+
+    return args
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,78 @@
+"""
+评测切割树构建的脚本共用的部分。
+"""
+
+from typing import List, Any, Tuple, Type, Mapping
+
+import logging
+import logging.config
+import argparse
+from pathlib import Path
+import time
+
+from .thread import Post
+from .configloader import DivisionsConfiguration
+from .divisiontree import TreeBuilder, DivisionNode
+
+
+def describe_tree(node: Any, depth: int = 0) -> List[Tuple[Any, ...]]:
+    """
+    将切割结果展开为列表以便比较，不包括父节点的引用。
+    """
+    if not isinstance(node, DivisionNode):
+        return [(depth, type(node).__name__, node.title)]
+    description = [(depth, node.title, node.title_number_in_parent_file,
+                    node.type, tuple(node.posts or []))]
+    if isinstance(node.children, list):
+        for child in node.children:
+            description.extend(describe_tree(child, depth + 1))
+    return description
+
+
+def build_tree_with(
+    builder_type: Type[TreeBuilder], post_pool: Mapping[int, Post], div_cfg: DivisionsConfiguration,
+) -> Tuple[TreeBuilder, DivisionNode, float]:
+    """
+    以 `builder_type` 构建切割树。
+    `TreeBuilder.build_tree` 总是构建 `TreeBuilder`，因此直接调用，以便传入用于对照的子类。
+
+    Returns
+    -------
+    Tuple[TreeBuilder, DivisionNode, float]
+        构建器、切割树的根节点，以及构建的用时（秒）。
+    """
+    started_at = time.perf_counter()
+    builder = builder_type(post_pool=post_pool, div_cfg=div_cfg)
+    tree = builder._TreeBuilder__build_root()
+    return (builder, tree, time.perf_counter() - started_at)
+
+
+def new_argument_parser(prog: str, description: str) -> argparse.ArgumentParser:
+    """
+    Returns
+    -------
+    argparse.ArgumentParser
+        已有转存文件夹路径与 `--log-config` 参数的解析器。
+    """
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description=description,
+    )
+
+    parser.add_argument("dump_folder_path",
+                        help="转存文件夹路径", metavar="<path to dump folder>",
+                        type=Path)
+    parser.add_argument("--log-config", "--logging-configuration",
+                        help="python logging配置文件的路径", metavar="<path to python logging.conf>",
+                        type=Path, dest="log_config")
+    return parser
+
+
+def parse_args(parser: argparse.ArgumentParser, args: List[str]) -> argparse.Namespace:
+    args = parser.parse_args(args)
+
+    if args.log_config != None:
+        logging.config.fileConfig(
+            args.log_config, disable_existing_loggers=False)
+
+    return args
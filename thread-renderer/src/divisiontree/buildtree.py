@@ -1,21 +1,23 @@
 from dataclasses import dataclass, field
-from typing import OrderedDict, List, Dict, Optional, Tuple
+from typing import Mapping, Sequence, List, Dict, Optional, Tuple
 
 from ..configloader import DivisionsConfiguration, DivisionRule, DivisionType, MatchUntil, MatchOnly, Collect, Include
 from ..thread import Thread, Post
 
-from .node import Node
+from .node import Node, cache_tree_metadata
 from .divisionnode import DivisionNode, PostInNode
 from .includenode import IncludeNode
 from .collectnodes import collect_nodes
+from .postindex import PostIndex
 from .exceptions import UnknownMatchRule, OnlyMatchRuleHasChildrenException
 from .utils import githubize_heading_name
 
 
 @dataclass
 class TreeBuilder:
-    post_pool: OrderedDict[int, Post]
-    post_ids: List[int]
+    post_pool: Mapping[int, Post]
+    post_ids: Sequence[int]
+    post_index: PostIndex
     post_i: int
     post_claims: Dict[int, DivisionNode]
 
@@ -26,20 +28,30 @@ class TreeBuilder:
     has_been_built = False
 
     collecting_nodes: List[DivisionNode] = field(default_factory=list)
+    # 标题 -> 按在树中先序遍历的顺序排列的节点，用于 `Collect` 规则
+    nodes_by_title: Dict[str, List[DivisionNode]] = field(default_factory=dict)
 
-    def __init__(self, post_pool: OrderedDict[int, Post], div_cfg: DivisionsConfiguration):
+    def __init__(self, post_pool: Mapping[int, Post], div_cfg: DivisionsConfiguration):
         self.post_pool = post_pool
-        self.post_ids = list(self.post_pool.keys())
+        # `LazyPostPool` 提供惰性的串号序列，避免为列出串号而读取所有页面
+        self.post_ids = getattr(post_pool, "post_ids", None) \
+            or list(self.post_pool.keys())
         self.post_i = 0
         self.post_claims = {}
 
         self.div_cfg = div_cfg
+        self.post_index = PostIndex(
+            post_pool=post_pool,
+            post_ids=self.post_ids,
+            po_cookies=div_cfg.po_cookies,
+        )
 
         # 为啥这个要在这里 init 而 `has_been_built` 不需要？
         self.collecting_nodes = []
+        self.nodes_by_title = {}
 
     @staticmethod
-    def build_tree(post_pool: OrderedDict[int, Post], div_cfg: DivisionsConfiguration) -> "DivisionTreeNode":
+    def build_tree(post_pool: Mapping[int, Post], div_cfg: DivisionsConfiguration) -> "DivisionTreeNode":
         builder = TreeBuilder(
             post_pool=post_pool,
             div_cfg=div_cfg,
@@ -68,14 +80,17 @@ class TreeBuilder:
             },
         ), self.div_cfg.division_rules))
 
+        collecting_node_ids = set(map(id, self.collecting_nodes))
         for node in self.collecting_nodes:
             assert(isinstance(node.children, Collect))
             node.children = collect_nodes(
-                node=root,
                 rule=node.children,
-                collecting_nodes=self.collecting_nodes,
+                nodes_by_title=self.nodes_by_title,
+                collecting_node_ids=collecting_node_ids,
             )
 
+        cache_tree_metadata(root)
+
         return root
 
     def __build_node(
@@ -94,6 +109,8 @@ class TreeBuilder:
             post_rules=rule.post_rules,
             children=None,
         )
+        # 在构建子节点之前登记，以保持先序遍历的顺序
+        self.__register_node(node)
 
         current_heading_name_counts = heading_name_counts.get(
             node.githubized_title, 0)+1
@@ -146,6 +163,8 @@ class TreeBuilder:
         elif isinstance(rule.match_rule, Include):
             assert(rule.post_rules == None)
             assert(rule.children == None or len(rule.children) == 0)
+            # 该节点不会出现在树中，撤销登记。由于没有子节点，它是最后登记的
+            self.nodes_by_title[node.title].pop()
             # FIXME: 如果这是最后一个第一级分割，「暂未整理」不会被生成
             return IncludeNode(
                 parent=parent_node,
@@ -166,14 +185,14 @@ class TreeBuilder:
                     self.post_claims[appended] = [node]
 
         if rule == self.div_cfg.division_rules[-1]:
-            leftover_post_ids = self.post_ids[self.post_i:]
-            if len(leftover_post_ids) > 0:
+            if self.post_i < len(self.post_ids):
+                # 只留下 PO 的回应，与 `__build_leftover_node` 中的筛选结果相同
                 node.children.append(
                     self.__build_leftover_node(
-                        posts=list(map(lambda post_id: PostInNode(
-                            post_id=post_id,
+                        posts=list(map(lambda i: PostInNode(
+                            post_id=self.post_ids[i],
                             is_weak=True,
-                        ), leftover_post_ids)),
+                        ), self.post_index.po_positions(self.post_i, len(self.post_ids)))),
                         parent_node=node,
                         heading_name_counts=heading_name_counts,
                     )
@@ -189,7 +208,7 @@ class TreeBuilder:
         heading_name_counts: Dict[str, int],
     ) -> DivisionNode:
         posts = list(filter(
-            lambda post_in_node: self.post_pool[post_in_node.post_id].user_id in self.div_cfg.po_cookies, posts))
+            lambda post_in_node: self.post_index.is_po(post_in_node.post_id), posts))
 
         if self.remain_post != None:
             posts[0] = PostInNode(
@@ -209,6 +228,7 @@ class TreeBuilder:
             post_rules=None,
             children=None,
         )
+        self.__register_node(node)
 
         current_heading_name_counts = heading_name_counts.get(
             node.githubized_title, 0)+1
@@ -217,47 +237,57 @@ class TreeBuilder:
 
         return node
 
+    def __register_node(self, node: DivisionNode):
+        self.nodes_by_title.setdefault(node.title, []).append(node)
+
     # TODO: 如果 id 比之前的要小，抛出 `UntilMatchRuleIDBelowPreviousException`
     def __collect_match_until_posts(self, match_until: MatchUntil) -> List[PostInNode]:
         posts: PostInNode = []
 
-        while self.post_i < len(self.post_ids):
-            post_id = self.post_ids[self.post_i]
-            if post_id > match_until.id:
-                break
-
-            after_text = None
-            if self.remain_post != None:
-                if self.remain_post[0] == post_id:
-                    after_text = self.remain_post[1]
-                else:
-                    posts.append(PostInNode(
-                        post_id=post_id,
-                        is_weak=True,
-                        after_text=self.remain_post[1],
-                    ))
-                self.remain_post = None
-
-            post = self.post_pool[post_id]
-
-            is_not_excluded = post_id not in (match_until.excluded or [])
-            is_po = post.user_id in self.div_cfg.po_cookies
-            if is_not_excluded and is_po:
-                if post_id == match_until.id:
-                    until_text = match_until.text_until
-                else:
-                    until_text = None
+        # 本规则涉及的位置区间为 [start, end)
+        start = self.post_i
+        end = self.post_index.end_of_until(start, match_until.id)
+        stop_at = None
+        if match_until.text_until != None:
+            # 该回应的后半部分属于之后的规则，因此下一条规则仍从该回应开始
+            stop_at = self.post_index.position_of(match_until.id, start, end)
+            if stop_at != None:
+                end = stop_at + 1
+
+        first_after_text = None
+        if start < end and self.remain_post != None:
+            first_post_id = self.post_ids[start]
+            if self.remain_post[0] == first_post_id:
+                first_after_text = self.remain_post[1]
+            else:
                 posts.append(PostInNode(
-                    post_id=post_id,
+                    post_id=first_post_id,
                     is_weak=True,
-                    after_text=after_text,
-                    until_text=until_text,
+                    after_text=self.remain_post[1],
                 ))
+            self.remain_post = None
+
+        excluded = frozenset(match_until.excluded or [])
+        for i in self.post_index.po_positions(start, end):
+            post_id = self.post_ids[i]
+            if post_id in excluded:
+                continue
+            if post_id == match_until.id:
+                until_text = match_until.text_until
+            else:
+                until_text = None
+            posts.append(PostInNode(
+                post_id=post_id,
+                is_weak=True,
+                after_text=first_after_text if i == start else None,
+                until_text=until_text,
+            ))
 
-            if match_until.text_until != None and post_id == match_until.id:
-                self.remain_post = (post_id, match_until.text_until)
-                break
-            self.post_i += 1
+        if stop_at != None:
+            self.remain_post = (match_until.id, match_until.text_until)
+            self.post_i = stop_at
+        else:
+            self.post_i = end
 
         return posts
 
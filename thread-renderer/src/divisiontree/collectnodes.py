@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import List, Optional, Dict, Set
 
 from ..configloader import Collect
 
@@ -6,30 +6,39 @@ from .divisionnode import DivisionNode
 
 
 def collect_nodes(
-    node: DivisionNode,
     rule: Collect,
-    collecting_nodes: List[DivisionNode]
+    nodes_by_title: Dict[str, List[DivisionNode]],
+    collecting_node_ids: Set[int],
 ) -> Optional[List[DivisionNode]]:
+    """
+    找出标题符合规则的节点，并收集它们的子节点。
 
-    if node.children == None or node in collecting_nodes:
-        return None
+    结果与从根节点开始逐层查找相同：查找不会深入标题已符合的节点，也不会深入其他收集节点。
+    因此只需从标题索引中的候选节点向上检查各祖先节点，而不必遍历整棵树。
+
+    Parameters
+    ----------
+    nodes_by_title : Dict[str, List[DivisionNode]]
+        标题到节点的索引，同一标题的节点按在树中先序遍历的顺序排列。
+    collecting_node_ids : Set[int]
+        所有收集节点的 `id()`。
+    """
 
     collected_nodes = []
 
-    for child in node.children:
-        if not isinstance(child, DivisionNode):
-            continue
-        if child.title == rule.parent_title_matches:
-            collected_nodes.extend(child.children)
-        else:
-            child_collect_nodes = collect_nodes(
-                node=child,
-                rule=rule,
-                collecting_nodes=collecting_nodes,
-            )
-            if child_collect_nodes != None:
-                collected_nodes.extend(child_collect_nodes)
+    for candidate in nodes_by_title.get(rule.parent_title_matches, []):
+        if is_reachable(candidate, rule, collecting_node_ids):
+            collected_nodes.extend(candidate.children)
 
     if len(collected_nodes) > 0:
         return collected_nodes
     return None
+
+
+def is_reachable(node: DivisionNode, rule: Collect, collecting_node_ids: Set[int]) -> bool:
+    ancestor = node.parent
+    while ancestor.parent != None:
+        if id(ancestor) in collecting_node_ids or ancestor.title == rule.parent_title_matches:
+            return False
+        ancestor = ancestor.parent
+    return True
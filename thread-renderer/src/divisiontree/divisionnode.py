@@ -1,6 +1,7 @@
 from __future__ import annotations
 from typing import List, Optional, Union
 from dataclasses import dataclass
+from functools import cached_property
 
 from ..configloader import DivisionType, MatchRule, PostRules, Collect, Include
 
@@ -20,18 +21,20 @@ class DivisionNode(Node):
     # 建好后类型不会是 `Collecting`
     children: Optional[Union[List["DivisionTreeNode"], Collect, Include]]
 
-    @property
+    @cached_property
+    def section_nest_level(self) -> int:
+        """
+        自身与其上连续的 SECTION 节点的层数，自身不是 SECTION 时为 0。
+        """
+        if self.type != DivisionType.SECTION:
+            return 0
+        return self.parent.section_nest_level + 1
+
+    @cached_property
     def nest_level_in_parent_file(self) -> int:
-        l = 0
-        node = self
-        if node.type == DivisionType.FILE:
-            l += 1
-            node = node.parent
-
-        while node.type == DivisionType.SECTION:
-            l += 1
-            node = node.parent
-        return l
+        if self.type == DivisionType.FILE:
+            return self.parent.section_nest_level + 1
+        return self.section_nest_level
 
     @property
     def top_heading_name(self) -> str:
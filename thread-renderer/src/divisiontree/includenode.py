@@ -1,6 +1,5 @@
 from dataclasses import dataclass
-
-from ..configloader import DivisionType
+from functools import cached_property
 
 from .node import Node
 
@@ -9,12 +8,6 @@ from .node import Node
 class IncludeNode(Node):
     file_path: str
 
-    @property
+    @cached_property
     def nest_level_in_parent_file(self) -> int:
-        l = 1
-        node = self.parent
-
-        while node.type == DivisionType.SECTION:
-            l += 1
-            node = node.parent
-        return l
+        return self.parent.section_nest_level + 1
@@ -1,60 +1,101 @@
 from __future__ import annotations
-from typing import Optional
+from typing import Optional, Tuple
 from dataclasses import dataclass
+from functools import cached_property
 
-import urllib
+import urllib.parse
 
 from .utils import githubize_heading_name
 
 
 @dataclass
 class Node:
+    """
+    节点建好后父节点与标题不再改变，因此以下由父节点链得出的信息只在第一次取用时计算，
+    并且都基于父节点已缓存的结果，每个节点只需常数时间。
+    """
+
     parent: Optional["Node"]
 
     title: str
     title_number_in_parent_file: int
 
+    # 可缓存的节点信息，按依赖顺序排列，见 `cache_tree_metadata`
+    CACHED_METADATA_NAMES = (
+        "githubized_title", "global_nest_level", "_Node__quoted_githubized_title",
+        "path", "title_path", "file_base_name",
+        "section_nest_level", "nest_level_in_parent_file",
+    )
+
     # 用于 GitHub Markdown Preview
-    @property
+    @cached_property
     def githubized_title(self) -> str:
         return githubize_heading_name(self.title)
 
-    @property
+    @cached_property
     def global_nest_level(self) -> int:
-        l = 0
-        node = self
-        while node.parent != None:
-            l += 1
-            node = node.parent
-        return l
+        if self.parent == None:
+            return 0
+        return self.parent.global_nest_level + 1
+
+    @cached_property
+    def __quoted_githubized_title(self) -> str:
+        return urllib.parse.quote(self.githubized_title)
 
     @property
     def heading_id(self):
-        id = urllib.parse.quote(self.githubized_title)
+        # `title_number_in_parent_file` 在节点创建后才设置，因此不缓存
+        id = self.__quoted_githubized_title
         if self.title_number_in_parent_file != 1:
             id += f"-{self.title_number_in_parent_file-1}"
         return id
 
-    @property
+    @cached_property
     def file_base_name(self) -> str:
         if self.parent == None:
             return "README"
 
         # 去掉主标题
-        return "·".join(list(self.title_path)[1:])
+        return "·".join(self.title_path[1:])
 
-    @property
-    def path(self) -> [Node]:
-        nodes = []
-        node = self
-        while True:
-            nodes.append(node)
-            if node.parent == None:
-                break
-            else:
-                node = node.parent
-        return reversed(nodes)
+    @cached_property
+    def path(self) -> Tuple[Node, ...]:
+        if self.parent == None:
+            return (self,)
+        return self.parent.path + (self,)
 
-    @property
-    def title_path(self) -> [str]:
-        return map(lambda node: node.title, self.path)
+    @cached_property
+    def title_path(self) -> Tuple[str, ...]:
+        if self.parent == None:
+            return (self.title,)
+        return self.parent.title_path + (self.title,)
+
+
+def cache_tree_metadata(root: Node):
+    """
+    自上而下遍历整棵树，一次性算好各节点的信息并缓存。
+
+    各信息本身也会在第一次取用时计算并缓存，但 `cached_property` 每次计算都有额外的开销，
+    而在这里直接写入节点的 `__dict__`，计算时父节点的信息也已经就绪。
+    """
+    visited_node_ids = set()
+    nodes = [root]
+    while len(nodes) > 0:
+        node = nodes.pop()
+        # 收集节点的子节点也出现在树的其他位置
+        if id(node) in visited_node_ids:
+            continue
+        visited_node_ids.add(id(node))
+
+        for name in Node.CACHED_METADATA_NAMES:
+            if name in node.__dict__:
+                continue
+            for cls in type(node).__mro__:
+                attribute = cls.__dict__.get(name, None)
+                if isinstance(attribute, cached_property):
+                    node.__dict__[name] = attribute.func(node)
+                    break
+
+        children = getattr(node, "children", None)
+        if isinstance(children, list):
+            nodes.extend(reversed(children))
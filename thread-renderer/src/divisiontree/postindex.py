@@ -0,0 +1,93 @@
+from typing import Mapping, Sequence, Optional, Iterator, Collection
+
+from bisect import bisect_left, bisect_right
+from operator import lt
+from itertools import islice
+
+from ..thread import Post
+
+
+class PostIndex:
+    """
+    供 `TreeBuilder` 按位置区间查询回应的索引。
+
+    * 串号按位置排列，严格递增时以二分查找定位区间的边界，否则逐个比较；
+    * 各位置是否为 PO 的回应记录在 `bytearray` 中，首次查询到该位置时才从回应池取出回应判断，
+      因此不会为了判断饼干而多次查询同一个回应，也不会读取从未查询过的部分。
+    """
+
+    UNKNOWN = 0
+    NOT_PO = 1
+    PO = 2
+
+    def __init__(self, post_pool: Mapping[int, Post], post_ids: Sequence[int], po_cookies: Collection[str]):
+        self.post_pool = post_pool
+        self.post_ids = post_ids
+        self.po_cookies = frozenset(po_cookies)
+        # `PostStore` 可以只取出饼干，而不必构建整个回应
+        self.__user_id_of = getattr(post_pool, "user_id_of", None) \
+            or (lambda post_id: post_pool[post_id].user_id)
+        self.__po_mask = bytearray(len(post_ids))
+        # 回应池知道串号是否有序时直接采用，而不逐个检查：
+        # 对于 `LazyPostPool`，逐个检查会读取所有页面
+        self.__is_sorted: Optional[bool] = getattr(
+            post_pool, "post_ids_are_sorted", None)
+
+    @property
+    def is_sorted(self) -> bool:
+        if self.__is_sorted == None:
+            self.__is_sorted = all(
+                map(lt, self.post_ids, islice(self.post_ids, 1, None)))
+        return self.__is_sorted
+
+    def end_of_until(self, start: int, until_id: int) -> int:
+        """
+        Returns
+        -------
+        int
+            从 `start` 开始，第一个串号大于 `until_id` 的位置；没有则为总数。
+        """
+        if self.is_sorted:
+            return bisect_right(self.post_ids, until_id, lo=start)
+        for i in range(start, len(self.post_ids)):
+            if self.post_ids[i] > until_id:
+                return i
+        return len(self.post_ids)
+
+    def position_of(self, post_id: int, start: int, end: int) -> Optional[int]:
+        """
+        Returns
+        -------
+        Optional[int]
+            串号在 [`start`, `end`) 中的位置，不在其中时为空。
+        """
+        if self.is_sorted:
+            i = bisect_left(self.post_ids, post_id, lo=start, hi=end)
+            if i < end and self.post_ids[i] == post_id:
+                return i
+            return None
+        for i in range(start, end):
+            if self.post_ids[i] == post_id:
+                return i
+        return None
+
+    def is_po_at(self, i: int) -> bool:
+        mark = self.__po_mask[i]
+        if mark == PostIndex.UNKNOWN:
+            user_id = self.__user_id_of(self.post_ids[i])
+            mark = PostIndex.PO if user_id in self.po_cookies else PostIndex.NOT_PO
+            self.__po_mask[i] = mark
+        return mark == PostIndex.PO
+
+    def po_positions(self, start: int, end: int) -> Iterator[int]:
+        """
+        依次给出 [`start`, `end`) 中属于 PO 的回应的位置。
+        """
+        return filter(self.is_po_at, range(start, end))
+
+    def is_po(self, post_id: int) -> bool:
+        if self.is_sorted:
+            i = self.position_of(post_id, 0, len(self.post_ids))
+            if i != None:
+                return self.is_po_at(i)
+        return self.__user_id_of(post_id) in self.po_cookies
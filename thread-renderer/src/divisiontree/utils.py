@@ -1,15 +1,31 @@
+from typing import Dict, Optional
+
 import unicodedata
+from functools import lru_cache
 
 from emoji import UNICODE_EMOJI
 
 
-def githubize_heading_name(name: str) -> str:
-    result = ""
-    for char in name:
+class _HeadingNameTable(Dict[int, Optional[str]]):
+    """
+    供 `str.translate` 使用的对照表：标点、符号与 emoji 映射为空（即删去），其余字符不变。
+    每个字符只在第一次遇到时判断。
+    """
+
+    def __missing__(self, code_point: int) -> Optional[str]:
+        char = chr(code_point)
         category = unicodedata.category(char)
-        if category.startswith("P") or category.startswith("S"):
-            continue
-        if char in UNICODE_EMOJI:
-            continue
-        result += char
-    return result
+        if category.startswith("P") or category.startswith("S") or char in UNICODE_EMOJI:
+            result = None
+        else:
+            result = char
+        self[code_point] = result
+        return result
+
+
+_HEADING_NAME_TABLE = _HeadingNameTable()
+
+
+@lru_cache(maxsize=None)
+def githubize_heading_name(name: str) -> str:
+    return name.translate(_HEADING_NAME_TABLE)
@@ -1 +1,3 @@
 from .generating import OutputsGenerator
+from .attachments import AttachmentResolver
+from .rendercache import RenderCache
@@ -0,0 +1,53 @@
+from typing import Optional
+
+import logging
+from pathlib import Path
+import os
+import shutil
+
+import sys
+sys.path.append(str(Path(__file__).parent.parent.parent.parent / "commons"))
+from attachmentstore import AttachmentStore  # noqa: E402
+
+
+REMOTE_ATTACHMENT_BASE_URL = "https://nmbimg.fastmirror.org/image/"
+
+
+class AttachmentResolver:
+    """
+    决定生成的文件中附件图片的地址。
+
+    `mode` 为 `link` 时指向转存文件夹中已下载的附件，
+    为 `copy` 时将已下载的附件复制到输出文件夹的 `attachments` 中再指向复制后的文件。
+    尚未下载的附件，以及 `mode` 为空时，指向远程地址。
+    """
+
+    def __init__(self, mode: Optional[str] = None,
+                 dump_folder_path: Optional[Path] = None,
+                 output_folder_path: Optional[Path] = None):
+        self.mode = mode
+        self.output_folder_path = output_folder_path
+        self.__store = None
+        if mode != None:
+            self.__store = AttachmentStore.load(dump_folder_path)
+            logging.info(f"转存文件夹中已下载{len(self.__store)}个附件")
+
+    def resolve(self, adnmb_img: str, adnmb_ext: str) -> str:
+        key = AttachmentStore.key(adnmb_img, adnmb_ext)
+        object_path = None
+        if self.__store != None:
+            object_path = self.__store.get_object_path(key)
+        if object_path == None or not object_path.exists():
+            return f"{REMOTE_ATTACHMENT_BASE_URL}{key}"
+
+        if self.mode == "copy":
+            copied_path = self.output_folder_path / \
+                AttachmentStore.FOLDER_NAME / object_path.name
+            if not copied_path.exists():
+                copied_path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(object_path, copied_path)
+            object_path = copied_path
+
+        # 输出的文件都位于输出文件夹的根目录下
+        return Path(os.path.relpath(
+            object_path.absolute(), self.output_folder_path.absolute())).as_posix()
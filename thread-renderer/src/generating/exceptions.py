@@ -8,3 +8,8 @@ from ..configloader import DivisionType
 class UnexpectedDivisionTypeException(Exception):
     got: Optional[DivisionType]
     expected: Optional[DivisionType]
+
+
+@dataclass
+class UnclosedQuoteLinkException(Exception):
+    line: str
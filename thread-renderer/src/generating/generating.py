@@ -1,9 +1,13 @@
-from dataclasses import dataclass
-from typing import OrderedDict, Optional, List, Dict
+from dataclasses import dataclass, field
+from typing import Mapping, Optional, List, Dict, TextIO, Tuple, Any
 
 import logging
 import io
 from pathlib import Path
+import shutil
+from tempfile import SpooledTemporaryFile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 from ..configloader import DivisionsConfiguration, DivisionType, PostRule
 from ..thread import Post
@@ -11,27 +15,37 @@ from ..divisiontree import Node, DivisionNode, PostInNode, IncludeNode
 from ..divisiontree.utils import githubize_heading_name
 
 from .postrenderer import PostRenderer
+from .rendercache import RenderCache
+from .quotegraph import QuoteGraph
+from .attachments import AttachmentResolver
 from .exceptions import UnexpectedDivisionTypeException
 from .breadcrumb import render_breadcrumb
 from .toc import render_toc
 
 
-@dataclass
-class DivisionOutputBuilder:
-    breadcrumb: Optional[str] = None
-    heading: Optional[str] = None
-    intro: Optional[str] = None
-    toc: Optional[str] = None
-    self_posts: Optional[str] = None
-    children: Optional[str] = None
+class DivisionOutputWriter:
+    """
+    将切割的各部分（面包屑、标题、简介、目录、自身的回应、子节点）依次写入 `sink`，
+    各部分之间以换行分隔，不存在的部分不会写入。
+    """
+
+    def __init__(self, sink: TextIO):
+        self.sink = sink
+        self.__has_written_part = False
 
-    def build(self) -> str:
+    def begin_part(self) -> TextIO:
+        """
+        开始新的一部分，之后直接向返回的 `sink` 写入该部分的内容。
+        """
+        if self.__has_written_part:
+            self.sink.write("\n")
+        self.__has_written_part = True
+        return self.sink
 
-        return "\n".join(filter(lambda x: x != None, [
-            self.breadcrumb, self.heading,
-            self.intro, self.toc,
-            self.self_posts, self.children,
-        ]))
+    def write_part(self, part: Optional[str]):
+        if part == None:
+            return
+        self.begin_part().write(part)
 
 
 @dataclass
@@ -39,7 +53,7 @@ class OutputsGenerator:
 
     output_folder_path: Path
 
-    post_pool: OrderedDict[int, Post]
+    post_pool: Mapping[int, Post]
 
     div_cfg: DivisionsConfiguration
     div_cfg_folder_path: Path
@@ -49,15 +63,44 @@ class OutputsGenerator:
 
     post_claims: Dict[int, DivisionNode]
 
+    attachment_resolver: AttachmentResolver
+
+    render_cache: Optional[RenderCache] = None
+
+    # 各个文件的 `PostRenderer` 共用，以免同一回应的正文被重复切分
+    quote_graph: QuoteGraph = field(default_factory=QuoteGraph)
+
+    # 大于 1 时，由多个工作进程分别生成各个文件
+    worker_count: int = 1
+
+    # 暂存子节点的输出时，超过该大小后改存于临时文件
+    CHILDREN_SPOOL_MAX_SIZE = 1 << 20
+
     @staticmethod
     def generate_outputs(
         output_folder_path: Path,
-        post_pool: OrderedDict[int, Post],
+        post_pool: Mapping[int, Post],
         div_cfg: DivisionsConfiguration,
         div_cfg_folder_path: Path,
         division_tree: DivisionNode,
-        post_claims: Dict[int, DivisionNode]
+        post_claims: Dict[int, DivisionNode],
+        attachment_resolver: Optional[AttachmentResolver] = None,
+        render_cache: Optional[RenderCache] = None,
+        worker_count: int = 1,
     ):
+        """
+        Parameters
+        ----------
+        worker_count : int
+            大于 1 时，以该数量的工作进程并行生成各个文件。
+            每个文件本就各自使用新的 `PostRenderer`，文件之间除了指向子文件的链接外互不相关，
+            因此结果与逐个生成相同。工作进程以 fork 方式创建，只读地共用回应池与切割树；
+            不支持 fork 的平台上仍逐个生成。
+        """
+        if worker_count > 1 and "fork" not in multiprocessing.get_all_start_methods():
+            logging.warning("当前平台不支持以 fork 方式创建工作进程，将逐个生成文件")
+            worker_count = 1
+
         generator = OutputsGenerator(
             output_folder_path=output_folder_path,
             post_pool=post_pool,
@@ -65,86 +108,175 @@ class OutputsGenerator:
             div_cfg_folder_path=div_cfg_folder_path,
             division_tree=division_tree,
             post_claims=post_claims,
+            attachment_resolver=attachment_resolver or AttachmentResolver(),
+            render_cache=render_cache,
+            worker_count=worker_count,
         )
-        generator.__generate_division_node(
-            node=generator.division_tree,
-            post_renderer=None,
+        if worker_count > 1:
+            generator.__generate_files_in_parallel()
+        else:
+            generator.__generate_file(generator.division_tree)
+
+    def __generate_files_in_parallel(self):
+        global _generator_in_worker
+
+        # 同一节点可能经由多个父节点到达（如被 `collect` 收集），
+        # 同名的文件只生成一次，以免多个工作进程同时写入同一文件。
+        # 逐个生成时后生成的会覆盖先生成的，因此保留最后出现的位置
+        file_node_paths_by_name: Dict[str, Tuple[int, ...]] = {}
+        for (node, path) in self.__iterate_file_nodes(self.division_tree, ()):
+            file_node_paths_by_name[output_file_name_of(node)] = path
+        file_node_paths = list(file_node_paths_by_name.values())
+        logging.info(
+            f"以{self.worker_count}个工作进程生成{len(file_node_paths)}个文件")
+
+        # 工作进程 fork 时继承该变量，因此无需序列化回应池与切割树
+        _generator_in_worker = self
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.worker_count,
+                mp_context=multiprocessing.get_context("fork"),
+            ) as executor:
+                results = list(executor.map(
+                    _generate_file_in_worker, file_node_paths))
+        finally:
+            _generator_in_worker = None
+
+        if self.render_cache != None:
+            for new_cache_entries in results:
+                self.render_cache.merge(*new_cache_entries)
+
+    def __iterate_file_nodes(self, node: DivisionNode, path: Tuple[int, ...]):
+        """
+        按先序遍历依次给出根节点与各 FILE 节点，及其在切割树中的位置（各层子节点的下标）。
+        """
+        if node.type in (None, DivisionType.FILE):
+            yield (node, path)
+        for (i, child) in enumerate(node.children or []):
+            if isinstance(child, DivisionNode):
+                yield from self.__iterate_file_nodes(child, path + (i,))
+
+    def generate_file_in_worker(self, node_path: Tuple[int, ...]) -> Optional[Tuple[Any, ...]]:
+        """
+        供工作进程调用，生成 `node_path` 处的节点对应的文件。
+
+        Returns
+        -------
+        Optional[Tuple[Any, ...]]
+            本次新记下的回应渲染缓存，交由主进程合并。
+        """
+        node = self.division_tree
+        for i in node_path:
+            node = node.children[i]
+        self.__generate_file(node)
+        if self.render_cache != None:
+            return self.render_cache.take_new_entries()
+        return None
+
+    def __generate_file(self, node: DivisionNode):
+        """
+        生成根节点或 FILE 节点对应的文件，其中的 SECTION 节点共用同一个 `PostRenderer`。
+        """
+        post_renderer = PostRenderer(
+            post_pool=self.post_pool,
+            po_cookies=self.div_cfg.po_cookies,
+            expanded_post_ids=set(),
+            attachment_resolver=self.attachment_resolver,
+            render_cache=self.render_cache,
+            quote_graph=self.quote_graph,
         )
+        with open(self.output_folder_path / output_file_name_of(node), "w+") as output_file:
+            self.__write_division_node(node, post_renderer, output_file)
 
     def __generate_division_node(
         self,
         node: DivisionNode,
-        post_renderer: Optional[PostRenderer]
-    ) -> Optional[str]:
+        post_renderer: PostRenderer,
+        sink: TextIO,
+    ):
+        """
+        SECTION 节点的输出直接写入 `sink`；
+        FILE 节点的输出写入单独的文件，并向 `sink` 写入指向该文件的链接。
+        并行生成时，FILE 节点的文件由其他任务生成。
+        """
+
+        if node.type == DivisionType.SECTION:
+            self.__write_division_node(node, post_renderer, sink)
+            return
+
+        if self.worker_count <= 1:
+            self.__generate_file(node)
+
+        if node.type == DivisionType.FILE:
+            output_file_name = output_file_name_of(node)
+            sink.write(render_heading(
+                node=node,
+                is_top_level=False,
+            ) + "\n")
+            sink.write(f"⎆ [{node.title}]({output_file_name})\n")
+
+    def __write_division_node(
+        self,
+        node: DivisionNode,
+        post_renderer: PostRenderer,
+        sink: TextIO,
+    ):
         logging.debug(
             f'{"#"*(node.global_nest_level+1)} {node.title} [{node.type}]',
         )
 
-        if post_renderer == None or node.type in (None, DivisionType.FILE):
-            post_renderer = PostRenderer(
-                post_pool=self.post_pool,
-                po_cookies=self.div_cfg.po_cookies,
-                expanded_post_ids=set(),
-            )
-
-        output = DivisionOutputBuilder()
+        output = DivisionOutputWriter(sink)
 
         if node.type in (None, DivisionType.FILE):
-            output.breadcrumb = render_breadcrumb(node)
+            output.write_part(render_breadcrumb(node))
 
-        output.heading = render_heading(
+        output.write_part(render_heading(
             node,
             is_top_level=(node.type in (None, DivisionType.FILE)),
-        )
+        ))
 
-        output.intro = node.intro
+        output.write_part(node.intro)
 
         if node.type == DivisionType.FILE:
-            output.toc = render_toc(
+            output.write_part(render_toc(
                 node=node,
                 toc_cfg=self.div_cfg.toc,
-            )
+            ))
 
+        # 子节点要先于自身的回应渲染，以决定被引用的回应在何处展开，
+        # 但输出位于自身的回应之后，因此先暂存起来
+        children_output = None
         if len(node.children or []) > 0:
-            output.children = self.__generate_children(
+            children_output = SpooledTemporaryFile(
+                max_size=OutputsGenerator.CHILDREN_SPOOL_MAX_SIZE,
+                mode="w+", encoding="utf-8", newline="",
+            )
+            self.__generate_children(
                 children=node.children,
                 post_renderer=post_renderer,
+                sink=children_output,
             )
 
         if len(node.posts or []) > 0:
-            output.self_posts = self.__render_posts(
+            self.__render_posts(
                 post_renderer=post_renderer,
                 posts_in_node=node.posts,
                 post_rules=node.post_rules,
+                sink=output.begin_part(),
             )
 
-        output = output.build()
-        if node.type == DivisionType.SECTION:
-            return output
-
-        if node.type == None:
-            output_file_name = "README.md"
-        else:  # node.type == DivisionType.FILE
-            output_file_name = f"{node.file_base_name}.md"
-        with open(self.output_folder_path / output_file_name, "w+") as output_file:
-            output_file.write(output)
-
-        if node.type == DivisionType.FILE:
-            output_for_parent = render_heading(
-                node=node,
-                is_top_level=False,
-            ) + "\n"
-            output_for_parent += f"⎆ [{node.title}]({output_file_name})\n"
-            return output_for_parent
+        if children_output != None:
+            with children_output:
+                children_output.seek(0)
+                shutil.copyfileobj(children_output, output.begin_part())
 
     def __render_posts(
         self,
         post_renderer: PostRenderer,
         posts_in_node: List[PostInNode],
         post_rules: Optional[Dict[int, PostRule]],
-    ) -> str:
-        output = ""
-
+        sink: TextIO,
+    ):
         default_post_rule = PostRule(
             expand_quote_links=self.div_cfg.defaults.expand_quote_links,
         )
@@ -160,7 +292,7 @@ class OutputsGenerator:
             specific_post_rule = (post_rules or {}).get(post_id, None)
             post_rule = PostRule.merge(default_post_rule, specific_post_rule)
 
-            output += post_renderer.render(
+            sink.write(post_renderer.render(
                 post=post,
                 options=PostRenderer.Options(
                     post_rule=post_rule,
@@ -168,49 +300,60 @@ class OutputsGenerator:
                     after_text=post_in_node.after_text,
                     until_text=post_in_node.until_text,
                 )
-            )
-
-        return output
+            ))
 
     def __generate_children(
             self,
             children: List[Node],
-            post_renderer: PostRenderer) -> str:
+            post_renderer: PostRenderer,
+            sink: TextIO):
 
-        outputs = []
-
-        for child in children:
+        for (i, child) in enumerate(children):
+            if i > 0:
+                sink.write("\n")
             if isinstance(child, DivisionNode):
-                outputs.append(self.__generate_division_node(
+                self.__generate_division_node(
                     node=child,
                     post_renderer=post_renderer,
-                ))
+                    sink=sink,
+                )
             elif isinstance(child, IncludeNode):
-                outputs.append(
-                    self.__generate_include_node(
-                        node=child,
-                    ))
+                self.__generate_include_node(
+                    node=child,
+                    sink=sink,
+                )
             else:
                 raise "? in __generate_children"
 
-        return "\n".join(outputs)
-
-    def __generate_include_node(self, node: IncludeNode):
+    def __generate_include_node(self, node: IncludeNode, sink: TextIO):
 
         output_file_name = f"{node.file_base_name}.md"
 
-        with open(self.div_cfg_folder_path / node.file_path) as input_file:
-            input = input_file.read()
-
-        with open(self.output_folder_path / output_file_name, "w+") as output_file:
-            output_file.write(render_breadcrumb(node) + "\n" + input)
+        with open(self.div_cfg_folder_path / node.file_path) as input_file, \
+                open(self.output_folder_path / output_file_name, "w+") as output_file:
+            output_file.write(render_breadcrumb(node) + "\n")
+            shutil.copyfileobj(input_file, output_file)
 
-        output_for_parent = render_heading(
+        sink.write(render_heading(
             node=node,
             is_top_level=False,
-        ) + "\n"
-        output_for_parent += f"⎆ [{node.title}]({output_file_name})\n"
-        return output_for_parent
+        ) + "\n")
+        sink.write(f"⎆ [{node.title}]({output_file_name})\n")
+
+
+# 并行生成时，工作进程从 fork 时继承的该变量取得生成器
+_generator_in_worker: Optional[OutputsGenerator] = None
+
+
+def _generate_file_in_worker(node_path: Tuple[int, ...]) -> Optional[Tuple[Any, ...]]:
+    return _generator_in_worker.generate_file_in_worker(node_path)
+
+
+def output_file_name_of(node: DivisionNode) -> str:
+    if node.type == None:
+        return "README.md"
+    # node.type == DivisionType.FILE
+    return f"{node.file_base_name}.md"
 
 
 def render_heading(node: Node, is_top_level: bool):
@@ -1,20 +1,30 @@
 #!/usr/bin/env python3
 
-from typing import OrderedDict, List, Set, Union, Optional, Tuple
-from dataclasses import dataclass
+from typing import Mapping, List, Set, Union, Optional, Tuple
+from dataclasses import dataclass, field
 
 from ..thread import Post
 from ..configloader import DivisionsConfiguration, DivisionRule, PostRule
+from .attachments import AttachmentResolver
+from .rendercache import RenderCache, RenderTrace
+from .quotegraph import QuoteGraph, PostContent, ContentLine, tokenize_line, out_of_thread_ids_among
 
 
 @dataclass(frozen=True)
 class PostRenderer:
 
-    post_pool: OrderedDict[int, Post]
+    post_pool: Mapping[int, Post]
     po_cookies: List[str]
 
     expanded_post_ids: Set[int]
 
+    attachment_resolver: AttachmentResolver = field(
+        default_factory=AttachmentResolver)
+
+    render_cache: Optional[RenderCache] = None
+
+    quote_graph: QuoteGraph = field(default_factory=QuoteGraph)
+
     @dataclass
     class Options:
         post_rule: PostRule
@@ -28,13 +38,36 @@ class PostRenderer:
             return PostRenderer.Options(**d)
 
     def render(self, post: Post, options: "PostRenderer.Options") -> str:
-        return "\n".join(self.__render_lines(post, options, nest_level=0)) + "\n"
-
-    def __render_lines(self, post: Post, options: "PostRenderer.Options", nest_level: int) -> str:
+        if self.render_cache == None:
+            return "\n".join(self.__render_lines(post, options, nest_level=0, trace=None)) + "\n"
+
+        key = self.render_cache.key_of(post, "\n".join([
+            repr(options.post_rule), repr(options.style),
+            repr(options.after_text), repr(options.until_text),
+            repr(sorted(self.po_cookies)),
+        ]))
+        output = self.render_cache.get(
+            key, self.post_pool, self.expanded_post_ids, self.attachment_resolver.resolve)
+        if output != None:
+            return output
+
+        trace = RenderTrace(self.expanded_post_ids)
+        output = "\n".join(self.__render_lines(
+            post, options, nest_level=0, trace=trace)) + "\n"
+        self.render_cache.put(key, trace, output)
+        return output
+
+    def __render_lines(
+        self, post: Post, options: "PostRenderer.Options", nest_level: int,
+        trace: Optional[RenderTrace],
+    ) -> str:
 
         lines = []
 
-        self.expanded_post_ids.add(post.id)
+        if trace != None:
+            trace.add_expanded(post.id)
+        else:
+            self.expanded_post_ids.add(post.id)
 
         lines.extend(['<blockquote>', ""])
 
@@ -56,20 +89,26 @@ class PostRenderer:
 
         # 生成图片部分
         if post.adnmb_img != None and options.post_rule.show_attachment != False:
-            image = f'<img width="40%" src="https://nmbimg.fastmirror.org/image/{post.adnmb_img}{post.adnmb_ext}">'
+            src = self.attachment_resolver.resolve(
+                post.adnmb_img, post.adnmb_ext)
+            if trace != None:
+                trace.dependencies.append(
+                    ("attachment", post.adnmb_img, post.adnmb_ext, src))
+            image = f'<img width="40%" src="{src}">'
             lines.extend([image, ""])
 
         # 生成正文部分
-        content = post.content.replace('\r\n', '\n')
-        if options.after_text != None:
-            p = content.partition(options.after_text)
-            # 必定切割成功，因为 until_text 已经找了一次
-            content = p[2]
-        if options.until_text != None:
-            p = content.partition(options.until_text)
-            if p[1] == "":
-                raise f"bad until_text {options.until_text}. post id: {post.id}"
-            content = p[0] + p[1]
+        out_of_thread_ids = None
+        if options.after_text == None and options.until_text == None:
+            post_content = self.quote_graph.content_of(post)
+            if options.post_rule.expand_quote_links != False:
+                out_of_thread_ids = self.quote_graph.out_of_thread_ids_of(
+                    post, self.post_pool)
+        else:
+            post_content = self.__partial_content_of(post, options)
+            if options.post_rule.expand_quote_links != False:
+                out_of_thread_ids = out_of_thread_ids_among(
+                    post_content.quoted_ids, self.post_pool)
 
         if options.after_text != None:
             lines.extend(
@@ -77,7 +116,7 @@ class PostRenderer:
 
         lines.append("<p>")
 
-        for line in content.split("<br />\n"):
+        for (i, line) in enumerate(post_content.lines):
             if line.strip() == "":
                 lines.append("</p><p>")
             else:
@@ -88,7 +127,8 @@ class PostRenderer:
                     continue
 
                 lines.extend(self.__render_content_line(
-                    line, options, nest_level=nest_level))
+                    post_content.tokenized_lines[i], options, out_of_thread_ids,
+                    nest_level=nest_level, trace=trace))
 
         lines.append("</p>")
 
@@ -102,8 +142,9 @@ class PostRenderer:
                           '<p style="font-style: italic">附加：</p>'])
 
             for appended_post_id in options.post_rule.appended:
+                appended_post = self.__get_post(appended_post_id, trace)
                 lines.extend(self.__render_lines(
-                    self.post_pool[appended_post_id],
+                    appended_post,
                     options=options.clone_and_replace_with(
                         post_rule=PostRule.merge(
                             old=options.post_rule,
@@ -112,6 +153,7 @@ class PostRenderer:
                         after_text=None, until_text=None,
                     ),
                     nest_level=nest_level+0,
+                    trace=trace,
                 ))
 
         if options.style == DivisionsConfiguration.Defaults.PostStyle.DETAILS_BLOCKQUOTE:
@@ -121,6 +163,20 @@ class PostRenderer:
         lines.append('</blockquote>')
         return lines
 
+    def __partial_content_of(self, post: Post, options: "PostRenderer.Options") -> PostContent:
+        # 只截取部分的回应不经过 `quote_graph`，以免记下的切分结果与原本的正文不符
+        content = post.content.replace('\r\n', '\n')
+        if options.after_text != None:
+            p = content.partition(options.after_text)
+            # 必定切割成功，因为 until_text 已经找了一次
+            content = p[2]
+        if options.until_text != None:
+            p = content.partition(options.until_text)
+            if p[1] == "":
+                raise f"bad until_text {options.until_text}. post id: {post.id}"
+            content = p[0] + p[1]
+        return PostContent.from_content(content)
+
     def __render_header_line(self, post: Post, is_part: bool, is_po: bool) -> str:
         header_items = [f"No.{post.id}"]
         if is_part:
@@ -137,20 +193,41 @@ class PostRenderer:
 
         return "".join(header_items)
 
-    def __render_content_line(self, line: str, options: "PostRenderer.Options", nest_level: int) -> List[str]:
+    def __get_post(self, post_id: int, trace: Optional[RenderTrace]) -> Post:
+        post = self.post_pool[post_id]
+        if trace != None:
+            trace.dependencies.append(
+                ("post", post_id, self.render_cache.fingerprint_of(post)))
+        return post
+
+    def __is_expanded(self, post_id: int, trace: Optional[RenderTrace]) -> bool:
+        if trace != None:
+            return trace.is_expanded(post_id)
+        return post_id in self.expanded_post_ids
+
+    def __is_in_pool(self, post_id: int, out_of_thread_ids: Set[int], trace: Optional[RenderTrace]) -> bool:
+        is_in_pool = post_id not in out_of_thread_ids
+        if trace != None:
+            trace.dependencies.append(("exists", post_id, is_in_pool))
+        return is_in_pool
+
+    def __render_content_line(
+        self, tokenized_line: ContentLine, options: "PostRenderer.Options", out_of_thread_ids: Set[int],
+        nest_level: int, trace: Optional[RenderTrace],
+    ) -> List[str]:
         lines = []
         unappened_content = ""
-        for (content_before, quote_link_id) in PostRenderer.split_line_by_quote_link(line):
+        for (content_before, quote_link_id) in tokenized_line:
             if quote_link_id == None:
                 unappened_content += content_before
                 continue
 
-            if quote_link_id in self.expanded_post_ids:
+            if self.__is_expanded(quote_link_id, trace):
                 # 之前已经出现过，因此不会展开
                 # 为了减少冗余，无论配置如何都不会展开
                 # TODO: 点击跳转到包含展开内容的地方
                 unappened_content += f'{content_before}<font color="#789922">&gt;&gt;No.{quote_link_id}</font>'
-            elif quote_link_id not in self.post_pool:
+            elif not self.__is_in_pool(quote_link_id, out_of_thread_ids, trace):
                 # 该引用链接位于串外，无力展开
                 # TODO: 是不是可以给个链接？
                 unappened_content += f'{content_before}<font color="#789922">&gt;&gt;No.{quote_link_id}（串外）</font>'
@@ -162,7 +239,10 @@ class PostRenderer:
                 unappened_content += f'{content_before}<font color="#789922">&gt;&gt;No.{quote_link_id}</font>'
             else:
                 # 允许展开
-                self.expanded_post_ids.add(quote_link_id)
+                if trace != None:
+                    trace.add_expanded(quote_link_id)
+                else:
+                    self.expanded_post_ids.add(quote_link_id)
 
                 line = unappened_content + content_before
                 unappened_content = ""
@@ -170,11 +250,12 @@ class PostRenderer:
                     lines.append(line+"<br />")
 
                 lines.extend(self.__render_lines(
-                    self.post_pool[quote_link_id],
+                    self.__get_post(quote_link_id, trace),
                     options=options.clone_and_replace_with(
                         after_text=None, until_text=None,
                     ),
                     nest_level=nest_level+1,
+                    trace=trace,
                 ))
         if unappened_content.strip() != "":
             lines.append(unappened_content+"<br />")
@@ -183,16 +264,4 @@ class PostRenderer:
 
     @staticmethod
     def split_line_by_quote_link(line: str) -> List[Tuple[str, Optional[int]]]:
-        (before_font_open, font_open, after_font_open) = line.partition(
-            '<font color="#789922">&gt;&gt;No.')
-        if font_open == "":
-            return [(line, None)]
-        (font_inner, font_close, after_font_close) = after_font_open.partition('</font>')
-        if font_close == "":
-            raise "what? in split_line_by_quote_link"
-        result = [(before_font_open, int(font_inner))]
-        if after_font_close != "":
-            result.extend(
-                PostRenderer.split_line_by_quote_link(after_font_close)
-            )
-        return result
+        return list(tokenize_line(line))
@@ -0,0 +1,122 @@
+from __future__ import annotations
+from typing import Dict, Optional, Tuple, Mapping, Set, OrderedDict
+from dataclasses import dataclass
+from functools import cached_property
+
+import re
+
+from ..thread import Post
+from .exceptions import UnclosedQuoteLinkException
+
+
+QUOTE_LINK_OPEN_TAG = '<font color="#789922">&gt;&gt;No.'
+QUOTE_LINK_PATTERN = re.compile(
+    re.escape(QUOTE_LINK_OPEN_TAG) + r"(.*?)</font>", re.DOTALL)
+
+# 一行中依次出现的 (引用链接之前的文本, 引用的串号)，最后一项的串号可能为 `None`
+ContentLine = Tuple[Tuple[str, Optional[int]], ...]
+
+
+def tokenize_line(line: str) -> ContentLine:
+    """
+    将一行按引用链接切分，结果与逐个 partition 引用链接的标签相同：
+    只有不含引用链接的行，或最后一个引用链接之后仍有文本时，最后一项的串号才为 `None`。
+    """
+    tokens = []
+    position = 0
+    for match in QUOTE_LINK_PATTERN.finditer(line):
+        tokens.append((line[position:match.start()], int(match.group(1))))
+        position = match.end()
+    rest = line[position:]
+    if QUOTE_LINK_OPEN_TAG in rest:
+        raise UnclosedQuoteLinkException(line=line)
+    if len(tokens) == 0 or rest != "":
+        tokens.append((rest, None))
+    return tuple(tokens)
+
+
+@dataclass
+class PostContent:
+    """
+    分好行的回应正文，各行按引用链接的切分在首次用到时进行。
+
+    Attributes
+    ----------
+    lines : Tuple[str, ...]
+        按 `<br />\n` 分行的正文，换行已统一为 `\n`。
+    """
+
+    lines: Tuple[str, ...]
+
+    @staticmethod
+    def from_content(content: str) -> PostContent:
+        return PostContent(lines=tuple(content.replace('\r\n', '\n').split("<br />\n")))
+
+    @cached_property
+    def tokenized_lines(self) -> Tuple[ContentLine, ...]:
+        """
+        各行按引用链接切分的结果。
+        """
+        return tuple(map(tokenize_line, self.lines))
+
+    @cached_property
+    def quoted_ids(self) -> Tuple[int, ...]:
+        """
+        正文中引用的串号，按首次出现的顺序排列且不重复。
+        """
+        quoted_ids = dict()
+        for line in self.tokenized_lines:
+            for (_, quote_link_id) in line:
+                if quote_link_id != None:
+                    quoted_ids[quote_link_id] = None
+        return tuple(quoted_ids.keys())
+
+
+class QuoteGraph:
+    """
+    回应到其引用的串号的图。
+
+    图中只保留各回应引用的串号；切分好的正文则只保留最近用到的一部分，
+    被挤出后再次用到时重新切分，以免整个串的正文都驻留在内存中。
+    由于回应池可能按需读取页面，图也只包含用到过的回应，而非预先切分整个串。
+    """
+
+    def __init__(self, max_cached_content_count: int = 1024):
+        self.max_cached_content_count = max(max_cached_content_count, 1)
+        self.__quoted_ids: Dict[int, Tuple[int, ...]] = {}
+        self.__contents: OrderedDict[int, PostContent] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__quoted_ids)
+
+    def content_of(self, post: Post) -> PostContent:
+        content = self.__contents.get(post.id, None)
+        if content != None:
+            self.__contents.move_to_end(post.id)
+            return content
+
+        content = PostContent.from_content(post.content)
+        self.__contents[post.id] = content
+        if len(self.__contents) > self.max_cached_content_count:
+            self.__contents.popitem(last=False)
+        return content
+
+    def quoted_ids_of(self, post: Post) -> Tuple[int, ...]:
+        quoted_ids = self.__quoted_ids.get(post.id, None)
+        if quoted_ids == None:
+            quoted_ids = self.content_of(post).quoted_ids
+            self.__quoted_ids[post.id] = quoted_ids
+        return quoted_ids
+
+    def out_of_thread_ids_of(self, post: Post, post_pool: Mapping[int, Post]) -> Set[int]:
+        """
+        Returns
+        -------
+        Set[int]
+            回应引用的串号中不在 `post_pool` 中的那些。
+        """
+        return out_of_thread_ids_among(self.quoted_ids_of(post), post_pool)
+
+
+def out_of_thread_ids_among(quoted_ids: Tuple[int, ...], post_pool: Mapping[int, Post]) -> Set[int]:
+    return set(filter(lambda quote_link_id: quote_link_id not in post_pool, quoted_ids))
@@ -0,0 +1,169 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple, Any, Mapping, Set
+
+import logging
+from pathlib import Path
+import os
+import pickle
+import struct
+from hashlib import sha1
+
+from ..thread import Post
+
+
+class RenderTrace:
+    """
+    记录渲染一个回应（包括其附加与展开的回应）时依赖的外部状态，以便之后判断能否沿用渲染结果。
+    """
+
+    def __init__(self, expanded_post_ids: Set[int]):
+        self.expanded_post_ids = expanded_post_ids
+        # 依赖项，依次为 ("post", 串号, 指纹)、("exists", 串号, 是否在串中)、
+        # ("expanded", 串号, 渲染前是否已展开过)、("attachment", img, ext, 地址)
+        self.dependencies: List[Tuple[Any, ...]] = []
+        self.added_post_ids: List[int] = []
+        self.__added_post_id_set: Set[int] = set()
+
+    def add_expanded(self, post_id: int):
+        self.expanded_post_ids.add(post_id)
+        if post_id not in self.__added_post_id_set:
+            self.__added_post_id_set.add(post_id)
+            self.added_post_ids.append(post_id)
+
+    def is_expanded(self, post_id: int) -> bool:
+        is_expanded = post_id in self.expanded_post_ids
+        # 由本次渲染展开的回应不取决于渲染前的状态
+        if post_id not in self.__added_post_id_set:
+            self.dependencies.append(("expanded", post_id, is_expanded))
+        return is_expanded
+
+
+class RenderCache:
+    """
+    跨多次生成沿用的回应渲染结果，存于输出文件夹旁的缓存文件夹中。
+
+    以回应与渲染选项（串号、内容指纹、生效的 `PostRule`、样式、起止文本）为键，
+    每个键下可以有多个结果，各自记录了渲染时依赖的状态：
+    附加或展开的回应的内容指纹、引用的回应是否在串中、引用的回应在渲染前是否已被展开过，
+    以及附件的地址。这些状态都与当前一致时才沿用，并照原样将涉及的回应标记为已展开。
+
+    只保留本次生成中用到的结果，因此缓存不会无限增长。
+    """
+
+    FILE_NAME = ".render-cache"
+    MAGIC = b"ANOBBS-RENDER-CACHE"
+    # 渲染的输出格式有变化时需要增加版本号
+    VERSION = 1
+    HEADER = struct.Struct(f"<{len(MAGIC)}sI")
+
+    def __init__(self, entries: Optional[Dict[bytes, List[Tuple[Any, ...]]]] = None):
+        self.__old_entries = entries or {}
+        self.__entries: Dict[bytes, List[Tuple[Any, ...]]] = {}
+        self.__fingerprints: Dict[int, bytes] = {}
+        self.hit_count = 0
+        self.miss_count = 0
+
+    @staticmethod
+    def load(file_path: Path) -> RenderCache:
+        """
+        缓存不存在、版本不符或无法读取时返回空的缓存。
+        """
+        try:
+            with open(file_path, "rb") as cache_file:
+                header = cache_file.read(RenderCache.HEADER.size)
+                if len(header) != RenderCache.HEADER.size:
+                    return RenderCache()
+                (magic, version) = RenderCache.HEADER.unpack(header)
+                if magic != RenderCache.MAGIC or version != RenderCache.VERSION:
+                    logging.info("回应渲染缓存的版本不符，将不会使用")
+                    return RenderCache()
+                return RenderCache(entries=pickle.load(cache_file))
+        except FileNotFoundError:
+            return RenderCache()
+        except Exception as e:
+            logging.warning(f"无法读取回应渲染缓存，将不会使用：{e}")
+            return RenderCache()
+
+    def save(self, file_path: Path):
+        tmp_file_path = file_path.parent / f"_{file_path.name}"
+        with open(tmp_file_path, "wb") as cache_file:
+            cache_file.write(RenderCache.HEADER.pack(
+                RenderCache.MAGIC, RenderCache.VERSION))
+            pickle.dump(self.__entries, cache_file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file_path, file_path)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hit_count + self.miss_count
+        return self.hit_count / total if total > 0 else 0
+
+    def fingerprint_of(self, post: Post) -> bytes:
+        fingerprint = self.__fingerprints.get(post.id, None)
+        if fingerprint == None:
+            fingerprint = sha1(repr(post).encode("utf-8")).digest()
+            self.__fingerprints[post.id] = fingerprint
+        return fingerprint
+
+    def key_of(self, post: Post, options_repr: str) -> bytes:
+        return sha1(f"{post.id}\n{options_repr}\n".encode("utf-8") + self.fingerprint_of(post)).digest()
+
+    def get(
+        self, key: bytes, post_pool: Mapping[int, Post], expanded_post_ids: Set[int], resolve_attachment,
+    ) -> Optional[str]:
+        """
+        找出依赖的状态都与当前一致的结果，并将涉及的回应标记为已展开。
+        """
+        for entry in self.__old_entries.get(key, []):
+            (dependencies, added_post_ids, output) = entry
+            if all(map(lambda dependency: self.__is_satisfied(
+                    dependency, post_pool, expanded_post_ids, resolve_attachment), dependencies)):
+                expanded_post_ids.update(added_post_ids)
+                self.__keep(key, entry)
+                self.hit_count += 1
+                return output
+        self.miss_count += 1
+        return None
+
+    def put(self, key: bytes, trace: RenderTrace, output: str):
+        self.__keep(key, (tuple(trace.dependencies),
+                    tuple(trace.added_post_ids), output))
+
+    def take_new_entries(self) -> Tuple[Dict[bytes, List[Tuple[Any, ...]]], int, int]:
+        """
+        取出至今记下的结果与命中次数并清空，用于并行生成时由工作进程交回主进程。
+        """
+        new_entries = (self.__entries, self.hit_count, self.miss_count)
+        self.__entries = {}
+        self.hit_count = 0
+        self.miss_count = 0
+        return new_entries
+
+    def merge(self, entries: Dict[bytes, List[Tuple[Any, ...]]], hit_count: int, miss_count: int):
+        for (key, key_entries) in entries.items():
+            for entry in key_entries:
+                self.__keep(key, entry)
+        self.hit_count += hit_count
+        self.miss_count += miss_count
+
+    def __keep(self, key: bytes, entry: Tuple[Any, ...]):
+        entries = self.__entries.setdefault(key, [])
+        if entry not in entries:
+            entries.append(entry)
+
+    def __is_satisfied(
+        self, dependency: Tuple[Any, ...],
+        post_pool: Mapping[int, Post], expanded_post_ids: Set[int], resolve_attachment,
+    ) -> bool:
+        kind = dependency[0]
+        if kind == "expanded":
+            return (dependency[1] in expanded_post_ids) == dependency[2]
+        if kind == "exists":
+            return (dependency[1] in post_pool) == dependency[2]
+        if kind == "post":
+            post = post_pool.get(dependency[1], None)
+            return post != None and self.fingerprint_of(post) == dependency[2]
+        if kind == "attachment":
+            # 复制附件时，解析地址的同时也会将附件复制到输出文件夹
+            return resolve_attachment(dependency[1], dependency[2]) == dependency[3]
+        return False
@@ -0,0 +1,224 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Any, Iterator, Tuple, Mapping, Sequence, OrderedDict, Union
+
+import logging
+from pathlib import Path
+import os
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+from .thread import Post, decode_json
+from .trace import PageInfo
+
+import sys
+sys.path.append(str(Path(__file__).parent.parent.parent / "commons"))
+from packeddump import PackedPageStore  # noqa: E402
+
+
+class LazyPostPool(Mapping[int, Post]):
+    """
+    按需读取页面的回应池，可代替 `PostStore` 传给 `TreeBuilder` 与 `OutputsGenerator`。
+
+    以页面清单中各页的首末串号与回应数为索引，
+    取用某个回应时只读取其所在的页面，同时驻留的页面数量以 LRU 限制。
+    因此只用到 `only:` 规则、或只渲染一部分时，不必读取整个串。
+
+    页面清单缺少上述信息、或各页串号并非严格递增时，
+    会在开始时先完整读一遍各页来建立索引，之后仍按需读取。
+    """
+
+    def __init__(self, path: Path, page_info_list: List[PageInfo], max_resident_page_count: int = 64):
+        self.path = path
+        self.max_resident_page_count = max(max_resident_page_count, 1)
+        self.__page_infos = list(page_info_list)
+
+        with open(path / "thread.json", "rb") as thread_file:
+            thread_object = decode_json(thread_file.read())
+        self.thread_id = thread_object["id"]
+        self.__body = Post.load_from_object(
+            thread_object, thread_id=self.thread_id, page_number=1)
+        self.thread_body_id = self.__body.id
+
+        self.__store = None
+        if PackedPageStore.exists(path):
+            self.__store = PackedPageStore.open(path, read_only=True)
+
+        # 页序号 -> (该页各回应, 串号 -> 回应)
+        self.__resident_pages: OrderedDict[int, Tuple[List[Post], Dict[int, Post]]] = OrderedDict()
+        self.loaded_page_count = 0
+        """读取页面的次数，包括被挤出后再次读取。"""
+
+        # 各页首末串号严格递增时，以二分查找定位页面；否则以字典记录各串号所在的页面
+        self.__first_post_ids: List[int] = []
+        self.__last_post_ids: List[int] = []
+        self.__page_indices_by_post_id: Optional[Dict[int, int]] = None
+        self.__ordered_post_ids: Optional[List[int]] = None
+        self.__are_ordered_post_ids_sorted = True
+        if self.__has_range_index():
+            self.__first_post_ids = list(
+                map(lambda page_info: page_info.first_post_id, self.__page_infos))
+            self.__last_post_ids = list(
+                map(lambda page_info: page_info.last_post_id, self.__page_infos))
+            # 第 i 页第一个回应在整个串中的位置，串本身位于 0
+            self.__page_offsets = list(accumulate(
+                map(lambda page_info: page_info.reply_count, self.__page_infos), initial=1))
+        else:
+            logging.info("页面清单缺少各页的串号范围，将先读取所有页面建立索引")
+            self.__build_explicit_index()
+
+    def __has_range_index(self) -> bool:
+        last_post_id = self.__body.id
+        for page_info in self.__page_infos:
+            if page_info.first_post_id == None or page_info.last_post_id == None \
+                    or page_info.reply_count == None:
+                return False
+            if page_info.first_post_id <= last_post_id or page_info.last_post_id < page_info.first_post_id:
+                return False
+            last_post_id = page_info.last_post_id
+        return True
+
+    def __build_explicit_index(self):
+        # 与 `flattened_post_dict` 一致：位置取首次出现，内容取最后一次出现
+        self.__page_indices_by_post_id = {self.__body.id: None}
+        self.__ordered_post_ids = [self.__body.id]
+        for page_index in range(len(self.__page_infos)):
+            for post_object in self.__read_page_object(page_index):
+                post_id = int(post_object["id"])
+                if post_id not in self.__page_indices_by_post_id:
+                    if post_id <= self.__ordered_post_ids[-1]:
+                        self.__are_ordered_post_ids_sorted = False
+                    self.__ordered_post_ids.append(post_id)
+                self.__page_indices_by_post_id[post_id] = page_index
+
+    def close(self):
+        if self.__store != None:
+            self.__store.close()
+
+    def __enter__(self) -> LazyPostPool:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def post_ids(self) -> Sequence[int]:
+        """
+        按顺序排列的所有串号。
+        有范围索引时为惰性序列，只在取用某个位置时读取对应的页面。
+        """
+        if self.__ordered_post_ids != None:
+            return self.__ordered_post_ids
+        return _LazyPostIds(self)
+
+    @property
+    def post_ids_are_sorted(self) -> bool:
+        """
+        `post_ids` 是否严格递增。
+        有范围索引时各页的串号范围严格递增，页内的回应也按串号排列，因此无需读取页面。
+        """
+        return self.__are_ordered_post_ids_sorted
+
+    def __read_page_object(self, page_index: int) -> List[Any]:
+        page_info = self.__page_infos[page_index]
+        if self.__store != None:
+            page_bytes = self.__store.read_page_bytes(page_info.number)
+            try:
+                return decode_json(page_bytes)
+            finally:
+                page_bytes.release()
+        with open(os.path.join(self.path, "pages", page_info.filename()), "rb") as page_file:
+            return decode_json(page_file.read())
+
+    def page_posts(self, page_index: int) -> List[Post]:
+        return self.__get_page(page_index)[0]
+
+    def __get_page(self, page_index: int) -> Tuple[List[Post], Dict[int, Post]]:
+        page = self.__resident_pages.get(page_index, None)
+        if page != None:
+            self.__resident_pages.move_to_end(page_index)
+            return page
+
+        page_info = self.__page_infos[page_index]
+        posts = Post.load_from_objects(
+            self.__read_page_object(page_index), self.thread_id, page_info.number)
+        page = (posts, dict(map(lambda post: (post.id, post), posts)))
+        self.loaded_page_count += 1
+        self.__resident_pages[page_index] = page
+        if len(self.__resident_pages) > self.max_resident_page_count:
+            self.__resident_pages.popitem(last=False)
+        return page
+
+    def __page_index_of(self, post_id: int) -> Optional[int]:
+        if self.__page_indices_by_post_id != None:
+            return self.__page_indices_by_post_id.get(post_id, None)
+        page_index = bisect_left(self.__last_post_ids, post_id)
+        if page_index < len(self.__page_infos) and self.__first_post_ids[page_index] <= post_id:
+            return page_index
+        return None
+
+    def locate(self, position: int) -> Tuple[int, int]:
+        """
+        Returns
+        -------
+        Tuple[int, int]
+            串中第 `position` 个回应所在的页序号，以及在该页中的位置。
+        """
+        page_index = bisect_right(self.__page_offsets, position) - 1
+        return (page_index, position - self.__page_offsets[page_index])
+
+    def __len__(self) -> int:
+        if self.__ordered_post_ids != None:
+            return len(self.__ordered_post_ids)
+        return self.__page_offsets[-1]
+
+    def __getitem__(self, post_id: int) -> Post:
+        if post_id == self.__body.id:
+            return self.__body
+        page_index = self.__page_index_of(post_id)
+        if page_index == None:
+            raise KeyError(post_id)
+        return self.__get_page(page_index)[1][post_id]
+
+    def __contains__(self, post_id: Any) -> bool:
+        if post_id == self.__body.id:
+            return True
+        if not isinstance(post_id, int):
+            return False
+        page_index = self.__page_index_of(post_id)
+        if page_index == None:
+            return False
+        if self.__page_indices_by_post_id != None:
+            return True
+        # 落在某页的范围内，但可能已被删除
+        return post_id in self.__get_page(page_index)[1]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.post_ids)
+
+
+class _LazyPostIds(Sequence[int]):
+    """
+    `LazyPostPool` 中按顺序排列的所有串号，取用某个位置时才读取对应的页面。
+    """
+
+    def __init__(self, pool: LazyPostPool):
+        self.pool = pool
+
+    def __len__(self) -> int:
+        return len(self.pool)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[int, List[int]]:
+        if isinstance(i, slice):
+            return list(map(self.__getitem__, range(*i.indices(len(self)))))
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+        if i == 0:
+            return self.pool.thread_body_id
+        (page_index, offset) = self.pool.locate(i)
+        return self.pool.page_posts(page_index)[offset].id
+
+    def __iter__(self) -> Iterator[int]:
+        for i in range(len(self)):
+            yield self[i]
@@ -0,0 +1,313 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Any, Iterator, Tuple, Mapping
+
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+import calendar
+import re
+import time
+
+from .thread import Thread, Post, decode_json
+from .trace import PageInfo
+
+
+class _InternedColumn:
+    """
+    取值种类不多的字符串列（如饼干、名称），每行只存一个序号。
+    序号 0 代表空。
+    """
+
+    def __init__(self):
+        self.values: List[Optional[str]] = [None]
+        self.__indices: Dict[str, int] = {}
+        self.rows = array("I")
+
+    def append(self, value: Optional[str]):
+        self.rows.append(self.__index_of(value))
+
+    def get(self, row: int) -> Optional[str]:
+        return self.values[self.rows[row]]
+
+    def __index_of(self, value: Optional[str]) -> int:
+        if value == None:
+            return 0
+        index = self.__indices.get(value, None)
+        if index == None:
+            index = len(self.values)
+            self.values.append(value)
+            self.__indices[value] = index
+        return index
+
+
+class PostStore(Mapping[int, Post]):
+    """
+    紧凑地按列存储一个串的所有回应，可代替 `Thread.flattened_post_dict` 得到的 `OrderedDict`。
+
+    * 串号、页数、标记与发布时间存于 `array` 中；
+    * 饼干、名称、邮箱、标题这类重复较多的字段只存一份，各行存序号；
+    * 附件这类多数回应没有的字段存于以行号为键的稀疏字典中；
+    * 正文以 UTF-8 连续存放，取用时才解码。
+
+    以串号取出的 `Post` 是临时构建的，与原来的 `Post` 相等，但每次取出的都是新对象。
+    遍历顺序与 `flattened_post_dict` 相同：串本身在前，其后依页面顺序；
+    同一串号重复出现时，位置取首次出现的位置，内容取最后一次出现的内容。
+    """
+
+    FLAG_SAGE = 1 << 0
+    FLAG_ADMIN = 1 << 1
+
+    # 发布时间无法以时间戳还原时的占位值，此时原文存于 `__raw_created_at`
+    RAW_CREATED_AT = -(1 << 63)
+    DAY_PATTERN = re.compile(r"^(\d{4})-(\d{2})-(\d{2})\(.\)$")
+    WEEKDAYS = "一二三四五六日"
+
+    def __init__(self, thread_id: Any):
+        self.thread_id = thread_id
+
+        # 以下各列以行号索引，同一串号重复出现时会占用新的一行
+        self.__ids = array("q")
+        self.__page_numbers = array("I")
+        self.__flags = array("B")
+        self.__created_at = array("q")
+        self.__raw_created_at: Dict[int, str] = {}
+        # 日期部分的原文与当日零时的时间戳之间的对照
+        self.__day_timestamps: Dict[str, Optional[int]] = {}
+        self.__day_texts: Dict[int, str] = {}
+        self.__user_ids = _InternedColumn()
+        self.__names = _InternedColumn()
+        self.__emails = _InternedColumn()
+        self.__titles = _InternedColumn()
+        self.__attachments: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        self.__content = bytearray()
+        self.__content_offsets = array("Q", [0])
+
+        # 遍历顺序中各位置的串号与行号
+        self.__ordered_ids = array("q")
+        self.__ordered_rows = array("I")
+        # 串号严格递增时以二分查找定位，否则退化为字典
+        self.__positions: Optional[Dict[int, int]] = None
+
+    @staticmethod
+    def load_from_dump_folder(path: Path, page_info_list: List[PageInfo]) -> PostStore:
+        """
+        从转存文件夹直接构建，不经过 `Thread`，因此不会同时持有所有 `Post`。
+        """
+        with open(path / "thread.json", "rb") as thread_file:
+            thread_object = decode_json(thread_file.read())
+        store = PostStore(thread_id=thread_object["id"])
+        store.append_object(thread_object, page_number=1)
+        for (page_info, page_object) in Thread.iterate_page_objects(path, page_info_list):
+            for post_object in page_object:
+                store.append_object(post_object, page_info.number)
+        return store
+
+    def append_object(self, obj: Dict[str, Any], page_number: int):
+        """
+        添加转存文件中的一个回应，经由 `Post.normalize_object` 整理。
+        """
+        fields = Post.normalize_object(obj)
+        post_id = fields["id"]
+        row = len(self.__ids)
+
+        self.__ids.append(post_id)
+        self.__page_numbers.append(page_number)
+        flags = 0
+        if fields["is_sage"]:
+            flags |= PostStore.FLAG_SAGE
+        if fields["is_admin"]:
+            flags |= PostStore.FLAG_ADMIN
+        self.__flags.append(flags)
+        self.__created_at.append(
+            self.__encode_created_at(row, fields["created_at"]))
+        self.__user_ids.append(fields["user_id"])
+        self.__names.append(fields["name"])
+        self.__emails.append(fields["email"])
+        self.__titles.append(fields["title"])
+        if fields["adnmb_img"] != None or fields["adnmb_ext"] != None:
+            self.__attachments[row] = (fields["adnmb_img"], fields["adnmb_ext"])
+        self.__content += fields["content"].encode("utf-8")
+        self.__content_offsets.append(len(self.__content))
+
+        self.__place(post_id, row)
+
+    @property
+    def row_count(self) -> int:
+        """
+        已添加的回应数，包括重复出现的串号。
+        """
+        return len(self.__ids)
+
+    def truncate(self, row_count: int):
+        """
+        只保留最先添加的 `row_count` 个回应，之后可以继续添加。
+        用于在快照中替换最后几页。
+        """
+        for column in (self.__ids, self.__page_numbers, self.__flags, self.__created_at,
+                       self.__user_ids.rows, self.__names.rows, self.__emails.rows, self.__titles.rows):
+            del column[row_count:]
+        for sparse_column in (self.__raw_created_at, self.__attachments):
+            for row in [row for row in sparse_column.keys() if row >= row_count]:
+                del sparse_column[row]
+        del self.__content[self.__content_offsets[row_count]:]
+        del self.__content_offsets[row_count + 1:]
+
+        # 串号重复出现时位置与内容来自不同的行，因此重新排列剩下的各行
+        self.__ordered_ids = array("q")
+        self.__ordered_rows = array("I")
+        self.__positions = None
+        for (row, post_id) in enumerate(self.__ids):
+            self.__place(post_id, row)
+
+    @property
+    def post_ids_are_sorted(self) -> bool:
+        """
+        按遍历顺序排列的串号是否严格递增。
+        """
+        return self.__positions == None
+
+    def __place(self, post_id: int, row: int):
+        if self.__positions == None:
+            if len(self.__ordered_ids) == 0 or post_id > self.__ordered_ids[-1]:
+                self.__ordered_ids.append(post_id)
+                self.__ordered_rows.append(row)
+                return
+            position = self.__bisect(post_id)
+            if position != None:
+                self.__ordered_rows[position] = row
+                return
+            # 串号乱序，改用字典定位
+            self.__positions = dict(
+                map(lambda item: (item[1], item[0]), enumerate(self.__ordered_ids)))
+
+        position = self.__positions.get(post_id, None)
+        if position != None:
+            self.__ordered_rows[position] = row
+        else:
+            self.__positions[post_id] = len(self.__ordered_ids)
+            self.__ordered_ids.append(post_id)
+            self.__ordered_rows.append(row)
+
+    def __bisect(self, post_id: int) -> Optional[int]:
+        position = bisect_left(self.__ordered_ids, post_id)
+        if position < len(self.__ordered_ids) and self.__ordered_ids[position] == post_id:
+            return position
+        return None
+
+    def __row_of(self, post_id: int) -> Optional[int]:
+        if self.__positions == None:
+            position = self.__bisect(post_id)
+        else:
+            position = self.__positions.get(post_id, None)
+        if position == None:
+            return None
+        return self.__ordered_rows[position]
+
+    def __encode_created_at(self, row: int, now: str) -> int:
+        # 同一天的回应很多，日期部分只在第一次遇到时解析
+        day_text = now[:13]
+        if day_text not in self.__day_timestamps:
+            self.__parse_day(day_text)
+        day = self.__day_timestamps[day_text]
+        if day != None and len(now) == 21 and now[15] == ":" and now[18] == ":":
+            try:
+                (hour, minute, second) = (
+                    int(now[13:15]), int(now[16:18]), int(now[19:21]))
+            except ValueError:
+                hour = None
+            if hour != None and 0 <= hour < 24 and 0 <= minute < 60 and 0 <= second < 60:
+                timestamp = day + hour * 3600 + minute * 60 + second
+                if self.__decode_created_at(timestamp) == now:
+                    return timestamp
+        self.__raw_created_at[row] = now
+        return PostStore.RAW_CREATED_AT
+
+    def __parse_day(self, day_text: str):
+        """
+        记录日期部分（如 `2020-08-15(六)`）对应的时间戳，无法还原时记为空。
+        """
+        day = None
+        m = PostStore.DAY_PATTERN.match(day_text)
+        if m != None:
+            (year, month, day_of_month) = map(int, m.groups())
+            try:
+                timestamp = calendar.timegm(
+                    (year, month, day_of_month, 0, 0, 0))
+                if PostStore.__format_day(timestamp) == day_text:
+                    day = timestamp
+                    self.__day_texts[timestamp] = day_text
+            except (ValueError, OverflowError):
+                pass
+        self.__day_timestamps[day_text] = day
+
+    def __decode_created_at(self, timestamp: int) -> str:
+        (day, seconds) = divmod(timestamp, 86400)
+        day_text = self.__day_texts[day * 86400]
+        (hour, seconds) = divmod(seconds, 3600)
+        (minute, second) = divmod(seconds, 60)
+        return f"{day_text}{hour:02d}:{minute:02d}:{second:02d}"
+
+    @staticmethod
+    def __format_day(timestamp: int) -> str:
+        t = time.gmtime(timestamp)
+        return f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}({PostStore.WEEKDAYS[t.tm_wday]})"
+
+    def content_of(self, post_id: int) -> str:
+        """
+        只解码某个回应的正文，而不构建整个 `Post`。
+        """
+        row = self.__row_of(post_id)
+        if row == None:
+            raise KeyError(post_id)
+        return self.__content_at(row)
+
+    def user_id_of(self, post_id: int) -> str:
+        """
+        只取出某个回应的饼干，而不构建整个 `Post`。
+        """
+        row = self.__row_of(post_id)
+        if row == None:
+            raise KeyError(post_id)
+        return self.__user_ids.get(row)
+
+    def __content_at(self, row: int) -> str:
+        start = self.__content_offsets[row]
+        end = self.__content_offsets[row + 1]
+        return self.__content[start:end].decode("utf-8")
+
+    def __getitem__(self, post_id: int) -> Post:
+        row = self.__row_of(post_id)
+        if row == None:
+            raise KeyError(post_id)
+
+        timestamp = self.__created_at[row]
+        if timestamp == PostStore.RAW_CREATED_AT:
+            now = self.__raw_created_at[row]
+        else:
+            now = self.__decode_created_at(timestamp)
+        flags = self.__flags[row]
+        (adnmb_img, adnmb_ext) = self.__attachments.get(row, (None, None))
+
+        return Post(
+            id=self.__ids[row], created_at=Post.AdnmbTime(now=now),
+            user_id=self.__user_ids.get(row), name=self.__names.get(row),
+            email=self.__emails.get(row), title=self.__titles.get(row),
+            content=self.__content_at(row),
+            is_sage=flags & PostStore.FLAG_SAGE != 0,
+            is_admin=flags & PostStore.FLAG_ADMIN != 0,
+            adnmb_img=adnmb_img, adnmb_ext=adnmb_ext,
+
+            thread_id=self.thread_id,
+            page_number=self.__page_numbers[row],
+        )
+
+    def __contains__(self, post_id: Any) -> bool:
+        if not isinstance(post_id, int):
+            return False
+        return self.__row_of(post_id) != None
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.__ordered_ids)
+
+    def __len__(self) -> int:
+        return len(self.__ordered_ids)
@@ -0,0 +1,164 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, Any
+
+import logging
+from pathlib import Path
+import os
+import pickle
+import struct
+
+from .thread import Thread, Post, decode_json
+from .poststore import PostStore
+from .trace import PageInfo
+
+import sys
+sys.path.append(str(Path(__file__).parent.parent.parent / "commons"))
+from packeddump import PackedPageStore  # noqa: E402
+
+
+@dataclass
+class PostStoreSnapshot:
+    """
+    已读取的 `PostStore` 的快照，存于输出文件夹旁的缓存文件夹中，供下次渲染时使用。
+
+    以 `thread.json` 与各页的指纹判断快照是否仍然可用：
+    逐页存放时指纹为文件大小、修改时间与页面状态，打包格式时为记录的位置、内容的 CRC32 与页面状态。
+    只有末尾几页变化时，截去快照中这几页的回应后重新读取；
+    全部未变化时（如只修改了切割规则配置），完全不需要解析页面的 JSON。
+    """
+
+    FILE_NAME = ".post-store.snapshot"
+    MAGIC = b"ANOBBS-POST-STORE"
+    # `PostStore` 的内部结构有变化时需要增加版本号
+    VERSION = 1
+    HEADER = struct.Struct(f"<{len(MAGIC)}sI")
+
+    thread_fingerprint: Tuple[Any, ...]
+    page_fingerprints: List[Tuple[Any, ...]]
+    page_row_counts: List[int]
+    """读入各页后 `PostStore` 的行数。"""
+    store: PostStore
+
+    @staticmethod
+    def load(file_path: Path) -> Optional[PostStoreSnapshot]:
+        """
+        Returns
+        -------
+        Optional[PostStoreSnapshot]
+            快照不存在、版本不符或无法读取时为空。
+        """
+        try:
+            with open(file_path, "rb") as snapshot_file:
+                header = snapshot_file.read(PostStoreSnapshot.HEADER.size)
+                if len(header) != PostStoreSnapshot.HEADER.size:
+                    return None
+                (magic, version) = PostStoreSnapshot.HEADER.unpack(header)
+                if magic != PostStoreSnapshot.MAGIC or version != PostStoreSnapshot.VERSION:
+                    logging.info("快照的版本不符，将不会使用")
+                    return None
+                snapshot = pickle.load(snapshot_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"无法读取快照，将不会使用：{e}")
+            return None
+        if not isinstance(snapshot, PostStoreSnapshot):
+            return None
+        return snapshot
+
+    def save(self, file_path: Path):
+        tmp_file_path = file_path.parent / f"_{file_path.name}"
+        with open(tmp_file_path, "wb") as snapshot_file:
+            snapshot_file.write(PostStoreSnapshot.HEADER.pack(
+                PostStoreSnapshot.MAGIC, PostStoreSnapshot.VERSION))
+            pickle.dump(self, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file_path, file_path)
+
+    @staticmethod
+    def build(
+        path: Path, page_info_list: List[PageInfo],
+        previous: Optional[PostStoreSnapshot] = None,
+    ) -> PostStoreSnapshot:
+        """
+        读取转存文件夹，尽可能沿用 `previous` 中未变化的部分。
+        """
+        thread_file_path = path / "thread.json"
+        thread_fingerprint = PostStoreSnapshot.__file_fingerprint(
+            thread_file_path)
+        page_fingerprints = PostStoreSnapshot.page_fingerprints_of(
+            path, page_info_list)
+
+        if previous != None and previous.thread_fingerprint != thread_fingerprint:
+            # 转存时每轮都会重写 `thread.json`，但串本身的内容通常不变
+            with open(thread_file_path, "rb") as thread_file:
+                thread_object = decode_json(thread_file.read())
+            thread_id = thread_object["id"]
+            body = Post.load_from_object(
+                thread_object, thread_id=thread_id, page_number=1)
+            if previous.store.thread_id != thread_id or previous.store.get(body.id, None) != body:
+                previous = None
+
+        if previous == None:
+            kept_page_count = 0
+            store = None
+        else:
+            kept_page_count = 0
+            for (old, new) in zip(previous.page_fingerprints, page_fingerprints):
+                if old != new:
+                    break
+                kept_page_count += 1
+            store = previous.store
+            page_row_counts = previous.page_row_counts[:kept_page_count]
+            store.truncate(
+                page_row_counts[-1] if kept_page_count > 0 else 1)
+
+        if store == None:
+            with open(thread_file_path, "rb") as thread_file:
+                thread_object = decode_json(thread_file.read())
+            store = PostStore(thread_id=thread_object["id"])
+            store.append_object(thread_object, page_number=1)
+            page_row_counts = []
+
+        if kept_page_count > 0:
+            logging.info(
+                f"快照中前{kept_page_count}页未变化，读取其余{len(page_info_list) - kept_page_count}页")
+        for (page_info, page_object) in Thread.iterate_page_objects(path, page_info_list[kept_page_count:]):
+            for post_object in page_object:
+                store.append_object(post_object, page_info.number)
+            page_row_counts.append(store.row_count)
+
+        return PostStoreSnapshot(
+            thread_fingerprint=thread_fingerprint,
+            page_fingerprints=page_fingerprints,
+            page_row_counts=page_row_counts,
+            store=store,
+        )
+
+    @staticmethod
+    def page_fingerprints_of(path: Path, page_info_list: List[PageInfo]) -> List[Tuple[Any, ...]]:
+        if PackedPageStore.exists(path):
+            # 打包格式中页面有变化时总会追加新的记录，但整理后记录的位置会被重新分配，
+            # 因此还需加上记录内容的 CRC32
+            with PackedPageStore.open(path, read_only=True) as store:
+                fingerprints = []
+                for page_info in page_info_list:
+                    location = store.get_location(page_info.number)
+                    fingerprints.append((
+                        page_info.number, page_info.status.name,
+                        location.segment_number, location.offset, location.length,
+                        store.read_page_crc32(page_info.number),
+                    ))
+                return fingerprints
+
+        pages_folder_path = str(path / "pages")
+        return list(map(lambda page_info: (
+            page_info.number, page_info.status.name,
+            *PostStoreSnapshot.__file_fingerprint(
+                os.path.join(pages_folder_path, page_info.filename())),
+        ), page_info_list))
+
+    @staticmethod
+    def __file_fingerprint(file_path: os.PathLike) -> Tuple[int, int]:
+        stat = os.stat(file_path)
+        return (stat.st_size, stat.st_mtime_ns)
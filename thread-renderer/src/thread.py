@@ -1,16 +1,35 @@
 #!/usr/bin/env python3
 
 from __future__ import annotations
-from typing import Dict, List, OrderedDict, Optional, Any, Tuple, Union, Set
+from typing import Dict, List, OrderedDict, Optional, Any, Tuple, Union, Set, Iterator
 from dataclasses import dataclass
 
 from pathlib import Path
+import os
 import json
 from os.path import splitext
 import logging
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from .trace import PageInfo
 
+import sys
+sys.path.append(str(Path(__file__).parent.parent.parent / "commons"))
+from packeddump import PackedPageStore  # noqa: E402
+
+
+def decode_json(data: Union[bytes, memoryview]) -> Any:
+    """
+    解码 JSON。安装了 orjson 时使用 orjson，否则使用标准库。
+    """
+    if orjson != None:
+        return orjson.loads(data)
+    return json.loads(bytes(data))
+
 
 @dataclass(frozen=True)
 class Thread:
@@ -21,8 +40,8 @@ class Thread:
     @staticmethod
     def load_from_dump_folder(path: Path, page_info_list: List[PageInfo]) -> Thread:
         thread_id = None
-        with open(path / "thread.json") as thread_file:
-            thread_object = json.load(thread_file)
+        with open(path / "thread.json", "rb") as thread_file:
+            thread_object = decode_json(thread_file.read())
             thread_id = thread_object["id"]
             body = Post.load_from_object(
                 thread_object,
@@ -31,25 +50,41 @@ class Thread:
             )
 
         pages = []
-        for page_info in page_info_list:
-            with open(path / "pages" / page_info.filename()) as page_file:
-                page_object = json.load(page_file)
-                page = list(map(
-                    lambda post_object:
-                    Post.load_from_object(
-                        post_object,
-                        thread_id=thread_id,
-                        page_number=page_info.number,
-                    ),
-                    page_object,
-                ))
-                pages.append(page)
+        for (page_info, page_object) in Thread.iterate_page_objects(path, page_info_list):
+            pages.append(Post.load_from_objects(
+                page_object, thread_id, page_info.number))
 
         return Thread(
             body=body,
             pages=pages,
         )
 
+    @staticmethod
+    def iterate_page_objects(
+        path: Path, page_info_list: List[PageInfo],
+    ) -> Iterator[Tuple[PageInfo, List[Any]]]:
+        """
+        依次读取转存文件夹中各页的回应，得到尚未构建为 `Post` 的原始对象。
+        """
+        if PackedPageStore.exists(path):
+            # 打包格式：各页记录通过 mmap 依次读取
+            with PackedPageStore.open(path, read_only=True) as store:
+                for page_info in page_info_list:
+                    page_bytes = store.read_page_bytes(page_info.number)
+                    try:
+                        yield (page_info, decode_json(page_bytes))
+                    finally:
+                        page_bytes.release()
+            return
+
+        pages_folder_path = str(path / "pages")
+
+        def load_page_object(page_info: PageInfo) -> List[Any]:
+            with open(os.path.join(pages_folder_path, page_info.filename()), "rb") as page_file:
+                return decode_json(page_file.read())
+
+        yield from zip(page_info_list, map(load_page_object, page_info_list))
+
     def flattened_post_dict(self) -> OrderedDict[int, Post]:
         posts = OrderedDict()
 
@@ -82,41 +117,61 @@ class Post:
     class AdnmbTime:
         now: str
 
+    @staticmethod
+    def normalize_object(obj: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        整理转存文件中的一个回应对象，得到以 `Post` 的字段名为键的各值：
+        空的名称、邮箱、附件为 `None`，标题「无标题」为 `None`，`sage` 与 `admin` 为布尔值。
+        `created_at` 为原始的 `now` 文本，不包括 `thread_id` 与 `page_number`。
+
+        `load_from_object`、`load_from_objects` 与 `PostStore.append_object` 都经由此处，
+        以保证各处的整理规则一致。
+        """
+        title = obj["title"]
+        return {
+            "id": int(obj["id"]), "created_at": obj["now"],
+            "user_id": obj["userid"], "name": obj["name"] or None,
+            "email": obj["email"] or None,
+            "title": None if title == "无标题" else title,
+            "content": obj["content"],
+            "is_sage": int(obj["sage"]) != 0, "is_admin": int(obj["admin"]) != 0,
+            "adnmb_img": obj["img"] or None, "adnmb_ext": obj["ext"] or None,
+        }
+
     @staticmethod
     def load_from_object(
             obj: Dict[Any],
             thread_id: int, page_number: int) -> Post:
 
-        id = int(obj["id"])
-        created_at = Post.AdnmbTime(now=obj["now"])
-        user_id = obj["userid"]
-        name = obj["name"]
-        if name == "":
-            name = None
-        email = obj["email"]
-        if email == "":
-            email = None
-        title = obj["title"]
-        if title == "无标题":
-            title = None
-        content = obj["content"]
-        is_sage = int(obj["sage"]) != 0
-        is_admin = int(obj["admin"]) != 0
-        adnmb_img = obj["img"]
-        if adnmb_img == "":
-            adnmb_img = None
-        adnmb_ext = obj["ext"]
-        if adnmb_ext == "":
-            adnmb_ext = None
-
+        fields = Post.normalize_object(obj)
+        fields["created_at"] = Post.AdnmbTime(now=fields["created_at"])
         return Post(
-            id=id, created_at=created_at,
-            user_id=user_id, name=name,
-            email=email, title=title,
-            content=content,
-            is_sage=is_sage, is_admin=is_admin,
-            adnmb_img=adnmb_img, adnmb_ext=adnmb_ext,
-
+            **fields,
             thread_id=thread_id,
             page_number=page_number,
         )
+
+    @staticmethod
+    def load_from_objects(
+            objs: List[Dict[Any]],
+            thread_id: int, page_number: int) -> List[Post]:
+        """
+        批量构建同一页的回应，结果与逐个调用 `load_from_object` 相同。
+
+        大串的渲染时间主要花在这里，因此绕过冻结数据类较慢的 `__init__`，
+        直接以 `normalize_object` 的结果填充各回应的 `__dict__`。
+        """
+
+        new = object.__new__
+        posts = []
+        for obj in objs:
+            fields = Post.normalize_object(obj)
+            created_at = new(Post.AdnmbTime)
+            created_at.__dict__["now"] = fields["created_at"]
+            fields["created_at"] = created_at
+            fields["thread_id"] = thread_id
+            fields["page_number"] = page_number
+            post = new(Post)
+            post.__dict__.update(fields)
+            posts.append(post)
+        return posts
@@ -34,11 +34,14 @@ class Trace:
         dump_folder_path: Path,
         page_info_list: List[PageInfo]
     ) -> Trace:
-        last_page_filename = page_info_list[-1].filename()
-        last_page_file_path = dump_folder_path / "pages" / last_page_filename
-        with open(last_page_file_path) as last_page_file:
-            last_page = json.load(last_page_file)
-            last_dumped_post_id = int(last_page[-1]["id"])
+        # 页面清单中有记录时，无需读取最后一页
+        last_dumped_post_id = page_info_list[-1].last_post_id
+        if last_dumped_post_id == None:
+            last_page_filename = page_info_list[-1].filename()
+            last_page_file_path = dump_folder_path / "pages" / last_page_filename
+            with open(last_page_file_path) as last_page_file:
+                last_page = json.load(last_page_file)
+                last_dumped_post_id = int(last_page[-1]["id"])
         with open(div_cfg_path, 'rb') as div_cfg_file:
             h = sha1()
             while True:
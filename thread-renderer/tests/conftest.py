@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 与各脚本相同，以 `src.*` 导入 thread-renderer 中的模块
+sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -0,0 +1,47 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent / "commons"))
+from dumpedpages import PageInfo, PageManifest  # noqa: E402
+
+
+def write_page(pages_folder_path, number, first_id, count):
+    replies = [{"id": str(first_id + i)} for i in range(count)]
+    with open(pages_folder_path / f"{number}.json", "w") as page_file:
+        json.dump(replies, page_file)
+
+
+def make_dump_folder(dump_folder_path):
+    pages_folder_path = dump_folder_path / "pages"
+    pages_folder_path.mkdir()
+    for number in [1, 2, 3]:
+        write_page(pages_folder_path, number, number * 100, 3)
+    PageManifest.rebuild(dump_folder_path, examines_pages=True).save()
+    return pages_folder_path
+
+
+def test_manifest_rechecks_page_rewritten_in_place(tmp_path):
+    pages_folder_path = make_dump_folder(tmp_path)
+    folder_mtime_ns = os.stat(pages_folder_path).st_mtime_ns
+
+    # 原地改写页面文件不会改变文件夹的修改时间
+    write_page(pages_folder_path, 2, 250, 5)
+    os.utime(pages_folder_path, ns=(folder_mtime_ns, folder_mtime_ns))
+
+    manifest = PageManifest.load(tmp_path, examines_pages=True)
+    assert manifest.get(2) == PageInfo(
+        2, PageInfo.Status.COMPLETE, first_post_id=250, last_post_id=254, reply_count=5)
+    assert manifest.get(1).last_post_id == 102
+
+
+def test_manifest_keeps_recorded_ranges_without_examining(tmp_path):
+    pages_folder_path = make_dump_folder(tmp_path)
+    os.remove(pages_folder_path / "3.json")
+    write_page(pages_folder_path, 4, 400, 1)
+
+    manifest = PageManifest.load(tmp_path)
+    assert [page_info.number for page_info in manifest.page_info_list()] == [1, 2, 4]
+    assert manifest.get(2).reply_count == 3
+    assert manifest.get(4).reply_count == None
@@ -0,0 +1,95 @@
+import io
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent.parent / "commons"))
+from dumpedpages import PageInfo  # noqa: E402
+from packeddump import PackedPageStore  # noqa: E402
+
+
+def make_page(number, first_id, count):
+    replies = [{"id": str(first_id + i), "content": f"第{number}页"}
+               for i in range(count)]
+    return (PageInfo.from_replies(number, PageInfo.Status.COMPLETE, replies),
+            PackedPageStore.encode_page(replies))
+
+
+def crash_while_appending(dump_folder_path):
+    """
+    追加两页后，模拟第三页的记录只写入一半、索引也未更新时程序退出的情况。
+    """
+    with PackedPageStore.create(dump_folder_path) as store:
+        store.append_pages([make_page(1, 100, 3), make_page(2, 200, 3)])
+    segment_path = store.segment_path(0)
+    complete_size = segment_path.stat().st_size
+
+    (page_info, page_bytes) = make_page(3, 300, 3)
+    with open(segment_path, "ab") as segment_file:
+        segment_file.write(PackedPageStore.RECORD_HEADER.pack(
+            PackedPageStore.RECORD_MAGIC, page_info.status.value,
+            page_info.number, len(page_bytes), 0)[:8])
+    return (segment_path, complete_size)
+
+
+def test_read_only_open_ignores_incomplete_tail(tmp_path):
+    (segment_path, complete_size) = crash_while_appending(tmp_path)
+    index_mtime = os.stat(tmp_path / "packed" / "index.json").st_mtime_ns
+    size = segment_path.stat().st_size
+
+    with PackedPageStore.open(tmp_path, read_only=True) as store:
+        assert [page_info.number for page_info in store.page_info_list()] == [1, 2]
+        assert store.read_page_replies(store.get(2))[0]["id"] == "200"
+        with pytest.raises(io.UnsupportedOperation):
+            store.save()
+
+    assert segment_path.stat().st_size == size > complete_size
+    assert os.stat(tmp_path / "packed" / "index.json").st_mtime_ns == index_mtime
+
+
+def test_writer_open_recovers_crash_truncated_segment(tmp_path):
+    (segment_path, complete_size) = crash_while_appending(tmp_path)
+
+    with PackedPageStore.open(tmp_path) as store:
+        assert [page_info.number for page_info in store.page_info_list()] == [1, 2]
+        store.append_pages([make_page(3, 300, 2)])
+    assert segment_path.stat().st_size > complete_size
+
+    with PackedPageStore.open(tmp_path, read_only=True) as store:
+        assert [page_info.number for page_info in store.page_info_list()] == [1, 2, 3]
+        assert [reply["id"] for reply in store.read_page_replies(store.get(3))] == ["300", "301"]
+
+
+def test_index_beyond_segment_end_is_rebuilt(tmp_path):
+    with PackedPageStore.create(tmp_path) as store:
+        store.append_pages([make_page(1, 100, 3), make_page(2, 200, 3)])
+    # 分段被截到只剩第一页，但索引仍记录着第二页
+    os.truncate(store.segment_path(0), store.get_location(2).offset)
+
+    for read_only in [True, False]:
+        with PackedPageStore.open(tmp_path, read_only=read_only) as store:
+            assert [page_info.number for page_info in store.page_info_list()] == [1]
+            assert store.read_page_replies(store.get(1))[0]["id"] == "100"
+
+
+def test_snapshot_fingerprint_changes_after_compaction(tmp_path):
+    from src.snapshot import PostStoreSnapshot
+
+    replies = [{"id": "100", "content": "甲"}]
+    page_info = PageInfo.from_replies(1, PageInfo.Status.COMPLETE, replies)
+    with PackedPageStore.create(tmp_path) as store:
+        store.append_pages([(page_info, PackedPageStore.encode_page(replies))])
+    page_info_list = [page_info]
+    before = PostStoreSnapshot.page_fingerprints_of(tmp_path, page_info_list)
+
+    # 内容长度相同的新记录在整理后会回到旧记录的位置
+    replies[0]["content"] = "乙"
+    with PackedPageStore.open(tmp_path) as store:
+        store.append_pages([(page_info, PackedPageStore.encode_page(replies))])
+        store.compact()
+        assert store.get_location(1).offset == 0
+    after = PostStoreSnapshot.page_fingerprints_of(tmp_path, page_info_list)
+
+    assert before != after
@@ -0,0 +1,117 @@
+import io
+import logging
+import filecmp
+from pathlib import Path
+
+import yaml
+
+from src.thread import Post
+from src.configloader import DivisionsConfiguration
+from src.divisiontree import TreeBuilder
+from src.generating import OutputsGenerator, RenderCache
+
+QUOTE_LINK = '<font color="#789922">&gt;&gt;No.{}</font>'
+
+
+def make_post_pool():
+    post_pool = {}
+    for i in range(60):
+        post_id = 1000 + i
+        content = f"第{i}楼<br />\r\n"
+        if i >= 2:
+            content += QUOTE_LINK.format(post_id - 2) + "<br />\r\n"
+        content += QUOTE_LINK.format(5)
+        post_pool[post_id] = Post(
+            id=post_id, created_at=Post.AdnmbTime(now=f"2020-01-01(三)00:00:{i:02d}"),
+            user_id="PO" if i % 3 == 0 else f"U{i}", name=None, email=None, title=None,
+            content=content, is_sage=False, is_admin=False,
+            adnmb_img=None, adnmb_ext=None,
+            thread_id=1000, page_number=1 + i // 19,
+        )
+    return post_pool
+
+
+def make_divisions_configuration():
+    """
+    「合集」与「再合集」两个收集节点都会收集「分卷」下的 FILE 节点，
+    因此这些 FILE 节点在树中出现不止一次。
+    """
+    obj = {
+        "title": "测试",
+        "po": ["PO"],
+        "divisions": [
+            {"title": "合集", "division-type": "file",
+             "collect": {"parent-title-matches": "分卷"}},
+            {"title": "再合集", "collect": {"parent-title-matches": "分卷"}},
+            {"title": "分卷", "children": [
+                {"title": "第一卷", "division-type": "file", "until": {"id": 1015},
+                 "children": [{"title": "上", "until": {"id": 1008}}]},
+                {"title": "第二卷", "division-type": "file", "until": {"id": 1030},
+                 "children": [
+                     {"title": "子卷", "division-type": "file", "until": {"id": 1022}},
+                ]},
+            ]},
+            {"title": "其余", "division-type": "file",
+             "children": [{"title": "余下", "until": {"id": 1045}}]},
+        ],
+    }
+    return DivisionsConfiguration.load(io.StringIO(yaml.safe_dump(obj)), root_folder_path=".")
+
+
+def generate(output_folder_path: Path, worker_count: int, render_cache=None):
+    post_pool = make_post_pool()
+    div_cfg = make_divisions_configuration()
+    (tree, post_claims) = TreeBuilder.build_tree(
+        post_pool=post_pool, div_cfg=div_cfg)
+    output_folder_path.mkdir()
+    OutputsGenerator.generate_outputs(
+        output_folder_path=output_folder_path,
+        post_pool=post_pool,
+        div_cfg=div_cfg,
+        div_cfg_folder_path=Path("."),
+        division_tree=tree,
+        post_claims=post_claims,
+        render_cache=render_cache,
+        worker_count=worker_count,
+    )
+
+
+def assert_same_outputs(a: Path, b: Path):
+    comparison = filecmp.dircmp(a, b)
+    assert comparison.left_only == [] and comparison.right_only == []
+    (_, mismatch, errors) = filecmp.cmpfiles(
+        a, b, comparison.common_files, shallow=False)
+    assert mismatch == [] and errors == []
+
+
+def test_parallel_outputs_match_serial_with_shared_file_nodes(tmp_path: Path, caplog):
+    generate(tmp_path / "serial", worker_count=1)
+    with caplog.at_level(logging.INFO):
+        generate(tmp_path / "parallel", worker_count=3)
+
+    file_names = sorted(map(lambda p: p.name, (tmp_path / "serial").iterdir()))
+    assert file_names == sorted([
+        "README.md", "合集.md", "其余.md",
+        "分卷·第一卷.md", "分卷·第二卷.md", "分卷·第二卷·子卷.md",
+    ])
+    # 被收集的 FILE 节点出现多次，但每个文件只交给一个工作进程生成
+    assert f"以3个工作进程生成{len(file_names)}个文件" in caplog.text
+    assert_same_outputs(tmp_path / "serial", tmp_path / "parallel")
+
+
+def test_parallel_merges_render_cache(tmp_path: Path):
+    serial_cache = RenderCache()
+    generate(tmp_path / "serial", worker_count=1, render_cache=serial_cache)
+    parallel_cache = RenderCache()
+    generate(tmp_path / "parallel", worker_count=3,
+             render_cache=parallel_cache)
+
+    serial_cache.save(tmp_path / "serial.cache")
+    parallel_cache.save(tmp_path / "parallel.cache")
+    assert serial_cache.hit_count == parallel_cache.hit_count == 0
+    assert parallel_cache.miss_count > 0
+
+    cached_cache = RenderCache.load(tmp_path / "parallel.cache")
+    generate(tmp_path / "cached", worker_count=3, render_cache=cached_cache)
+    assert cached_cache.miss_count == 0
+    assert_same_outputs(tmp_path / "serial", tmp_path / "cached")
@@ -0,0 +1,59 @@
+from src.thread import Post
+from src.poststore import PostStore
+
+
+def make_object(**overrides):
+    obj = {
+        "id": "1001", "now": "2020-01-01(三)12:34:56", "userid": "ABCDEFG",
+        "name": "无名氏", "email": "", "title": "无标题",
+        "content": "内容<br />\r\n第二行", "sage": "0", "admin": "0",
+        "img": "", "ext": "",
+    }
+    obj.update(overrides)
+    return obj
+
+
+EDGE_CASE_OBJECTS = [
+    make_object(),
+    make_object(id="1002", name="", email="", img="", ext=""),
+    make_object(id="1003", name="名称", email="sage@example.com",
+                title="有标题", sage="1", admin="1"),
+    make_object(id=1004, sage=0, admin=1, img="2020-01-01/abc", ext=".png"),
+    make_object(id="1005", img="2020-01-01/def", ext=""),
+    make_object(id="1006", title="", content=""),
+    make_object(id="1007", now="某个无法解析的时间"),
+]
+
+
+def test_load_from_objects_matches_load_from_object():
+    posts = Post.load_from_objects(
+        EDGE_CASE_OBJECTS, thread_id=1000, page_number=2)
+    expected = list(map(lambda obj: Post.load_from_object(
+        obj, thread_id=1000, page_number=2), EDGE_CASE_OBJECTS))
+
+    assert posts == expected
+
+
+def test_normalization():
+    [plain, empty, full, numeric, img_only, untitled, _] = list(map(
+        lambda obj: Post.load_from_object(obj, thread_id=1000, page_number=2),
+        EDGE_CASE_OBJECTS))
+
+    assert plain.title == None and plain.email == None
+    assert plain.is_sage == False and plain.is_admin == False
+    assert plain.adnmb_img == None and plain.adnmb_ext == None
+    assert empty.name == None
+    assert full.title == "有标题" and full.is_sage and full.is_admin
+    assert numeric.id == 1004 and not numeric.is_sage and numeric.is_admin
+    assert (img_only.adnmb_img, img_only.adnmb_ext) == ("2020-01-01/def", None)
+    assert untitled.title == ""
+
+
+def test_post_store_matches_load_from_object():
+    store = PostStore(thread_id=1000)
+    for obj in EDGE_CASE_OBJECTS:
+        store.append_object(obj, page_number=2)
+
+    assert list(map(lambda obj: store[int(obj["id"])], EDGE_CASE_OBJECTS)) == \
+        list(map(lambda obj: Post.load_from_object(
+            obj, thread_id=1000, page_number=2), EDGE_CASE_OBJECTS))